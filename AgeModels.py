@@ -0,0 +1,296 @@
+################################################################################
+###                               AGEMODELS.py                               ###
+#     210Pb age models computed downstream of PbTools.counts_to_activity:      #
+#        CRS (constant rate of supply), CIC (constant initial concentration)   #
+#        and CF:CS (constant flux, constant sedimentation) for whole batches   #
+#        of cores at once. Cores are told apart by their "CoreID" column.      #
+#        fit_sedimentation_rates adds weighted CF:CS fits with a surface-      #
+#        mixed-layer search and bootstrap confidence intervals.                #
+###                                                                          ###
+################################################################################
+
+import numpy as np
+import pandas as pd
+
+import PbTools
+
+# decay constant of 210Pb, in yr^-1 (same value as PbTools.λ_210Pb_min)
+λ_210Pb_yr = PbTools.λ_210Pb_min * 60 * 24 * 365.25
+
+# columns of the counts_to_activity table used by the age models
+C_XS = "C_i excess at collection, salt+mud correction (dpm/g)"
+RHO_DRY = "ρ_bulk_dry (g/cm3)"
+Z_MID = "Z_midpt (cm)"
+DZ = "ΔZ (cm)"
+
+
+################################################################################
+###                                AGE_MODELS                                ###
+#  Cumulative mass depth and 210Pb inventories (segmented prefix sums over     #
+#  every core at once), then CRS and CIC ages and CF:CS rates per interval.    #
+#
+#                                    INPUTS:
+#  INPUT #1: table returned by counts_to_activity(_batch); rows of one core do
+#            not need to be adjacent or sorted
+#  INPUT #2: core_col, the column that names each core (if it is missing the
+#            whole table is treated as one core)
+#
+#                                   RETURNS:
+#  INPUT #1 (same row order) plus the columns
+#     M_cum (g/cm2)	..........  cumulative dry mass above the interval midpoint
+#     I_i (dpm/cm2)	..........  excess 210Pb inventory of the interval
+#     I_below (dpm/cm2)	......  excess inventory below the interval midpoint
+#     I_total (dpm/cm2)	......  excess inventory of the whole core
+#     Age_CRS (yr)	..........  ln(I_total / I_below) / λ
+#     MAR_CRS (g/cm2/yr)	......  λ I_below / C_xs
+#     Age_CIC (yr)	..........  ln(C_xs at the top of the core / C_xs) / λ
+#     S_CFCS (cm/yr)	..........  -λ / slope of ln(C_xs) against depth
+#     MAR_CFCS (g/cm2/yr)	......  -λ / slope of ln(C_xs) against mass depth
+#     Age_CFCS (yr)	..........  Z_midpt / S_CFCS
+#
+#  Negative excess activities count as zero inventory and are left out of the
+#  CF:CS fits. CRS ages assume the core holds its complete excess inventory;
+#  below the last interval with excess 210Pb they are undefined (NaN).
+###                                                                          ###
+################################################################################
+
+
+def age_models(act, core_col="CoreID"):
+    n = len(act)
+    cores = act[core_col] if core_col in act else pd.Series(np.zeros(n))
+    core, order = _core_order(cores, act[Z_MID])
+
+    # work on the rows sorted by (core, depth)
+    C = np.asarray(act[C_XS], dtype=float)[order]
+    z = np.asarray(act[Z_MID], dtype=float)[order]
+    mass = np.asarray(act[RHO_DRY], dtype=float)[order] * np.asarray(act[DZ], dtype=float)[order]
+    inventory = np.clip(C, 0, None) * mass
+
+    # prefix sums within each core: mass and inventory above the interval top
+    mass_top = _segment_cumsum(mass, core) - mass
+    inv_top = _segment_cumsum(inventory, core) - inventory
+    inv_total = np.bincount(core, weights=inventory)[core]
+    m_cum = mass_top + mass / 2
+    inv_below = inv_total - inv_top - inventory / 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        valid = inv_below > 0
+        age_crs = np.where(valid, np.log(inv_total / inv_below) / λ_210Pb_yr, np.nan)
+        mar_crs = np.where(valid & (C > 0), λ_210Pb_yr * inv_below / C, np.nan)
+
+        # CIC: decay relative to the shallowest interval of each core
+        first = np.flatnonzero(np.r_[True, core[1:] != core[:-1]])
+        C0 = np.repeat(C[first], np.diff(np.r_[first, n]))
+        age_cic = np.where((C > 0) & (C0 > 0), np.log(C0 / C) / λ_210Pb_yr, np.nan)
+
+        # CF:CS: one least-squares line of ln(C_xs) per core, from group sums
+        slope_z = _group_slope(z, np.log(np.where(C > 0, C, np.nan)), core)
+        slope_m = _group_slope(m_cum, np.log(np.where(C > 0, C, np.nan)), core)
+        s_cfcs = (-λ_210Pb_yr / slope_z)[core]
+        mar_cfcs = (-λ_210Pb_yr / slope_m)[core]
+        age_cfcs = z / s_cfcs
+
+    out = act.copy()
+    columns = {
+        "M_cum (g/cm2)": m_cum,
+        "I_i (dpm/cm2)": inventory,
+        "I_below (dpm/cm2)": inv_below,
+        "I_total (dpm/cm2)": inv_total,
+        "Age_CRS (yr)": age_crs,
+        "MAR_CRS (g/cm2/yr)": mar_crs,
+        "Age_CIC (yr)": age_cic,
+        "S_CFCS (cm/yr)": s_cfcs,
+        "MAR_CFCS (g/cm2/yr)": mar_cfcs,
+        "Age_CFCS (yr)": age_cfcs,
+    }
+    for name, values in columns.items():
+        # scatter back from (core, depth) order to the caller's row order
+        unsorted = np.empty(n)
+        unsorted[order] = values
+        out[name] = unsorted
+    return out
+
+
+# integer code of each row's core, and the row order sorted by (core, depth)
+def _core_order(cores, z):
+    codes, _ = pd.factorize(cores, sort=True)
+    order = np.lexsort((np.asarray(z, dtype=float), codes))
+    return codes[order], order
+
+
+# cumulative sum that restarts at the first row of every core (rows sorted)
+def _segment_cumsum(x, core):
+    total = np.cumsum(x)
+    starts = np.flatnonzero(np.r_[True, core[1:] != core[:-1]])
+    offset = (total - x)[starts]
+    return total - np.repeat(offset, np.diff(np.r_[starts, len(x)]))
+
+
+# least-squares slope of y against x for every core; NaN rows are skipped
+def _group_slope(x, y, core, weights=None):
+    keep = np.isfinite(x) & np.isfinite(y)
+    w = keep * (1.0 if weights is None else np.where(keep, weights, 0))
+    x, y = np.where(keep, x, 0), np.where(keep, y, 0)
+    n_cores = core.max() + 1 if len(core) else 0
+    S = np.bincount(core, weights=w, minlength=n_cores)
+    Sx = np.bincount(core, weights=w * x, minlength=n_cores)
+    Sy = np.bincount(core, weights=w * y, minlength=n_cores)
+    Sxx = np.bincount(core, weights=w * x * x, minlength=n_cores)
+    Sxy = np.bincount(core, weights=w * x * y, minlength=n_cores)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (S * Sxy - Sx * Sy) / (S * Sxx - Sx * Sx)
+
+
+################################################################################
+###                         FIT_SEDIMENTATION_RATES                          ###
+#  Weighted log-linear fits of excess 210Pb against depth for every core and   #
+#  every candidate surface-mixed-layer cutoff at once, with bootstrap          #
+#  confidence intervals on the chosen fit.                                     #
+#
+#  . ln(C_xs) is fitted against Z_midpt with weights 1/σ², σ = Xdir_error/C_xs
+#  . cutoff k drops the k shallowest intervals (the mixed layer). Weighted
+#    sums over the remaining rows are suffix sums, so every k of every core
+#    comes out of one cumulative sum over a (cores, intervals) array
+#  . the smallest cutoff k is kept whose reduced χ² is consistent with the
+#    errors (χ²_red <= 1 + 2 sqrt(2/dof)) and whose shallowest interval lies
+#    within mixed_sigma (default 2) of the fit of the intervals below it, else
+#    the one with the lowest χ²_red; at least min_points must be left and at
+#    most max_cutoff (default half the intervals) dropped. The second test
+#    finds a few mixed intervals that the χ² of a long core would average
+#    away; mixed intervals closer than mixed_sigma to the line are kept
+#  . bootstrap: n_boot resamples (with replacement) of the fitted intervals of
+#    each core, fitted as one (cores, n_boot, intervals) array, chunked so the
+#    working set stays under max_bytes
+#
+#                                   RETURNS:
+#  one row per core: CoreID, n_fit, mixed_layer_intervals,
+#  mixed_layer_depth (cm) (Z_midpt of the shallowest fitted interval),
+#  slope (1/cm), slope_err (1/cm), chi2_red, S (cm/yr), S_err (cm/yr),
+#  S p<q> (cm/yr) for each bootstrap percentile q
+###                                                                          ###
+################################################################################
+
+ERR = "Error_MudSaltCorr (Xdir_error)"
+
+
+def fit_sedimentation_rates(act, core_col="CoreID", min_points=4, max_cutoff=None, mixed_sigma=2.0, n_boot=1000, percentiles=(2.5, 97.5), seed=None, max_bytes=256 * 2**20):
+    n = len(act)
+    cores = act[core_col] if core_col in act else pd.Series(np.zeros(n))
+    C = np.asarray(act[C_XS], dtype=float)
+    err = np.asarray(act[ERR], dtype=float)
+    usable = (C > 0) & (err > 0) & np.isfinite(C) & np.isfinite(err)
+    names, codes = np.unique(np.asarray(cores)[usable], return_inverse=True)
+
+    # (cores, L) arrays of depth, ln(C_xs) and weight; rows sorted by depth
+    x, y, w, counts = _pad_by_core(
+        codes,
+        np.asarray(act[Z_MID], dtype=float)[usable],
+        np.log(C[usable]),
+        (C[usable] / err[usable]) ** 2,
+        len(names),
+    )
+    n_cores, L = x.shape
+
+    # weighted sums over rows k.. of every core = suffix sums along axis 1
+    def suffix(v):
+        return np.cumsum(v[:, ::-1], axis=1)[:, ::-1]
+
+    S, Sx, Sy = suffix(w), suffix(w * x), suffix(w * y)
+    Sxx, Sxy, Syy = suffix(w * x * x), suffix(w * x * y), suffix(w * y * y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        D = S * Sxx - Sx * Sx
+        b = (S * Sxy - Sx * Sy) / D
+        a = (Sy - b * Sx) / S
+        chi2 = Syy - 2 * a * Sy - 2 * b * Sxy + a * a * S + 2 * a * b * Sx + b * b * Sxx
+        n_left = counts[:, None] - np.arange(L)[None, :]
+        chi2_red = chi2 / (n_left - 2)
+
+        # distance (in σ) of row k from the line fitted to rows k+1..
+        S1, Sx1, Sy1, Sxx1, Sxy1 = (np.pad(v[:, 1:], ((0, 0), (0, 1))) for v in (S, Sx, Sy, Sxx, Sxy))
+        D1 = S1 * Sxx1 - Sx1 * Sx1
+        b1 = (S1 * Sxy1 - Sx1 * Sy1) / D1
+        a1 = (Sy1 - b1 * Sx1) / S1
+        var = 1 / w + (Sxx1 - 2 * x * Sx1 + x * x * S1) / D1
+        off_line = np.abs(y - a1 - b1 * x) / np.sqrt(var)
+
+    # best allowed cutoff per core
+    k = np.arange(L)[None, :]
+    limit = counts // 2 if max_cutoff is None else np.full(n_cores, max_cutoff)
+    allowed = (n_left >= max(min_points, 3)) & (k <= limit[:, None]) & np.isfinite(chi2_red)
+    score = np.where(allowed, chi2_red, np.inf)
+    # fewest dropped intervals whose fit is consistent with the errors (χ²_red
+    # within 2σ of 1, shallowest interval on the line); otherwise the lowest
+    # χ²_red
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accept = allowed & (score <= 1 + 2 * np.sqrt(2 / (n_left - 2))) & (off_line <= mixed_sigma)
+    best = np.where(accept.any(axis=1), np.argmax(accept, axis=1), np.argmin(score, axis=1))
+    ok = np.isfinite(score[np.arange(n_cores), best])
+    rows = np.arange(n_cores)
+    slope = np.where(ok, b[rows, best], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope_err = np.where(ok, np.sqrt(S[rows, best] / D[rows, best]), np.nan)
+        rate = -λ_210Pb_yr / slope
+        rate_err = λ_210Pb_yr * slope_err / slope**2
+
+    out = pd.DataFrame(
+        {
+            core_col: names,
+            "n_fit": np.where(ok, counts - best, 0),
+            "mixed_layer_intervals": np.where(ok, best, -1),
+            "mixed_layer_depth (cm)": np.where(ok, x[rows, best], np.nan),
+            "slope (1/cm)": slope,
+            "slope_err (1/cm)": slope_err,
+            "chi2_red": np.where(ok, chi2_red[rows, best], np.nan),
+            "S (cm/yr)": rate,
+            "S_err (cm/yr)": rate_err,
+        }
+    )
+    if n_boot:
+        boot = _bootstrap_rates(x, y, w, best, counts, ok, n_boot, percentiles, seed, max_bytes)
+        for j, q in enumerate(percentiles):
+            out[f"S p{q:g} (cm/yr)"] = boot[:, j]
+    return out
+
+
+# pack each core's usable rows, sorted by depth, into padded (cores, L) arrays
+def _pad_by_core(codes, z, y, w, n_cores):
+    order = np.lexsort((z, codes))
+    codes = codes[order]
+    counts = np.bincount(codes, minlength=n_cores)
+    L = max(counts.max() if n_cores else 0, 1)
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    col = np.arange(len(codes)) - starts[codes]
+    padded = []
+    for v in (z, y, w):
+        p = np.zeros((n_cores, L))
+        p[codes, col] = v[order]
+        padded.append(p)
+    return padded[0], padded[1], padded[2], counts
+
+
+# bootstrap percentiles of the sedimentation rate for the chosen fit of each core
+def _bootstrap_rates(x, y, w, best, counts, ok, n_boot, percentiles, seed, max_bytes):
+    rng = np.random.default_rng(seed)
+    n_cores, L = x.shape
+    n_fit = np.where(ok, counts - best, 0)
+    result = np.full((n_cores, len(percentiles)), np.nan)
+    # ~8 (cores, n_boot, L) float64 arrays are alive at once
+    chunk = max(1, int(max_bytes // (8 * 8 * n_boot * max(L, 1))))
+    for lo in range(0, n_cores, chunk):
+        c = np.arange(lo, min(lo + chunk, n_cores))
+        # draw n_fit indices from rows best.. of each core; pad draws get weight 0
+        pick = best[c, None, None] + np.floor(
+            rng.random((len(c), n_boot, L)) * n_fit[c, None, None]
+        ).astype(np.intp)
+        pick = np.minimum(pick, L - 1)
+        live = np.arange(L)[None, None, :] < n_fit[c, None, None]
+        xb = np.take_along_axis(x[c, None, :], pick, axis=2)
+        yb = np.take_along_axis(y[c, None, :], pick, axis=2)
+        wb = np.take_along_axis(w[c, None, :], pick, axis=2) * live
+        S, Sx, Sy = wb.sum(2), (wb * xb).sum(2), (wb * yb).sum(2)
+        Sxx, Sxy = (wb * xb * xb).sum(2), (wb * xb * yb).sum(2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = -λ_210Pb_yr / ((S * Sxy - Sx * Sy) / (S * Sxx - Sx * Sx))
+            result[c] = np.nanpercentile(rate, percentiles, axis=1).T
+    result[~ok] = np.nan
+    return result
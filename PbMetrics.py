@@ -0,0 +1,164 @@
+################################################################################
+###                               PBMETRICS.py                               ###
+#      Instrumentation shared by the pipeline: the "PbTools" logger that       #
+#      carries the progress banners, and the Metrics object every stage        #
+#      reports its timings and counters into.                                  #
+#
+#  LOGGING: all progress output goes through logging.getLogger("PbTools")
+#  (children such as "PbTools.watch" included). Until the application
+#  configures logging itself, a stdout handler printing the bare message is
+#  attached, so the banners look as before. To silence them:
+#      logging.getLogger("PbTools").setLevel(logging.WARNING)
+#  Stage timings are logged at DEBUG level.
+###                                                                          ###
+################################################################################
+
+import contextlib
+import logging
+import sys
+import time
+
+log = logging.getLogger("PbTools")
+
+
+class _DefaultHandler(logging.StreamHandler):
+    # stdout handler used only while nothing else handles the "PbTools" logs
+    def emit(self, record):
+        if logging.getLogger().handlers:
+            return
+        super().emit(record)
+
+
+if not log.handlers:
+    _handler = _DefaultHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+
+
+################################################################################
+###                                 METRICS                                  ###
+#  Collects what one call (or several, if the same object is passed again)     #
+#  spent its time and memory on.                                               #
+#
+#      .stages    : {stage name: seconds}, summed over repeated stages
+#      .counters  : {name: value}, e.g. files, bytes_read, rows, cache_hits
+#      .peak_memory_bytes : tracemalloc peak (trace_memory=True), otherwise
+#                           the peak resident size of the process where the
+#                           platform reports it
+#
+#      with m.stage("parse"): ...    times one block
+#      m.lap("decay corrections")    ends the running lap stage (if any) and
+#                                    starts a new one; m.lap(None) ends it
+#      m.count("files", n)           adds n to a counter
+#      with m.track(): ...           wraps a whole call: turns on the optional
+#                                    cProfile (profile=True) and tracemalloc
+#                                    (trace_memory=True) hooks around it
+#      m.as_dict(), m.report(), m.profile_stats(limit=25)
+###                                                                          ###
+################################################################################
+
+
+class Metrics:
+    def __init__(self, profile=False, trace_memory=False):
+        self.stages = {}
+        self.counters = {}
+        self.peak_memory_bytes = None
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self._profiler = None
+        self._lap = None
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self._add(name, time.perf_counter() - t0)
+
+    def lap(self, name):
+        now = time.perf_counter()
+        if self._lap is not None:
+            self._add(self._lap[0], now - self._lap[1])
+        self._lap = None if name is None else (name, now)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def track(self):
+        # nested calls (e.g. counts_to_activity inside PbWatch) share the
+        # outermost hooks
+        self._depth += 1
+        outer = self._depth == 1
+        started_tracing = False
+        if outer and self.trace_memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+        if outer and self.profile:
+            import cProfile
+
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        try:
+            yield self
+        finally:
+            self.lap(None)
+            self._depth -= 1
+            if outer and self.profile:
+                self._profiler.disable()
+            if outer:
+                self._record_peak(started_tracing)
+
+    def as_dict(self):
+        return {
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "peak_memory_bytes": self.peak_memory_bytes,
+        }
+
+    def report(self):
+        lines = [f"{'stage':<24} {'seconds':>10}"]
+        lines += [f"{name:<24} {sec:10.4f}" for name, sec in self.stages.items()]
+        lines += [f"{name:<24} {value:>10}" for name, value in self.counters.items()]
+        if self.peak_memory_bytes is not None:
+            lines.append(f"{'peak memory (MB)':<24} {self.peak_memory_bytes / 2**20:10.1f}")
+        return "\n".join(lines)
+
+    def profile_stats(self, sort="cumulative", limit=25):
+        if self._profiler is None:
+            return ""
+        import io
+        import pstats
+
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def _add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        log.debug("stage %-20s %.4f s", name, seconds)
+
+    def _record_peak(self, started_tracing):
+        if self.trace_memory:
+            import tracemalloc
+
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        else:
+            try:
+                import resource
+            except ImportError:
+                return
+            # ru_maxrss is in kB on Linux, bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak *= 1 if sys.platform == "darwin" else 1024
+        self.peak_memory_bytes = max(peak, self.peak_memory_bytes or 0)
@@ -1,10 +1,31 @@
 ################################################################################
 ###                                 LEADTOOLS.py                             ###
-#         3 functions: spe_to_counts, DET_MATCH_SUM, counts_to_activity        #
+#    functions: spe_to_counts, READ_SPES, INTEGRATE_WINDOWS, DET_MATCH_SUM,    #
+#   CALIBRATE_WINDOWS, FIT_PEAK_SHAPES, SWEEP_WINDOWS, counts_to_activity      #
+#   (_batch), SWEEP_ACTIVITY, CORRECTION_CHAIN; plus the DETECTORS registry    #
 #           Function descriptions are given directly above the code.           #
 ###                                Evan Lahr 2020                            ###
 ################################################################################
 
+import glob
+import itertools
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from PbMetrics import Metrics, log
+from SpeReader import SpeFormatError, read_spe
+from SpeRoi import RoiSpectra
+
+# matplotlib (plots) and SpeArchive (.spa inputs) are imported only where
+# they are used, so batch runs that do not plot never load pyplot; the
+# optional extras pyarrow (parquet/feather tables) and numba
+# (correction_chain(engine="numba")) likewise
+
 ################################################################################
 ###                                spe_to_counts                             ###
 #                     this script performs the following:                      #
@@ -13,8 +34,9 @@
 #        3. Write a csv with the columns specified below (see "OUTPUT")
 #
 #  ------INPUT #1:  SPE FOLDER--------      --------------OUTPUT-----------------
-#  . type: string path               .      . Z_midpt (cm)	                    .
-#  . content: folder of .SPE files   .      . Δt_in_counting (sec)	            .
+#  . type: string path               .      . CoreID                            .
+#  . content: folder of .SPE files   .      . Z_midpt (cm)	                    .
+#  . named <CoreID>_..<Z_up>-<Z_lo>  .      . Δt_in_counting (sec)	            .
 #  -----------------------------------      . ΔZ (cm)	M_pan (g)	            .
 #                   \\                      . M_WetSed+Pan (g)	                .
 #                    \\                     . M_DrySed+Pan (g)	                .
@@ -37,107 +59,234 @@
 #  .   siltclay (volfrac)            .
 #  -----------------------------------
 #
+#  OPTIONAL: workers=N spreads SPE parsing over N processes (output is
+#  identical to the serial run). On platforms that spawn processes (Windows,
+#  macOS) call it under  if __name__ == "__main__":
+#  OPTIONAL: cache=<folder or SpeReader.SpeCache> keeps parsed spectra on disk
+#  so later runs over the same files skip parsing; hits/misses are reported.
+#  OPTIONAL: plots=<folder> writes integration-window QC plots of the spectra
+#  read in this run (PlotTools.plot_spectra, one PDF per detector); with
+#  plots_flagged_only=True only spectra picked by PlotTools.flag_spectra.
+#  PlotSPEs=True still draws one pyplot figure per file in the caller.
+#  OPTIONAL: incremental=True re-reads the existing output at fout and only
+#  processes spe files that are new or changed since it was written (tracked
+#  in "<fout>.manifest.json"); the lab columns are re-matched on every run.
+#  The manifest also records tail_correction, filename_pattern and the
+#  windows of every detector; when they change, all rows are rebuilt.
+#  OPTIONAL: calibrate="propose" finds the Po peaks of each detector in this
+#  batch (calibrate_windows) and prints windows that follow them;
+#  calibrate="apply" also integrates this run with them (DETECTORS itself is
+#  not changed, so later calls start from the registry again). drift_log=<csv>
+#  appends the peak positions of every run, to follow gain drift over time.
+#  OPTIONAL: a fout ending in .parquet or .feather writes a typed columnar
+#  table (see TABLE I/O) instead of a csv; spectra_column=True then adds the
+#  raw channel counts of each row as a "spectrum" column.
+#  OPTIONAL: filename_pattern=<regex> overrides FILENAME_PATTERN, which reads
+#  CoreID, Z_upper and Z_lower from each file name (see parse_filenames).
+#  Lab rows are matched on those three keys, so one folder may hold several
+#  cores; unmatched spectra and lab rows are reported (strict=True raises).
+#  OPTIONAL: SPEs_path may also be a list of spe files, and labsheet_path a
+#  DataFrame of lab rows (as used by PbWatch).
+#  OPTIONAL: SPEs_path may name a spectrum archive (*.spa, see SpeArchive)
+#  instead of a glob of spe files; depths then come from the archive index.
+#  It is read one stored chunk at a time; unless calibrate, tail_correction,
+#  plots or spectra_column need the spectra, only the window sums are kept.
+#  OPTIONAL: roi=True keeps only the channels around the integration windows
+#  in memory (see SpeRoi), roi=[(lo, hi), ...] the given channel ranges;
+#  the sums are the same, memory use for large batches is ~1/10.
+#  OPTIONAL: tail_correction=True fits the peak shapes (fit_peak_shapes) and
+#  corrects both window sums for the 210Po tail in the 209Po window; the net
+#  counts moved are kept as "209Po_tail_correction (counts)". The peak shapes
+#  are fitted per detector over the spectra read together, so rows kept by an
+#  incremental run keep the shapes of the run that read them.
+#  OPTIONAL: metrics=PbMetrics.Metrics(...) collects stage timings (glob,
+#  parse, calibrate, integrate, tail correction, plot, merge, write),
+#  file/byte/cache counters and peak memory; the same numbers are in
+#  counts.attrs["metrics"].
+#  Progress is logged to the "PbTools" logger (see PbMetrics).
+#
 ###                                                                          ###
 ################################################################################
 
+def spe_to_counts(SPEs_path, labsheet_path, fout, workers=None, cache=None, incremental=False, plots=None, plots_flagged_only=False, calibrate=None, drift_log=None, spectra_column=False, filename_pattern=None, strict=False, roi=None, tail_correction=False, metrics=None, **PlotSPEs):
+    metrics = Metrics() if metrics is None else metrics
+    with metrics.track():
+        counts = _spe_to_counts(SPEs_path, labsheet_path, fout, workers, cache, incremental, plots, plots_flagged_only, calibrate, drift_log, spectra_column, filename_pattern, strict, roi, tail_correction, metrics, PlotSPEs)
+    counts.attrs["metrics"] = metrics.as_dict()
+    return counts
 
 
-def spe_to_counts(SPEs_path, labsheet_path, fout, **PlotSPEs):
-    print("|------------------------  spe_to_counts STARTED  ----------------------|")
-
-    # import modules
-    import pandas as pd
-    import numpy as np
-    import glob
+def _spe_to_counts(SPEs_path, labsheet_path, fout, workers, cache, incremental, plots, plots_flagged_only, calibrate, drift_log, spectra_column, filename_pattern, strict, roi, tail_correction, metrics, PlotSPEs):
+    log.info("|------------------------  spe_to_counts STARTED  ----------------------|")
+    metrics.lap("glob")
 
-    # create list of all the spe files to open using the input folder path
-    files = glob.glob(SPEs_path)
-    df_files = pd.DataFrame(files)
+    # an archive (SpeArchive) replaces the folder of spe files
+    from SpeArchive import ARCHIVE_EXT
+    archive = None
+    if str(SPEs_path).endswith(ARCHIVE_EXT):
+        from SpeArchive import SpeArchive
+        if incremental:
+            raise ValueError("spe_to_counts: incremental=True needs spe files, not an archive")
+        archive = SpeArchive(SPEs_path)
+        files = archive.index["path"].tolist()
+    elif isinstance(SPEs_path, str):
+        # create list of all the spe files to open using the input folder path
+        files = glob.glob(SPEs_path)
+    else:
+        # or take an explicit list of spe files
+        files = list(SPEs_path)
 
+    metrics.count("files", len(files))
     # print statement for verification
-    print(f"||    Reading {len(files)} spe files at path:            {SPEs_path}")
-
-    # read and compute all relevant info from each spe file, write into dfs
-    # create empty dfs to be added to in for loop
-    spe = pd.DataFrame()
-    speDet = pd.DataFrame()
-    speDate = pd.DataFrame()
-    speCounts = pd.DataFrame()
-    spectra_sum = pd.DataFrame()
-    counts = pd.DataFrame()
-    # loop through each individual spe file and read characters into dataframe
-    for i in range(len(files)):
-        spe_raw = pd.read_csv(files[i])
-        # read relevant regions of the spe file
-        spe_new = pd.DataFrame(spe_raw[11:2059].astype(int))  # raw counts data
-        speDet_new = spe_raw[2:3].astype(str)  # name of detector ID
-        speDate_new = spe_raw[6:7].astype(str)  # date of counting
-        speCounts_new = spe_raw[8:9].astype(str)  # total number of counts
-        # add new values to existing dataframe
-        spe = pd.concat([spe, spe_new], axis=1, ignore_index=True)
-        speDet = pd.concat([speDet, speDet_new], axis=1, ignore_index=True)
-        speDate = pd.concat([speDate, speDate_new], axis=1, ignore_index=True)
-        speCounts = pd.concat(
-            [speCounts, speCounts_new], axis=1, ignore_index=True
-        )
-        # Match spes to detectors, sum α-decays with the function "det_match_sum"
-        spectra_sum_new = pd.DataFrame(det_match_sum(spe[i], speDet[i][2],files[i], PlotSPEs['PlotSPEs'])).T
-        spectra_sum = pd.concat(
-            [spectra_sum, spectra_sum_new], axis=0, ignore_index=True
-        )
+    log.info(f"||    Reading {len(files)} spe files at path:            {SPEs_path if isinstance(SPEs_path, str) else '<list of files>'}")
+
+    # incremental mode: keep the rows of files already written to fout and
+    # only process spe files that are new or changed since that run; the
+    # options that change the window sums must match the previous run's
+    kept, manifest, options = None, {}, {}
+    if incremental:
+        options = {
+            "tail_correction": bool(tail_correction),
+            "filename_pattern": getattr(filename_pattern, "pattern", filename_pattern) or FILENAME_PATTERN,
+        }
+        all_files = files
+        kept, files, manifest, old_windows = _incremental_split(files, fout, options)
+        if kept is not None:
+            log.info(f"||    Incremental: {len(kept)} rows kept, {len(files)} new or changed spe files")
+
+    if isinstance(cache, str):
+        from SpeReader import SpeCache
+        cache = SpeCache(cache)
+    while True:
+        # read every spe file once into a preallocated spectra matrix (in a
+        # pool of worker processes and/or from the spectra cache if asked to)
+        metrics.lap("parse")
+        if workers is not None and workers > 1 and len(files) > 1:
+            log.info(f"||    ...using {workers} worker processes...")
+        sums = None
+        if archive is not None:
+            # the window sums are taken chunk by chunk; the spectra are only
+            # kept when a later step looks at them
+            keep = calibrate is not None or tail_correction or plots is not None or spectra_column or PlotSPEs.get("PlotSPEs") == True
+            spectra, sums = _read_archive(archive, roi, keep, metrics)
+            headers = np.zeros(len(files), dtype=SPE_HEADER_DTYPE)
+            for name in headers.dtype.names:
+                headers[name] = archive.index[name]
+            coreIDs = archive.index["CoreID"].astype(object)
+            z_upper, z_lower = archive.index["Z_upper (cm)"], archive.index["Z_lower (cm)"]
+            archive.close()
+        else:
+            spectra, headers = read_spes(files, workers=workers, cache=cache, roi=roi, metrics=metrics)
+            # core and depth interval from the file names
+            keys = parse_filenames(files, filename_pattern)
+            coreIDs = keys["CoreID"].to_numpy()
+            z_upper, z_lower = keys["Z_upper (cm)"].to_numpy(), keys["Z_lower (cm)"].to_numpy()
+        # locate the Po peaks of each detector; propose or apply shifted
+        # windows (applied windows are used for this run only, DETECTORS is
+        # not changed)
+        detectors = DETECTORS
+        if calibrate is not None and len(files):
+            metrics.lap("calibrate")
+            if calibrate not in ("propose", "apply"):
+                raise ValueError(f"spe_to_counts: calibrate must be 'propose' or 'apply', not {calibrate!r}")
+            calibration = calibrate_windows(spectra, headers["det"], headers["date"], apply=calibrate == "apply", drift_log=drift_log)
+            detectors = calibration.attrs["detectors"]
+            for _, row in calibration[calibration["shift (channels)"] != 0].iterrows():
+                action = "applied" if row["applied"] else "proposed"
+                log.info(f"||    {row['detector']}: windows {row['windows']} -> {row['proposed']} ({action})")
+        if not incremental:
+            break
+        # windows of every detector in the output; kept rows summed with
+        # other windows than this run's are rebuilt with all the files
+        options["windows"], stale = _incremental_windows(old_windows, manifest, headers["det"], detectors, calibrate)
+        if not stale:
+            break
+        log.info(f"||    Incremental: windows of {stale} changed since the last run, rebuilding all {len(all_files)} rows")
+        kept, files, manifest, old_windows = None, all_files, {}, {}
+    # match spes to detectors, sum α-decays for the whole batch at once
+    metrics.lap("integrate")
+    detIDs, po209, po210 = integrate_windows(spectra, headers["det"], detectors) if sums is None else sums
+    # move the 210Po tail counts out of the 209Po window (and vice versa)
+    if tail_correction and len(files):
+        metrics.lap("tail correction")
+        fits = fit_peak_shapes(spectra, headers["det"], detectors)
+        tail = fits["209Po_decays (counts)"].to_numpy() - po209
+        po209 = fits["209Po_decays (counts)"].to_numpy()
+        po210 = fits["210Po_decays (counts)"].to_numpy()
+        log.info(f"||    Tail correction: median {np.median(tail):+.1f} counts moved into the 209Po windows, {int((~fits['converged']).sum())} fits not converged")
+    if PlotSPEs.get('PlotSPEs') == True:
+        metrics.lap("plot")
+        for i in range(len(files)):
+            det_match_sum(spectra[i], headers["det"][i], files[i], True)
+    # QC plots of the integration windows, written to disk by PlotTools
+    if plots is not None:
+        metrics.lap("plot")
+        import PlotTools
+        flagged = PlotTools.flag_spectra(spectra, headers["det"], detectors=detectors) if plots_flagged_only else None
+        written = PlotTools.plot_spectra(spectra, headers["det"], files, plots, flagged=flagged, workers=workers, detectors=detectors)
+        log.info(f"||    Wrote {len(written)} QC plot files to:          {plots}")
 
     # create df named 'counts' to store final values, begin adding computed columns
+    metrics.lap("merge")
     counts = pd.DataFrame()
-    # the depth midpoint at section i (temp, will be overwritten)
-    counts["Z_midpt (cm)"] = pd.DataFrame(files)
-    # total elapsed counting time in seconds
-    counts["Δt_in_counting (sec)"] = speCounts.T
 
     # Compute a few more values and concat
-    midpt = np.zeros(len(files))  # midpoint of the section interval (cm bsf)
-    totcts = np.zeros(len(files))  # total number of counting seconds
-    depInt = np.zeros(
-        len(files)
-    )  # the vertical thickness of the section analyzed
-    for i in range(len(files)):
-        midpt[i] = (
-            int(counts["Z_midpt (cm)"][i][22:25])
-            + int(counts["Z_midpt (cm)"][i][26:29])
-        ) / 2
-        totcts[i] = int(counts["Δt_in_counting (sec)"][i].split(" ")[0])
-        depInt[i] = int(counts["Z_midpt (cm)"][i][26:29]) - int(
-            counts["Z_midpt (cm)"][i][22:25]
-        )
-    
+    midpt = (z_upper + z_lower) / 2  # midpoint of the section interval (cm bsf)
+    totcts = headers["live_time"].astype(float)  # total number of counting seconds
+    depInt = (z_lower - z_upper).astype(float)  # the vertical thickness of the section analyzed
+
     # add computed values to df
+    # the core that section i belongs to
+    counts["CoreID"] = coreIDs
     # section i depth midpoint
     counts["Z_midpt (cm)"] = midpt
+    # the elapsed time between the start and end of counting
+    counts["Δt_in_counting (sec)"] = totcts
     # section i vertical thickness
     counts["ΔZ (cm)"] = depInt
     # the detector bin ID that the sample was counted in
-    counts["detID"] = spectra_sum[:][0]
-    # the elapsed time between the start and end of counting
-    counts["Δt_in_counting (sec)"] = totcts
+    counts["detID"] = detIDs
     # the total number of 209Po α-decays detected
-    counts["209Po_decays (counts)"] = spectra_sum[:][1]
+    counts["209Po_decays (counts)"] = po209
     # the total number of 210Po α-decays detected
-    counts["210Po_decays (counts)"] = spectra_sum[:][2]
+    counts["210Po_decays (counts)"] = po210
+    # counts moved into the 209Po window by the tail correction
+    if tail_correction:
+        counts[_TAIL_COLUMN] = tail if len(files) else np.zeros(0)
     # the date and time of α-counting
-    counts["Counting_StartDate+Time"] = speDate.T
+    counts["Counting_StartDate+Time"] = headers["date"].astype(object)
     # spe format is hh:mm:ss
     counts["Counting_StartTime"] = (
         counts["Counting_StartDate+Time"].astype(str).str[11:])
     # spe format is MM/DD/YYYY
     counts["Counting_StartDate"] = (
         counts["Counting_StartDate+Time"].astype(str).str[:10] )
-    # sort the dataframe by section depth
-    counts = counts.sort_values(by=["Z_midpt (cm)"], ignore_index=True)
-    
-    
-    
-    # read in weight, grain size, and time data obtained in the lab
-    labsheet = pd.read_csv(labsheet_path, header=0).sort_values(by=["Z_upper (cm)"], ignore_index=True)
-    print( f"||    Read {len(labsheet)} rows of lab csv data at path: {labsheet_path}")    
+    # the depth interval as read from the file name (or archive index), the
+    # key of the lab join below; not written
+    counts["Z_upper (cm)"], counts["Z_lower (cm)"] = z_upper, z_lower
+    # raw channel counts of each row, for QC without the spe files
+    if spectra_column:
+        counts["spectrum"] = pd.Series(list(np.asarray(spectra).astype(np.uint32)), dtype=object)
+    # remember which depth each file produced (used by incremental mode)
+    if incremental:
+        for i in range(len(files)):
+            st = os.stat(files[i])
+            manifest[os.path.abspath(files[i])] = [st.st_mtime_ns, st.st_size, midpt[i], coreIDs[i], headers["det"][i]]
+    # merge in the rows kept from the previous run
+    if kept is not None:
+        counts = pd.concat([kept, counts], ignore_index=True)
+    # sort the dataframe by core, then section depth
+    counts = counts.sort_values(by=["CoreID", "Z_midpt (cm)"], kind="stable", ignore_index=True)
+
+    # read in weight, grain size, and time data obtained in the lab, and look
+    # up the lab row of every section by (CoreID, Z_upper, Z_lower)
+    if isinstance(labsheet_path, pd.DataFrame):
+        labsheet = labsheet_path
+    else:
+        labsheet = pd.read_csv(labsheet_path, header=0, dtype=TEXT_COLUMNS)
+    log.info( f"||    Read {len(labsheet)} rows of lab csv data at path: {labsheet_path if isinstance(labsheet_path, str) else '<DataFrame>'}")
+    labsheet = _join_labsheet(counts, labsheet, strict)
+    counts = counts.drop(columns=["Z_upper (cm)", "Z_lower (cm)"])
     # mass of the pan used to dry sediment
     counts["M_pan (g)"] = labsheet["M_pan (g)"]
     # mass of the pan plus wet sediment
@@ -158,15 +307,1016 @@ def spe_to_counts(SPEs_path, labsheet_path, fout, **PlotSPEs):
     ]
     
 
-    print(f"||    Writing data to csv at path:             {fout}")
-    counts.to_csv(f"{fout}", index=False)
-    print(
+    # columnar files carry the plating/counting times typed, so
+    # counts_to_activity does not parse them again
+    fmt = table_format(fout)
+    if fmt != "csv":
+        counts["t_platingstart"], counts["t_countingstart"] = _timestamps(counts)
+    metrics.lap("write")
+    log.info(f"||    Writing data to {fmt} at path:             {fout}")
+    write_table(counts, fout)
+    metrics.count("rows_written", len(counts))
+    if incremental:
+        with open(f"{fout}.manifest.json", "w") as f:
+            json.dump({"options": options, "files": manifest}, f)
+    metrics.lap(None)
+    if cache is not None:
+        log.info(f"||    SPE cache: {cache.hits} hits, {cache.misses} misses at {cache.directory}")
+    log.info(
         f"|-------------------------  SPE_READER FINISHED  -----------------------|"
     )
-    print(" ")
+    log.info(" ")
     return counts
 
 
+# counts moved into the 209Po window by tail_correction=True
+_TAIL_COLUMN = "209Po_tail_correction (counts)"
+
+# columns of the counts table that come from the spe files themselves (the
+# tail correction only with tail_correction=True)
+_SPE_COLUMNS = [
+    "CoreID",
+    "Z_midpt (cm)",
+    "Δt_in_counting (sec)",
+    "ΔZ (cm)",
+    "detID",
+    "209Po_decays (counts)",
+    "210Po_decays (counts)",
+    _TAIL_COLUMN,
+    "Counting_StartDate+Time",
+    "Counting_StartTime",
+    "Counting_StartDate",
+]
+
+
+# split the spe files into rows that can be kept from a previous run at fout
+# and files that still need processing; returns (kept rows, files, manifest
+# of the kept files, windows of the previous run). Everything is rebuilt when
+# OPTIONS (tail_correction, filename_pattern) differ from the previous run's
+def _incremental_split(files, fout, options):
+    manifest_path = f"{fout}.manifest.json"
+    if not (os.path.exists(fout) and os.path.exists(manifest_path)):
+        return None, files, {}, {}
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    # manifests written before the options were recorded are rebuilt too
+    previous = manifest.get("options")
+    if not isinstance(previous, dict) or any(previous.get(k) != v for k, v in options.items()):
+        log.info("||    Incremental: processing options changed since the last run, rebuilding all rows")
+        return None, files, {}, {}
+    manifest = manifest["files"]
+
+    # a file is unchanged if its path, mtime and size match the manifest
+    unchanged, todo = {}, []
+    for path in files:
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        rec = manifest.get(key)
+        if rec is not None and rec[:2] == [st.st_mtime_ns, st.st_size]:
+            unchanged[key] = rec
+        else:
+            todo.append(path)
+    # drop the old rows of changed or deleted files, keep everything else
+    old = read_table(fout)
+    stale = {(str(rec[3]), rec[2]) for key, rec in manifest.items() if key not in unchanged}
+    row_keys = zip(old["CoreID"].astype(str), old["Z_midpt (cm)"])
+    columns = [c for c in _SPE_COLUMNS + ["spectrum"] if c in old]
+    kept = old.loc[[k not in stale for k in row_keys], columns]
+    return kept.reset_index(drop=True), todo, unchanged, previous.get("windows", {})
+
+
+# {detector name: windows} of the rows of an incremental run, and the names
+# of detectors whose kept rows were summed with other windows. Detectors that
+# calibrate="apply" did not see in this run keep their previous windows
+def _incremental_windows(old_windows, kept, names, detectors, calibrate):
+    kept_names = {str(rec[4]) for rec in kept.values()}
+    new_names = set(np.asarray(names, dtype=str).tolist())
+    windows, stale = {}, []
+    for name in sorted(kept_names | new_names):
+        if name not in new_names and calibrate == "apply":
+            windows[name] = old_windows.get(name)
+        else:
+            windows[name] = [int(w) for w in detectors[name][1]] if name in detectors else None
+        if name in kept_names and windows[name] != old_windows.get(name):
+            stale.append(name)
+    return windows, stale
+
+
+################################################################################
+###                             PARSE_FILENAMES                              ###
+#  Reads the core and depth interval of every spe file from its name with one  #
+#  compiled regular expression. The pattern is matched against the file name   #
+#  only (not the folder), so paths of any length work. It must define the      #
+#  named groups CoreID, Z_upper and Z_lower (depths in cm).                    #
+#
+#      INPUTS  : "FILES"  : LIST OF SPE FILE PATHS
+#                "PATTERN": REGEX STRING OR COMPILED PATTERN (OPTIONAL,
+#                           DEFAULT FILENAME_PATTERN, CASE-INSENSITIVE)
+#      OUTPUTS :  DATAFRAME WITH CoreID, Z_upper (cm), Z_lower (cm), ONE ROW
+#                 PER FILE; A FILE NAME THAT DOES NOT MATCH RAISES ValueError
+###                                                                          ###
+################################################################################
+
+# e.g. "MC01_Pb__000-002.Spe" -> CoreID "MC01", 0 to 2 cm
+FILENAME_PATTERN = r"^(?P<CoreID>[^_]+)_.*?(?P<Z_upper>\d+(?:\.\d+)?)-(?P<Z_lower>\d+(?:\.\d+)?)\.spe$"
+
+
+def parse_filenames(files, pattern=None):
+    if pattern is None:
+        pattern = FILENAME_PATTERN
+    if isinstance(pattern, str):
+        pattern = re.compile(pattern, re.IGNORECASE)
+    missing = {"CoreID", "Z_upper", "Z_lower"} - set(pattern.groupindex)
+    if missing:
+        raise ValueError(f"parse_filenames: pattern has no {sorted(missing)} group")
+
+    matches = [pattern.search(os.path.basename(f)) for f in files]
+    bad = [f for f, m in zip(files, matches) if m is None]
+    if bad:
+        raise ValueError(f"parse_filenames: {len(bad)} file names do not match {pattern.pattern!r}, e.g. {bad[:3]}")
+    return pd.DataFrame({
+        "CoreID": pd.Series([m["CoreID"] for m in matches], dtype=object),
+        "Z_upper (cm)": pd.Series([float(m["Z_upper"]) for m in matches], dtype=float),
+        "Z_lower (cm)": pd.Series([float(m["Z_lower"]) for m in matches], dtype=float),
+    })
+
+
+# depths are matched to this many decimals (cm), so an interval rebuilt from
+# its midpoint and thickness still finds its lab row
+DEPTH_DECIMALS = 6
+
+
+# the lab row of every counts row, looked up by (CoreID, Z_upper, Z_lower);
+# spectra without a lab row get NaN lab columns. Unmatched rows on either
+# side are reported, or raise ValueError if strict. Rows without
+# Z_upper/Z_lower (kept by incremental runs) use Z_midpt -/+ ΔZ/2
+def _join_labsheet(counts, labsheet, strict=False):
+    keys = ["CoreID", "Z_upper (cm)", "Z_lower (cm)"]
+    missing = [k for k in keys if k not in labsheet]
+    if missing:
+        raise ValueError(f"spe_to_counts: labsheet has no {missing} column")
+    lab = labsheet.astype({"CoreID": str, "Z_upper (cm)": float, "Z_lower (cm)": float})
+    lab[keys[1:]] = lab[keys[1:]].round(DEPTH_DECIMALS)
+    duplicated = lab.loc[lab.duplicated(keys), keys]
+    if len(duplicated):
+        raise ValueError(f"spe_to_counts: labsheet lists {list(duplicated.itertuples(index=False, name=None))} more than once")
+
+    half = counts["ΔZ (cm)"] / 2
+    upper, lower = counts["Z_midpt (cm)"] - half, counts["Z_midpt (cm)"] + half
+    if "Z_upper (cm)" in counts:
+        upper, lower = counts["Z_upper (cm)"].fillna(upper), counts["Z_lower (cm)"].fillna(lower)
+    wanted = pd.MultiIndex.from_arrays(
+        [counts["CoreID"].astype(str), upper.round(DEPTH_DECIMALS), lower.round(DEPTH_DECIMALS)],
+        names=keys,
+    )
+    lab_index = pd.MultiIndex.from_frame(lab[keys])
+    no_lab = wanted[~wanted.isin(lab_index)]
+    no_spe = lab_index[~lab_index.isin(wanted)]
+    for what, rows in (("spectra without a lab row", no_lab), ("lab rows without a spectrum", no_spe)):
+        if len(rows):
+            listed = ", ".join(f"{c} {u:g}-{l:g} cm" for c, u, l in rows[:10])
+            more = f" (+{len(rows) - 10} more)" if len(rows) > 10 else ""
+            if strict:
+                raise ValueError(f"spe_to_counts: {len(rows)} {what}: {listed}{more}")
+            log.warning(f"||    WARNING: {len(rows)} {what}: {listed}{more}")
+    return lab.set_index(keys).reindex(wanted).reset_index(drop=True)
+
+
+################################################################################
+###                                TABLE I/O                                 ###
+#  Reads and writes the counts and activity tables. The format follows the     #
+#  file extension:                                                             #
+#     .parquet / .pq      Parquet  (pyarrow or fastparquet)                    #
+#     .feather / .arrow   Feather  (pyarrow)                                   #
+#     anything else       csv, as before                                       #
+#  The columnar formats keep every dtype, timestamps included, so the next     #
+#  stage reads them back without re-parsing text. They can also hold a         #
+#  "spectrum" column with the raw channel counts of each row (see              #
+#  stack_spectra), which a csv cannot.                                         #
+#
+#  iter_table(path, chunksize) reads a table chunk by chunk, and TableWriter
+#  writes one chunk by chunk (counts_to_activity(chunksize=...) uses both), so
+#  neither ever holds more than a chunk of rows.
+#  The TEXT_COLUMNS (CoreID) are read as str in every format.
+###                                                                          ###
+################################################################################
+
+_COLUMNAR_FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+
+def table_format(path):
+    return _COLUMNAR_FORMATS.get(os.path.splitext(str(path))[1].lower(), "csv")
+
+
+def write_table(table, path):
+    fmt = table_format(path)
+    if fmt == "parquet":
+        table.to_parquet(path, index=False)
+    elif fmt == "feather":
+        table.reset_index(drop=True).to_feather(path)
+    elif "spectrum" in table:
+        raise ValueError(f"write_table: a 'spectrum' column needs a .parquet or .feather file, not {path!r}")
+    else:
+        table.to_csv(path, index=False)
+
+
+# columns read as text whatever they look like: a CoreID "0101" must not
+# become the number 101
+TEXT_COLUMNS = {"CoreID": str}
+
+
+def read_table(path, columns=None):
+    fmt = table_format(path)
+    if fmt == "parquet":
+        return _text_columns(pd.read_parquet(path, columns=columns))
+    if fmt == "feather":
+        return _text_columns(pd.read_feather(path, columns=columns))
+    return pd.read_csv(path, float_precision="round_trip", header=0, usecols=columns, dtype=TEXT_COLUMNS)
+
+
+# the TEXT_COLUMNS of a table as str (missing values stay missing)
+def _text_columns(table):
+    for col in TEXT_COLUMNS:
+        if col in table:
+            table[col] = table[col].astype(str).where(table[col].notna())
+    return table
+
+
+# DataFrames of up to chunksize rows, each indexed from 0
+def iter_table(path, chunksize, columns=None):
+    fmt = table_format(path)
+    if fmt == "csv":
+        for chunk in pd.read_csv(path, float_precision="round_trip", header=0, usecols=columns, chunksize=chunksize, dtype=TEXT_COLUMNS):
+            yield chunk.reset_index(drop=True)
+        return
+    import pyarrow as pa
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield _text_columns(pa.Table.from_batches([batch]).to_pandas())
+        return
+    # feather: slice the record batches of the memory-mapped file
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for lo in range(0, batch.num_rows, chunksize):
+                yield _text_columns(batch.slice(lo, chunksize).to_pandas())
+
+
+class TableWriter:
+    # appends DataFrames with the same columns to one csv/parquet/feather
+    # table; the columnar files take the schema of the first chunk
+    def __init__(self, path):
+        self.path = path
+        self.format = table_format(path)
+        self.rows = 0
+        self.chunks = 0
+        self._schema = None
+        self._writer = None
+        self._sink = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, table):
+        if self.format == "csv":
+            if "spectrum" in table:
+                raise ValueError(f"TableWriter: a 'spectrum' column needs a .parquet or .feather file, not {self.path!r}")
+            table.to_csv(self.path, index=False, mode="a" if self.chunks else "w", header=not self.chunks)
+        else:
+            import pyarrow as pa
+
+            chunk = pa.Table.from_pandas(table, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = chunk.schema
+                if self.format == "parquet":
+                    import pyarrow.parquet as pq
+
+                    self._writer = pq.ParquetWriter(self.path, self._schema)
+                else:
+                    self._sink = pa.OSFile(self.path, "wb")
+                    self._writer = pa.ipc.new_file(self._sink, self._schema)
+            self._writer.write_table(chunk)
+        self.rows += len(table)
+        self.chunks += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+# the "spectrum" column of a table as one (n_rows, n_channels) array
+def stack_spectra(table):
+    if "spectrum" not in table:
+        raise ValueError("stack_spectra: table has no 'spectrum' column")
+    if len(table) == 0:
+        return np.zeros((0, N_CHANNELS), dtype=np.int64)
+    return np.stack([np.asarray(s) for s in table["spectrum"]]).astype(np.int64)
+
+
+################################################################################
+###                                READ_SPES                                 ###
+#  Streams a list of SPE files into a single preallocated spectra matrix.      #
+#  Every file is read exactly once and written into its own row, so no         #
+#  table is copied while the loop runs and ingestion time grows linearly       #
+#  with the number of files.                                                   #
+#
+#      INPUTS  : "FILES"  : LIST OF SPE FILE PATHS (E.G. FROM glob.glob)
+#                "MMAP"   : MEMORY-MAP EACH FILE INSTEAD OF READING IT (OPTIONAL)
+#                "WORKERS": PARSE IN A POOL OF N PROCESSES (OPTIONAL)
+#                "CACHE"  : SpeReader.SpeCache TO READ/STORE PARSED FILES (OPTIONAL)
+#                "METRICS": PbMetrics.Metrics TO COUNT FILES, BYTES AND CACHE HITS
+#                "ROI"    : TRUE (DEFAULT REGIONS) OR [(lo, hi), ...]: RETURN THE
+#                           SPECTRA AS A COMPACT SpeRoi.RoiSpectra, BUILT
+#                           ROI_BLOCK FILES AT A TIME (OPTIONAL)
+#      PERFORMS:  READS THE CHANNEL COUNTS AND HEADER OF EACH FILE WITH
+#                 SpeReader.read_spe
+#      OUTPUTS :  "SPECTRA": (n_files, 2048) INTEGER ARRAY, ONE ROW PER FILE
+#                 "HEADERS": STRUCTURED ARRAY, ONE SPE_HEADER_DTYPE RECORD
+#                     PER FILE (detector name, counting date, live time)
+###                                                                          ###
+################################################################################
+
+# number of energy channels in each spectrum
+N_CHANNELS = 2048
+# typed header record kept for every spe file
+SPE_HEADER_DTYPE = [
+    ("det", "U16"),  # detector name, e.g. "DET# 1"
+    ("date", "U32"),  # counting start, MM/DD/YYYY hh:mm:ss
+    ("live_time", "i8"),  # elapsed live counting time (sec)
+]
+
+
+# files read (densely) per block when building a RoiSpectra
+ROI_BLOCK = 4096
+
+
+def read_spes(files, mmap=False, workers=None, cache=None, roi=None, metrics=None):
+    if roi is not None:
+        regions = _roi_regions(roi)
+        parts, headers = [], []
+        for lo in range(0, len(files), ROI_BLOCK):
+            block, block_headers = read_spes(files[lo : lo + ROI_BLOCK], mmap, workers, cache, None, metrics)
+            parts.append(RoiSpectra.from_dense(block, regions))
+            headers.append(block_headers)
+        if not parts:
+            return RoiSpectra(np.zeros((0, sum(hi - lo for lo, hi in regions)), dtype=np.uint8), regions), np.zeros(0, dtype=SPE_HEADER_DTYPE)
+        return RoiSpectra.concatenate(parts), np.concatenate(headers)
+
+    # preallocate the outputs once, then fill them row by row
+    spectra = np.zeros((len(files), N_CHANNELS), dtype=np.int64)
+    headers = np.zeros(len(files), dtype=SPE_HEADER_DTYPE)
+
+    # spectra already in the cache skip parsing entirely
+    todo = list(range(len(files)))
+    if cache is not None:
+        todo = []
+        for i in range(len(files)):
+            hit = cache.get(files[i])
+            if hit is None:
+                todo.append(i)
+            else:
+                spectra[i] = hit[0]
+                headers[i] = tuple(hit[1][name] for name in headers.dtype.names)
+
+    # parse the rest, in a process pool if asked to
+    block = [files[i] for i in todo]
+    if workers is not None and workers > 1 and len(block) > 1:
+        spectra[todo], headers[todo] = _read_spes_parallel(block, mmap, workers)
+    else:
+        for i in todo:
+            spectra[i], headers[i] = _read_one(files[i], mmap)
+
+    if cache is not None:
+        for i in todo:
+            cache.put(files[i], spectra[i], {name: headers[i][name].item() for name in headers.dtype.names})
+        cache.flush()
+    if metrics is not None:
+        metrics.count("files_parsed", len(todo))
+        metrics.count("bytes_read", sum(os.path.getsize(files[i]) for i in todo))
+        if cache is not None:
+            metrics.count("cache_hits", len(files) - len(todo))
+            metrics.count("cache_misses", len(todo))
+    return spectra, headers
+
+
+# the spectra of a SpeArchive, read one stored chunk at a time so the batch
+# is never held twice: a RoiSpectra with roi, else a dense int64 matrix. With
+# keep=False only the window sums (with DETECTORS) are collected and the
+# spectra are None. Returns spectra, (detIDs, 209Po sums, 210Po sums) or None
+def _read_archive(archive, roi, keep, metrics):
+    names = archive.index["det"]
+    regions = None if roi is None else _roi_regions(roi)
+    dense = np.zeros((len(archive), archive.n_channels), dtype=np.int64) if keep and regions is None else None
+    parts, sums = [], []
+    for lo, hi in archive.blocks():
+        block = archive.read(np.arange(lo, hi))
+        metrics.count("bytes_read", block.nbytes)
+        if regions is not None:
+            block = RoiSpectra.from_dense(block, regions)
+            if keep:
+                parts.append(block)
+        elif keep:
+            dense[lo:hi] = block
+        if not keep:
+            sums.append(integrate_windows(block, names[lo:hi]))
+    if not keep:
+        if not sums:
+            sums.append(integrate_windows(np.zeros((0, archive.n_channels), dtype=np.int64), []))
+        return None, tuple(np.concatenate(s) for s in zip(*sums))
+    if regions is None:
+        return dense, None
+    if not parts:
+        return RoiSpectra(np.zeros((0, sum(hi - lo for lo, hi in regions)), dtype=np.uint8), regions), None
+    return RoiSpectra.concatenate(parts), None
+
+
+# channel regions for roi=True (the default regions) or roi=[(lo, hi), ...]
+def _roi_regions(roi):
+    from SpeRoi import default_regions
+
+    return default_regions() if roi is True else roi
+
+
+# parse one spe file into a spectra row and an SPE_HEADER_DTYPE record
+def _read_one(path, mmap=False):
+    channels, header = read_spe(path, mmap=mmap)
+    if len(channels) != N_CHANNELS:
+        raise SpeFormatError(
+            f"{path}: expected {N_CHANNELS} channels, found {len(channels)}"
+        )
+    # raw counts data; name of detector ID, date of counting, live counting time
+    return channels, (header["det"], header["date"], header["live_time"])
+
+
+# split the files into contiguous blocks, parse the blocks in a pool and
+# stitch the results back together in the original file order
+def _read_spes_parallel(files, mmap, workers):
+    n_blocks = min(len(files), 4 * workers)
+    bounds = np.linspace(0, len(files), n_blocks + 1).astype(int)
+    blocks = [files[bounds[k] : bounds[k + 1]] for k in range(n_blocks)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(read_spes, blocks, [mmap] * n_blocks))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+################################################################################
+###                            DETECTOR REGISTRY                             ###
+#  Calibration table for every α-counting chamber, keyed by the detector name  #
+#  written in the SPE header. Each entry holds the detector ID used in the     #
+#  background csv and the active channel bounds for 209Po & 210Po, in the      #
+#  format [209Po lower, 209Po upper, 210Po lower, 210Po upper].                #
+#  Add or re-tune a chamber with register_detector; no code edits needed.      #
+###                                                                          ###
+################################################################################
+
+DETECTORS = {
+    "DET# 1": ("EnsembleInput1", [608, 789, 789, 970]),
+    "DET# 2": ("EnsembleInput2", [608, 789, 789, 970]),
+    "DET# 3": ("EnsembleInput3", [608, 789, 789, 970]),
+    "DET# 4": ("EnsembleInput4", [658, 839, 839, 1020]),
+    "DET# 5": ("EnsembleInput5", [608, 789, 789, 970]),
+    "DET# 6": ("EnsembleInput6", [608, 789, 789, 970]),
+    "DET# 7": ("EnsembleInput7", [608, 789, 789, 970]),
+    "DET# 8": ("EnsembleInput8", [608, 789, 789, 970]),
+}
+
+
+def register_detector(name, detID, windows):
+    DETECTORS[name] = (detID, _check_windows(name, windows, "register_detector"))
+
+
+# the 4 channel bounds as ints, or ValueError
+def _check_windows(name, windows, caller):
+    windows = [int(w) for w in windows]
+    if len(windows) != 4:
+        raise ValueError(f"{caller}: {name!r} needs 4 channel bounds, got {len(windows)}")
+    if not (0 <= windows[0] < windows[1] <= N_CHANNELS and 0 <= windows[2] < windows[3] <= N_CHANNELS):
+        raise ValueError(f"{caller}: bad channel bounds {windows} for {name!r}")
+    return windows
+
+
+################################################################################
+###                           CALIBRATE_WINDOWS                              ###
+#  Finds the 209Po (4.88 MeV) and 210Po (5.30 MeV) peaks of every detector     #
+#  from the summed spectra of a batch and proposes windows that follow them.   #
+#
+#  . spectra of one detector are summed (one reduceat over the sorted batch)
+#    and box-smoothed with a cumulative sum
+#  . the tallest local maximum is one peak; the tallest local maximum at least
+#    MIN_SEPARATION channels away is the other; the lower one is 209Po
+#  . centroids are count-weighted means within ±HALF_WIDTH channels of each
+#    peak (the minimum of the flat gap between the peaks is too noisy to use)
+#  . the proposed windows are the registered ones shifted so the 209Po/210Po
+#    boundary sits midway between the centroids (window widths are kept);
+#    shifts within ±TOLERANCE channels are ignored
+#
+#      INPUTS  : "SPECTRA"  : (n_spectra, n_channels) ARRAY OF COUNTS (OR A
+#                             SpeRoi.RoiSpectra; PEAKS ARE SEARCHED IN ITS REGIONS)
+#                "NAMES"    : DETECTOR NAME OF EACH SPECTRUM ("DET# 1", ...)
+#                "DATES"    : COUNTING DATE OF EACH SPECTRUM (OPTIONAL, USED
+#                             IN THE DRIFT LOG)
+#                "DETECTORS": REGISTRY TO USE (OPTIONAL, DEFAULT DETECTORS)
+#                "APPLY"    : IF TRUE, THE PROPOSED WINDOWS OF DETECTORS WITH AT
+#                             LEAST MIN_COUNTS COUNTS REPLACE THE OLD ONES IN
+#                             "DETECTORS" IF GIVEN, ELSE IN A COPY OF THE
+#                             REGISTRY (THE MODULE'S DETECTORS ARE NEVER CHANGED)
+#                "DRIFT_LOG": CSV TO APPEND ONE ROW PER DETECTOR TO (OPTIONAL)
+#      OUTPUTS :  ONE ROW PER DETECTOR: detID, n_spectra, counts, first/last
+#                 counting date, centroids, valley, current and proposed
+#                 windows, shift (channels) and whether it was applied;
+#                 attrs["detectors"] is the registry with the applied windows
+#                 (pass it on as detectors= to integrate_windows etc.)
+###                                                                          ###
+################################################################################
+
+# columns of the calibration table / drift log
+_CALIBRATION_COLUMNS = [
+    "detector", "detID", "n_spectra", "counts", "first_date", "last_date",
+    "centroid_209Po", "centroid_210Po", "midpoint", "windows", "proposed",
+    "shift (channels)", "applied",
+]
+
+
+def calibrate_windows(spectra, names, dates=None, detectors=None, apply=False, drift_log=None, min_counts=1000, min_separation=60, half_width=10, smooth=5, tolerance=2):
+    if detectors is None:
+        detectors = dict(DETECTORS) if apply else DETECTORS
+    compact = spectra if isinstance(spectra, RoiSpectra) else None
+    spectra = compact.data if compact is not None else np.asarray(spectra)
+    names = np.asarray(names, dtype=str)
+    n_ch = compact.n_channels if compact is not None else spectra.shape[1] if spectra.ndim == 2 else N_CHANNELS
+    unique, inverse = np.unique(names, return_inverse=True)
+    missing = [str(u) for u in unique if u not in detectors]
+    if missing:
+        raise ValueError(f"calibrate_windows: no detector registered as {missing}")
+
+    # one summed spectrum per detector
+    order = np.argsort(inverse, kind="stable")
+    n_spectra = np.bincount(inverse, minlength=len(unique))
+    total = np.zeros((len(unique), n_ch))
+    if len(order):
+        total = np.add.reduceat(spectra[order].astype(np.float64), np.r_[0, np.cumsum(n_spectra)[:-1]], axis=0)
+        if compact is not None:
+            total = compact.expand(total)
+    rows = np.arange(len(unique))
+    ch = np.arange(n_ch)
+
+    # box smoothing: cum[:, c] = counts in channels [0, c)
+    cum = np.zeros((len(unique), n_ch + 1))
+    np.cumsum(total, axis=1, out=cum[:, 1:])
+    lo, hi = np.maximum(ch - smooth, 0), np.minimum(ch + smooth + 1, n_ch)
+    smoothed = (cum[:, hi] - cum[:, lo]) / (hi - lo)
+
+    # the two tallest local maxima at least min_separation channels apart
+    padded = np.pad(smoothed, ((0, 0), (1, 1)), constant_values=-np.inf)
+    local = (smoothed >= padded[:, :-2]) & (smoothed >= padded[:, 2:]) & (smoothed > 0)
+    first = np.argmax(np.where(local, smoothed, -np.inf), axis=1)
+    far = np.abs(ch[None, :] - first[:, None]) >= min_separation
+    second = np.argmax(np.where(local & far, smoothed, -np.inf), axis=1)
+    found = (local & far).any(axis=1)
+    peak209, peak210 = np.minimum(first, second), np.maximum(first, second)
+
+    # count-weighted centroids of both peaks
+    wcum = np.zeros((len(unique), n_ch + 1))
+    np.cumsum(total * ch, axis=1, out=wcum[:, 1:])
+
+    def centroid(peak):
+        a, b = np.maximum(peak - half_width, 0), np.minimum(peak + half_width + 1, n_ch)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (wcum[rows, b] - wcum[rows, a]) / (cum[rows, b] - cum[rows, a])
+
+    c209, c210 = centroid(peak209), centroid(peak210)
+    midpoint = np.rint((c209 + c210) / 2)
+
+    # shift the registered windows so their shared boundary sits midway
+    windows = np.array([detectors[u][1] for u in unique], dtype=np.intp).reshape(-1, 4)
+    boundary = (windows[:, 1] + windows[:, 2]) // 2
+    counts = total.sum(axis=1)
+    usable = found & (counts >= min_counts)
+    usable = usable & np.isfinite(midpoint)
+    shift = np.where(usable, np.nan_to_num(midpoint) - boundary, 0).astype(np.intp)
+    shift[np.abs(shift) <= tolerance] = 0
+    proposed = np.clip(windows + shift[:, None], 0, n_ch)
+
+    if dates is not None:
+        dates = pd.to_datetime(pd.Series(np.asarray(dates, dtype=object)), format="%m/%d/%Y %H:%M:%S")
+        first_date = dates.groupby(inverse).min().reindex(rows)
+        last_date = dates.groupby(inverse).max().reindex(rows)
+    else:
+        first_date = last_date = pd.Series([pd.NaT] * len(unique))
+
+    applied = np.zeros(len(unique), dtype=bool)
+    if apply:
+        for k in np.flatnonzero(usable & (shift != 0)):
+            name = str(unique[k])
+            detectors[name] = (detectors[name][0], _check_windows(name, proposed[k], "calibrate_windows"))
+            applied[k] = True
+
+    table = pd.DataFrame({
+        "detector": unique.astype(object),
+        "detID": [detectors[u][0] for u in unique],
+        "n_spectra": n_spectra,
+        "counts": counts.astype(np.int64),
+        "first_date": first_date.to_numpy(),
+        "last_date": last_date.to_numpy(),
+        "centroid_209Po": np.where(usable, c209, np.nan),
+        "centroid_210Po": np.where(usable, c210, np.nan),
+        "midpoint": np.where(usable, midpoint, np.nan),
+        "windows": [list(map(int, w)) for w in windows],
+        "proposed": [list(map(int, w)) for w in proposed],
+        "shift (channels)": shift,
+        "applied": applied,
+    }, columns=_CALIBRATION_COLUMNS)
+    table.attrs["detectors"] = detectors
+
+    # drift record: one row per detector per calibration, appended over time
+    if drift_log is not None:
+        table.to_csv(drift_log, mode="a", index=False, header=not os.path.exists(drift_log))
+    return table
+
+
+################################################################################
+###                             FIT_PEAK_SHAPES                              ###
+#  Corrects the window sums for the overlap of the two Po peaks. The 210Po     #
+#  peak has a low-energy tail that reaches into the 209Po window (and the      #
+#  209Po peak a little into the 210Po window), which biases the 209Po sum      #
+#  and so the yield of high-activity samples.                                  #
+#
+#  . model, in channels [lower - MARGIN, upper + MARGIN) of the windows:
+#        A_209Po * g(c - mu_209Po) + A_210Po * g(c - mu_210Po) + bkg
+#    g is a Gaussian of width sigma with an exponential low-energy tail that
+#    joins it `tail` channels below the centroid and falls off over `tau`
+#    channels (the value is continuous; the slope is free, as real tails
+#    are flatter than the Gaussian where they join)
+#  . fits are weighted Levenberg-Marquardt steps run for a whole block of
+#    spectra at once (batched normal equations), at most MAX_ITER steps each;
+#    weights are 1/counts for the summed spectra and 1/(warm-start model)
+#    for single spectra
+#  . the summed spectrum of every detector is fitted first, with all eight
+#    parameters free; its result is the warm start of that detector's
+#    spectra, which then fit amplitudes, centroids and background with the
+#    detector's sigma, tail and tau
+#  . corrected sums move the fitted counts of each peak that fall in the
+#    other peak's window back to their own window (the total is unchanged)
+#
+#      INPUTS  : "SPECTRA": (n_spectra, n_channels) ARRAY OF COUNTS OR A
+#                           SpeRoi.RoiSpectra COVERING THE FIT RANGE
+#                "NAMES"  : DETECTOR NAME OF EACH SPECTRUM ("DET# 1", ...)
+#      OUTPUTS :  ONE ROW PER SPECTRUM: detector, the _PEAK_PARAMS, chi2_red,
+#                 converged, the counts each peak puts in the other's window,
+#                 and the corrected 209Po_decays / 210Po_decays (counts)
+#
+#  Used by spe_to_counts(tail_correction=True).
+###                                                                          ###
+################################################################################
+
+# channels fitted on either side of the windows
+TAIL_FIT_MARGIN = 50
+# fitted parameters, in this order
+_PEAK_PARAMS = ["A_209Po", "A_210Po", "mu_209Po", "mu_210Po", "sigma", "tail", "tau", "bkg"]
+# parameters fitted per spectrum (the shape comes from the detector fit)
+_SPECTRUM_FREE = np.array([True, True, True, True, False, False, False, True])
+
+
+def fit_peak_shapes(spectra, names, detectors=None, margin=TAIL_FIT_MARGIN, max_iter=30, tol=1e-6, block=2048):
+    if detectors is None:
+        detectors = DETECTORS
+    compact = spectra if isinstance(spectra, RoiSpectra) else None
+    if compact is None:
+        spectra = np.asarray(spectra)
+    n, n_ch = len(spectra), spectra.shape[1]
+    names = np.asarray(names, dtype=str)
+    unique, inverse = np.unique(names, return_inverse=True)
+    missing = [str(u) for u in unique if u not in detectors]
+    if missing:
+        raise ValueError(f"fit_peak_shapes: no detector registered as {missing}")
+
+    # fit range of every detector, all padded to the widest one
+    windows = np.array([detectors[u][1] for u in unique], dtype=np.intp).reshape(-1, 4)
+    lo = np.maximum(windows[:, 0] - margin, 0)
+    hi = np.minimum(windows[:, 3] + margin, n_ch)
+    width = int((hi - lo).max()) if len(unique) else 1
+    if compact is not None and not compact.covers(lo, hi).all():
+        raise ValueError(f"fit_peak_shapes: fit ranges {list(zip(lo.tolist(), hi.tolist()))} reach outside the kept regions {compact.regions}")
+
+    # detector fits on the summed spectra
+    order = np.argsort(inverse, kind="stable")
+    n_spectra = np.bincount(inverse, minlength=len(unique))
+    data = compact.data if compact is not None else spectra
+    total = np.zeros((len(unique), n_ch))
+    if n:
+        total = np.add.reduceat(data[order].astype(np.float64), np.r_[0, np.cumsum(n_spectra)[:-1]], axis=0)
+        if compact is not None:
+            total = compact.expand(total)
+    x, mask = _fit_grid(lo, hi, width)
+    y = np.take_along_axis(total, np.minimum(x, n_ch - 1).astype(np.intp), axis=1) * mask
+    bounds = _peak_bounds(windows, lo, hi)
+    det_params, _, _ = _fit_peaks(y, x, mask / np.maximum(y, 1), _peak_guess(y, x, mask, windows), np.ones(len(_PEAK_PARAMS), dtype=bool), bounds, max_iter, tol)
+
+    # spectrum fits, warm-started from their detector, one block at a time
+    params = np.zeros((n, len(_PEAK_PARAMS)))
+    chi2_red = np.zeros(n)
+    converged = np.zeros(n, dtype=bool)
+    scale = 1 / np.maximum(n_spectra, 1)
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start + block, n))
+        d = inverse[rows]
+        dense = compact[rows].to_dense() if compact is not None else spectra[rows]
+        xb, mb = x[d], mask[d]
+        yb = np.take_along_axis(dense, np.minimum(xb, n_ch - 1).astype(np.intp), axis=1) * mb
+        p0 = det_params[d].copy()
+        p0[:, [0, 1, 7]] *= scale[d, None]
+        # Poisson weights from the warm-start model (single spectra are too
+        # sparse to weight by their own counts)
+        wb = mb / np.maximum(_peak_model(xb, p0, False)[0], 1)
+        params[rows], chi2_red[rows], converged[rows] = _fit_peaks(yb, xb, wb, p0, _SPECTRUM_FREE, bounds[:, d], max_iter, tol)
+
+    # fitted counts of each peak inside the other peak's window
+    spill_210 = np.zeros(n)
+    spill_209 = np.zeros(n)
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start + block, n))
+        d = inverse[rows]
+        xb, p = x[d], params[rows]
+        g209, _ = _gauss_exp(xb - p[:, 2:3], p[:, 4:5], p[:, 5:6], p[:, 6:7])
+        g210, _ = _gauss_exp(xb - p[:, 3:4], p[:, 4:5], p[:, 5:6], p[:, 6:7])
+        w = windows[d]
+        in209 = mask[d] * (xb >= w[:, 0:1]) * (xb < w[:, 1:2])
+        in210 = mask[d] * (xb >= w[:, 2:3]) * (xb < w[:, 3:4])
+        spill_210[rows] = p[:, 1] * (g210 * in209).sum(axis=1)
+        spill_209[rows] = p[:, 0] * (g209 * in210).sum(axis=1)
+
+    _, po209, po210 = integrate_windows(spectra, names, detectors)
+    table = pd.DataFrame(params, columns=_PEAK_PARAMS)
+    table.insert(0, "detector", names.astype(object))
+    table["chi2_red"] = chi2_red
+    table["converged"] = converged
+    table["210Po_in_209Po_window (counts)"] = spill_210
+    table["209Po_in_210Po_window (counts)"] = spill_209
+    table["209Po_decays (counts)"] = po209 - spill_210 + spill_209
+    table["210Po_decays (counts)"] = po210 - spill_209 + spill_210
+    return table
+
+
+# channel grid (n_fits, width) of each fit range [lo, hi), with its mask
+def _fit_grid(lo, hi, width):
+    x = lo[:, None] + np.arange(width)[None, :]
+    return x.astype(np.float64), (x < hi[:, None]).astype(np.float64)
+
+
+# Gaussian with an exponential low-energy tail joined k channels below the
+# centroid, falling off over tau channels; returns the shape and the mask of
+# the Gaussian part
+def _gauss_exp(d, sigma, k, tau):
+    core = d >= -k
+    return np.exp(np.where(core, -0.5 * d * d / (sigma * sigma), -0.5 * k * k / (sigma * sigma) + (d + k) / tau)), core
+
+
+# model and Jacobian (n_fits, width, 8) for parameters p (n_fits, 8)
+def _peak_model(x, p, jacobian=True):
+    a1, a2, mu1, mu2, sigma, k, tau, bkg = (p[:, i : i + 1] for i in range(len(_PEAK_PARAMS)))
+    d1, d2 = x - mu1, x - mu2
+    g1, core1 = _gauss_exp(d1, sigma, k, tau)
+    g2, core2 = _gauss_exp(d2, sigma, k, tau)
+    model = a1 * g1 + a2 * g2 + bkg
+    if not jacobian:
+        return model, None
+    s2, s3 = sigma * sigma, sigma * sigma * sigma
+    # derivatives of log g, core / tail
+    G1, G2 = a1 * g1, a2 * g2
+    J = np.empty(x.shape + (len(_PEAK_PARAMS),))
+    J[..., 0] = g1
+    J[..., 1] = g2
+    J[..., 2] = G1 * np.where(core1, d1 / s2, -1 / tau)
+    J[..., 3] = G2 * np.where(core2, d2 / s2, -1 / tau)
+    J[..., 4] = G1 * np.where(core1, d1 * d1, k * k) / s3 + G2 * np.where(core2, d2 * d2, k * k) / s3
+    J[..., 5] = G1 * np.where(core1, 0, 1 / tau - k / s2) + G2 * np.where(core2, 0, 1 / tau - k / s2)
+    J[..., 6] = -(G1 * np.where(core1, 0, d1 + k) + G2 * np.where(core2, 0, d2 + k)) / (tau * tau)
+    J[..., 7] = 1
+    return model, J
+
+
+# starting values from the tallest channel of each window
+def _peak_guess(y, x, mask, windows):
+    p = np.zeros((len(y), len(_PEAK_PARAMS)))
+    bkg = np.array([np.percentile(row[m > 0], 10) if (m > 0).any() else 0 for row, m in zip(y, mask)])
+    for j, (a, b) in enumerate([(0, 1), (2, 3)]):
+        inside = (x >= windows[:, a : a + 1]) & (x < windows[:, b : b + 1])
+        top = np.argmax(np.where(inside, y, -1), axis=1)
+        p[:, j] = np.maximum(y[np.arange(len(y)), top] - bkg, 1)
+        p[:, 2 + j] = x[np.arange(len(y)), top]
+    p[:, 4] = 10
+    p[:, 5] = 10
+    p[:, 6] = 20
+    p[:, 7] = bkg
+    return p
+
+
+# (2, n_detectors, 8) lower and upper parameter bounds of each fit
+def _peak_bounds(windows, lo, hi):
+    lower = np.zeros((len(windows), len(_PEAK_PARAMS)))
+    upper = np.full((len(windows), len(_PEAK_PARAMS)), np.inf)
+    lower[:, 2], upper[:, 2] = lo, windows[:, 2]
+    lower[:, 3], upper[:, 3] = windows[:, 1], hi
+    lower[:, 4], upper[:, 4] = 1, 100
+    lower[:, 5], upper[:, 5] = 0.5, 200
+    lower[:, 6], upper[:, 6] = 1, 500
+    return np.stack([lower, upper])
+
+
+# batched Levenberg-Marquardt with fixed weights w (n_fits, width), zero
+# outside the fit range; bounds are (2, n_fits, 8); returns the parameters,
+# reduced chi2 and whether each fit converged
+def _fit_peaks(y, x, w, p, free, bounds, max_iter, tol):
+    p = np.clip(p, bounds[0], bounds[1])
+    m, nf = len(y), int(free.sum())
+    lam = np.full(m, 1e-2)
+    done = np.zeros(m, dtype=bool)
+    eye = np.eye(nf)
+    for _ in range(max_iter):
+        a = np.flatnonzero(~done)
+        if len(a) == 0:
+            break
+        model, J = _peak_model(x[a], p[a])
+        r = y[a] - model
+        chi2 = (w[a] * r * r).sum(axis=1)
+        J = J[..., free]
+        JW = J * w[a, :, None]
+        H = np.einsum("mli,mlj->mij", JW, J)
+        g = np.einsum("mli,ml->mi", JW, r)
+        diag = np.diagonal(H, axis1=1, axis2=2)
+        step = np.linalg.solve(H + eye * (lam[a, None] * diag + 1e-9)[:, None, :], g[..., None])[..., 0]
+        trial = p[a].copy()
+        trial[:, free] += step
+        trial = np.clip(trial, bounds[0][a], bounds[1][a])
+        new = (w[a] * (y[a] - _peak_model(x[a], trial, False)[0]) ** 2).sum(axis=1)
+        better = new < chi2
+        p[a[better]] = trial[better]
+        lam[a] = np.where(better, lam[a] / 3, lam[a] * 4)
+        # converged: a step that no longer helps, or no step that helps at all
+        done[a] = (better & (chi2 - new <= tol * chi2)) | (lam[a] > 1e8)
+
+    mask = w > 0
+    model, _ = _peak_model(x, p, False)
+    dof = np.maximum(mask.sum(axis=1) - free.sum(), 1)
+    chi2_red = (mask * (y - model) ** 2 / np.maximum(model, 1)).sum(axis=1) / dof
+    return p, chi2_red, done
+
+
+################################################################################
+###                            INTEGRATE_WINDOWS                             ###
+#  Sums the 209Po and 210Po windows of a whole batch of spectra at once.       #
+#  A cumulative sum along the channel axis turns every window sum into the     #
+#  difference of two lookups, so the cost does not depend on window width      #
+#  and there is no per-spectrum Python dispatch.                               #
+#
+#      INPUTS  : "SPECTRA"  : (n_spectra, n_channels) ARRAY OF COUNTS, OR A
+#                             SpeRoi.RoiSpectra WHOSE REGIONS HOLD THE WINDOWS
+#                "NAMES"    : DETECTOR NAME OF EACH SPECTRUM ("DET# 1", ...)
+#                "DETECTORS": REGISTRY TO USE (OPTIONAL, DEFAULT DETECTORS)
+#      OUTPUTS :  detIDs, 209Po SUMS, 210Po SUMS (ONE ENTRY PER SPECTRUM)
+###                                                                          ###
+################################################################################
+
+
+def integrate_windows(spectra, names, detectors=None):
+    if detectors is None:
+        detectors = DETECTORS
+    if not isinstance(spectra, RoiSpectra):
+        spectra = np.asarray(spectra)
+    n = len(spectra)
+
+    # look each distinct detector up once, then broadcast to the spectra
+    unique, inverse = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+    missing = [str(u) for u in unique if u not in detectors]
+    if missing:
+        raise ValueError(f"integrate_windows: no detector registered as {missing}")
+    detIDs = np.array([detectors[u][0] for u in unique], dtype=object)[inverse]
+    windows = np.array([detectors[u][1] for u in unique], dtype=np.intp).reshape(-1, 4)[inverse]
+
+    if isinstance(spectra, RoiSpectra):
+        outside = ~(spectra.covers(windows[:, 0], windows[:, 1]) & spectra.covers(windows[:, 2], windows[:, 3]))
+        if outside.any():
+            raise ValueError(f"integrate_windows: windows of {sorted(set(np.asarray(names, dtype=str)[outside].tolist()))} reach outside the kept regions {spectra.regions}")
+        cum = spectra.cumulative(windows)
+        return detIDs, cum[:, 1] - cum[:, 0], cum[:, 3] - cum[:, 2]
+
+    # cum[:, c] = total counts in channels [0, c)
+    cum = np.zeros((n, spectra.shape[1] + 1), dtype=np.int64)
+    np.cumsum(spectra, axis=1, out=cum[:, 1:])
+    rows = np.arange(n)
+    po209 = cum[rows, windows[:, 1]] - cum[rows, windows[:, 0]]
+    po210 = cum[rows, windows[:, 3]] - cum[rows, windows[:, 2]]
+    return detIDs, po209, po210
+
+
+################################################################################
+###                              SWEEP_WINDOWS                               ###
+#  Window sums for a grid of candidate windows per detector, from spectra      #
+#  already in memory: one cumulative sum per spectrum, then two lookups per    #
+#  window, for every candidate at once.                                        #
+#
+#      INPUTS  : "SPECTRA"   : (n_spectra, n_channels) ARRAY OF COUNTS OR A
+#                              SpeRoi.RoiSpectra
+#                "NAMES"     : DETECTOR NAME OF EACH SPECTRUM ("DET# 1", ...)
+#                "CANDIDATES": (k, 4) WINDOW SETS USED FOR EVERY DETECTOR, OR
+#                              A DICT {DETECTOR NAME: (k, 4) WINDOW SETS};
+#                              DETECTORS MISSING FROM THE DICT KEEP THEIR
+#                              REGISTERED WINDOWS AS THEIR ONLY CANDIDATE
+#      OUTPUTS :  ONE ROW PER (SPECTRUM, CANDIDATE): row, detector, candidate
+#                 (INDEX INTO THAT DETECTOR'S GRID), windows, 209Po_decays
+#                 (counts), 210Po_decays (counts)
+#
+#  window_grid(windows, lower, boundary, upper) builds a grid by shifting the
+#  209Po lower edge, the 209Po/210Po boundary and the 210Po upper edge by
+#  every combination of the given channel offsets.
+###                                                                          ###
+################################################################################
+
+
+def window_grid(windows, lower=(0,), boundary=(0,), upper=(0,)):
+    windows = np.asarray(windows, dtype=np.intp)
+    return np.array([windows + [dl, db, db, du] for dl, db, du in itertools.product(lower, boundary, upper)])
+
+
+def sweep_windows(spectra, names, candidates, detectors=None):
+    if detectors is None:
+        detectors = DETECTORS
+    if not isinstance(spectra, RoiSpectra):
+        spectra = np.asarray(spectra)
+    n_ch = spectra.shape[1]
+    names = np.asarray(names, dtype=str)
+    unique, inverse = np.unique(names, return_inverse=True)
+    missing = [str(u) for u in unique if u not in detectors]
+    if missing:
+        raise ValueError(f"sweep_windows: no detector registered as {missing}")
+
+    # every detector's grid, padded to the longest one
+    grids = []
+    for u in unique:
+        grid = candidates.get(u, [detectors[u][1]]) if isinstance(candidates, dict) else candidates
+        grid = np.asarray(grid, dtype=np.intp).reshape(-1, 4)
+        bad = ~((0 <= grid[:, 0]) & (grid[:, 0] < grid[:, 1]) & (grid[:, 1] <= n_ch) & (0 <= grid[:, 2]) & (grid[:, 2] < grid[:, 3]) & (grid[:, 3] <= n_ch))
+        if bad.any():
+            raise ValueError(f"sweep_windows: bad channel bounds {grid[bad].tolist()} for {str(u)!r}")
+        grids.append(grid)
+    k = max([len(g) for g in grids], default=1)
+    bounds = np.zeros((len(unique), k, 4), dtype=np.intp)
+    valid = np.zeros((len(unique), k), dtype=bool)
+    for d, grid in enumerate(grids):
+        bounds[d, : len(grid)] = grid
+        valid[d, : len(grid)] = True
+    bounds, valid = bounds[inverse], valid[inverse]
+
+    if isinstance(spectra, RoiSpectra):
+        inside = spectra.covers(bounds[..., 0], bounds[..., 1]) & spectra.covers(bounds[..., 2], bounds[..., 3])
+        if (valid & ~inside).any():
+            raise ValueError(f"sweep_windows: candidate windows reach outside the kept regions {spectra.regions}")
+        cum = spectra.cumulative(bounds.reshape(len(names), -1))
+    else:
+        cum = _cumulative(spectra, bounds.reshape(len(names), -1))
+    cum = cum.reshape(len(names), k, 4)
+
+    row, cand = np.nonzero(valid)
+    return pd.DataFrame({
+        "row": row,
+        "detector": names[row].astype(object),
+        "candidate": cand,
+        "windows": [list(map(int, w)) for w in bounds[row, cand]],
+        "209Po_decays (counts)": (cum[..., 1] - cum[..., 0])[row, cand],
+        "210Po_decays (counts)": (cum[..., 3] - cum[..., 2])[row, cand],
+    })
+
+
+# counts in channels [0, bound) of each row, for (n_spectra, k) bounds;
+# cumulative sums are built block by block
+def _cumulative(spectra, bounds, block=8192):
+    out = np.empty(bounds.shape, dtype=np.int64)
+    for lo in range(0, len(spectra), block):
+        part = spectra[lo : lo + block]
+        cum = np.zeros((len(part), part.shape[1] + 1), dtype=np.int64)
+        np.cumsum(part, axis=1, out=cum[:, 1:])
+        out[lo : lo + len(part)] = np.take_along_axis(cum, bounds[lo : lo + len(part)], axis=1)
+    return out
+
+
 ################################################################################
 ###                              DET_MATCH_SUM                               ###
 #  Uses header info from an SPE file to match it to a particular detector.     #
@@ -174,183 +1324,62 @@ def spe_to_counts(SPEs_path, labsheet_path, fout, **PlotSPEs):
 #                                                                            
 #      INPUTS  : "COUNTS": SPECTRAL DATA FROM A SINGLE SPE FILE
 #                    "NAME"  : DETECTOR NAME AS OBTAINED VIA speName
-#      PERFORMS:  MATCHES SPECTRAL DATA TO A SPECIFIC DETECTOR, AND
-#                     SUMS DATA FOR 209Po, 210Po FOR EACH UNIQUE DETECTOR
+#      PERFORMS:  MATCHES SPECTRAL DATA TO A SPECIFIC DETECTOR (SEE DETECTORS),
+#                     AND SUMS DATA FOR 209Po, 210Po IN ITS WINDOWS
 #      OUTPUTS :  SUMMED 209Po, 210Po DATA FOR EACH COLUMN
+#
+#  For batches of spectra use integrate_windows, which gives the same sums.
 ###                                                                          ###
 ################################################################################
 
 
 def det_match_sum(counts,name,sampleID,PlotSPEs):
-    import numpy as np
+    if name not in DETECTORS:
+        raise ValueError(f"det_match_sum: no detector registered as {name!r}")
+    detID, det = DETECTORS[name]
+    po209 = np.sum(counts[det[0] : det[1]])
+    po210 = np.sum(counts[det[2] : det[3]])
+    if PlotSPEs == True:
+        _plot_integration(counts, detID, det, sampleID)
+    return detID, po209, po210
+
+
+def _plot_integration(counts, detID, det, sampleID):
     import matplotlib.pyplot as plt
+    from PlotTools import draw_integration
 
-    #SET ACTIVE CHANNEL BOUNDS FOR 209Po & 210Po
-    #format is [209Po lower, 209Po upper, 210Po lower, 210Po upper]
-    det1 = [608, 789, 789, 970]
-    det2 = [608, 789, 789, 970]
-    det3 = [608, 789, 789, 970]
-    det4 = [658, 839, 839, 1020]
-    det5 = [608, 789, 789, 970]
-    det6 = [608, 789, 789, 970]
-    det7 = [608, 789, 789, 970]
-    det8 = [608, 789, 789, 970]
-    
-    
-    if name == "DET# 1":
-        po209 = np.sum(counts[det1[0] : det1[1]])
-        po210 = np.sum(counts[det1[2] : det1[3]])
-        detID = "EnsembleInput1"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det1[0] : det1[1]],0, counts[det1[0] : det1[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det1[2] : det1[3]],0, counts[det1[2] : det1[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det1[0]-100 : det1[3]+100],0, counts[det1[0]-100 : det1[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det1[0]}:{det1[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det1[2]}:{det1[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-            
-      
-
-    elif name == "DET# 2":
-        po209 = np.sum(counts[det2[0] : det2[1]])
-        po210 = np.sum(counts[det2[2] : det2[3]])
-        detID = "EnsembleInput2"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det2[0] : det2[1]],0, counts[det2[0] : det2[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det2[2] : det2[3]],0, counts[det2[2] : det2[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det2[0]-100 : det2[3]+100],0, counts[det2[0]-100 : det2[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det2[0]}:{det2[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det2[2]}:{det2[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-        
-        
-    elif name == "DET# 3":
-        po209 = np.sum(counts[det3[0] : det3[1]])
-        po210 = np.sum(counts[det3[2] : det3[3]])
-        detID = "EnsembleInput3"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det3[0] : det3[1]],0, counts[det3[0] : det3[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det3[2] : det3[3]],0, counts[det3[2] : det3[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det3[0]-100 : det3[3]+100],0, counts[det3[0]-100 : det3[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det3[0]}:{det3[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det3[2]}:{det3[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-        
-        
-    elif name == "DET# 4":
-        po209 = np.sum(counts[det4[0] : det4[1]])
-        po210 = np.sum(counts[det4[2] : det4[3]])
-        detID = "EnsembleInput4"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det4[0] : det4[1]],0, counts[det4[0] : det4[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det4[2] : det4[3]],0, counts[det4[2] : det4[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det4[0]-100 : det4[3]+100],0, counts[det4[0]-100 : det4[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det4[0]}:{det4[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det4[2]}:{det4[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-        
-        
-    elif name == "DET# 5":
-        po209 = np.sum(counts[det5[0] : det5[1]])
-        po210 = np.sum(counts[det5[2] : det5[3]])
-        detID = "EnsembleInput5"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det5[0] : det5[1]],0, counts[det5[0] : det5[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det5[2] : det5[3]],0, counts[det5[2] : det5[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det5[0]-100 : det5[3]+100],0, counts[det5[0]-100 : det5[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det5[0]}:{det5[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det5[2]}:{det5[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-        
-        
-    elif name == "DET# 6":
-        po209 = np.sum(counts[det6[0] : det6[1]])
-        po210 = np.sum(counts[det6[2] : det6[3]])
-        detID = "EnsembleInput6"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det6[0] : det6[1]],0, counts[det6[0] : det6[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det6[2] : det6[3]],0, counts[det6[2] : det6[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det6[0]-100 : det6[3]+100],0, counts[det6[0]-100 : det6[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det6[0]}:{det6[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det6[2]}:{det6[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-        
-        
-    elif name == "DET# 7":
-        po209 = np.sum(counts[det7[0] : det7[1]])
-        po210 = np.sum(counts[det7[2] : det7[3]])
-        detID = "EnsembleInput7"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det7[0] : det7[1]],0, counts[det7[0] : det7[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det7[2] : det7[3]],0, counts[det7[2] : det7[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det7[0]-100 : det7[3]+100],0, counts[det7[0]-100 : det7[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det7[0]}:{det7[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det7[2]}:{det7[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-        
-        
-    elif name == "DET# 8":
-        po209 = np.sum(counts[det8[0] : det8[1]])
-        po210 = np.sum(counts[det8[2] : det8[3]])
-        detID = "EnsembleInput8"
-        if PlotSPEs == True:
-            fig, ax = plt.subplots(figsize=(10,4))
-            ax.fill_between(counts.index.values[det8[0] : det8[1]],0, counts[det8[0] : det8[1]],color='red', zorder=3)
-            ax.fill_between(counts.index.values[det8[2] : det8[3]],0, counts[det8[2] : det8[3]],color='blue', zorder=4)
-            ax.fill_between(counts.index.values[det8[0]-100 : det8[3]+100],0, counts[det8[0]-100 : det8[3]+100],color='0.7', zorder=1)
-            ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
-            ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
-            ax.text(.885, .922, f'[{det8[0]}:{det8[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
-            ax.text(.885, .86, f'[{det8[2]}:{det8[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
-            ax.legend(['209Po', '210Po', 'not counted         '])
-            ax.set_ylabel('counts')
-            ax.set_xlabel('decay energy channels')
-    else:
-        print("ERROR det_match_sum: no match found")
-    return detID, po209, po210
+    fig, ax = plt.subplots(figsize=(10,4))
+    draw_integration(ax, counts, detID, det, sampleID)
+    return fig, ax
+
+
+# background columns carried into the activity table, keyed by the name they
+# have in the background csv (after the cpm columns are derived from it)
+_BKG_COLUMNS = {
+    "counts Po209": "BKG counts Pb209",
+    "counts Po210": "BKG counts Pb210",
+    "counting time (sec)": "BKG counts (sec)",
+    "209Po_detector_background_activity (cpm)": "209Po_detector_background_activity (cpm)",
+    "210Po_detector_background_activity (cpm)": "210Po_detector_background_activity (cpm)",
+}
+
+
+# look up every sample's detector background with one keyed join on the
+# detector name; returns one background row per sample, in sample order
+def _join_backgrounds(detIDs, bkg):
+    names = bkg["Detector Name"]
+    duplicated = sorted(names[names.duplicated()].unique())
+    if duplicated:
+        raise ValueError(
+            f"counts_to_activity: detector(s) {duplicated} listed more than once in the background csv"
+        )
+    missing = sorted(set(detIDs) - set(names))
+    if missing:
+        raise ValueError(
+            f"counts_to_activity: no background row for detector(s) {missing}"
+        )
+    a = bkg.set_index("Detector Name").reindex(detIDs)
+    return a[list(_BKG_COLUMNS)].rename(columns=_BKG_COLUMNS).reset_index(drop=True)
 
 
 ################################################################################
@@ -359,10 +1388,30 @@ def det_match_sum(counts,name,sampleID,PlotSPEs):
 #     corrections: decay during sample processing, salt weight, %mud           #
 #
 #                                    INPUTS:                               
-#  INPUT #1: csv produced by the "spe_to_counts" function (see above col info
-#  INPUT #2: csv of detector background activity with the following column order
-#  INPUT #3: csv of
-#
+#  INPUT #1: csv/parquet/feather table produced by the "spe_to_counts" function
+#            (see above col info); columnar tables keep their typed timestamps.
+#            Array columns (the "spectrum" of spectra_column=True) are not
+#            carried into the result, so it can be written to any format
+#  INPUT #2: csv of detector background activity with the following columns
+#            (any order, extra columns are ignored, one row per detector):
+#            "Detector Name", "counts Po209", "counts Po210", "counting time (sec)"
+#  INPUT #3: supported 210Pb level (dpm/g)
+#  OPTIONAL: any CORE_METADATA value as a keyword, e.g. t_collection="10/15/2021"
+#  OPTIONAL: mc_draws=N also propagates the input uncertainties by Monte Carlo
+#            (see activity_monte_carlo) and adds mean/std/percentile columns
+#  OPTIONAL: fout=<path> also writes the result (csv, .parquet or .feather,
+#            see TABLE I/O)
+#  OPTIONAL: columns=[...] keeps only those output columns (in that order);
+#            computed columns not listed (VolFrac_sed, the error terms, ...)
+#            are never added to the table, though correction_chain still
+#            fills its whole buffer
+#  OPTIONAL: chunksize=N streams INPUT #1 N rows at a time: every chunk is
+#            computed and appended to fout before the next is read, so memory
+#            stays at one chunk's intermediates whatever the table size
+#            (returns None when fout is given; no mc_draws)
+#  OPTIONAL: metrics=PbMetrics.Metrics(...) collects stage timings (read,
+#            timestamps, background join, correction chain, columns, errors,
+#            cleanup, monte carlo, write); also in cts.attrs["metrics"]
 #
 #                                   RETURNS:                                                 
 #                  A pd.dataframe with the following columns:                                
@@ -427,130 +1476,531 @@ def det_match_sum(counts,name,sampleID,PlotSPEs):
 ################################################################################
 
 
-def counts_to_activity(counts_fname, bkg_fname, supLvl):
-    # Imports
-    import matplotlib.pyplot as plt
-    from datetime import datetime
-    import numpy as np
-    import pandas as pd
+################################################################################
+###                             DEFINE CONSTANTS.                            ###
 
-    ################################################################################
-    ###                             DEFINE CONSTANTS.                            ###
-    
-    # core collection date
-    t_collection_yCE = datetime.strptime("10/15/2021", "%m/%d/%Y")  
-    # spike calibration date
-    t_spikeCal = datetime.strptime("08/15/2016", "%m/%d/%Y")  
+# per-core and per-spike values. counts_to_activity uses these unless they are
+# passed as keyword arguments; counts_to_activity_batch takes them per core
+CORE_METADATA = {
+    # core collection date (MM/DD/YYYY)
+    "t_collection": "10/15/2021",
+    # spike calibration date (MM/DD/YYYY)
+    "t_spikeCal": "08/15/2016",
     # volume of spike used per sample, ml
-    spike_volume_ml = 0.998     
+    "spike_volume_ml": 0.998,
     # spike activity at the time of calibration, dpm/ml
-    C_spike_atCal_dpmml = 12.0469862348134  
+    "C_spike_atCal_dpmml": 12.0469862348134,
     # the uncertainty associated with spike activity
-    u_C_spike_atCal_dpmml = 0.4  
-    
-    # decay constant of 210Pb, in min^-1
-    λ_210Pb_min = 0.00000005914  
-    # decay constant of 210Po, in min^-1
-    λ_210Po_min = 0.000003472848 
-    # decay constant of 209Po, in min^-1
-    λ_209Po_min = 0.00000001292  
-    
-    # density of porewater, g/cm^3
-    ρ_porewater_gcm3 = 1.025     
-    # density of sediment, g/cm^3
-    ρ_particle_gcm3 = 2.65       
-    # mass salt fraction of seawater
-    porewater_saltFrac = 0.025   
-    
-    ###                              END OF CONSTANTS                            ###
-    ################################################################################
+    "u_C_spike_atCal_dpmml": 0.4,
+}
 
-    print(
-        "|----------------------  COUNTS2ACTIVITY STARTED  ----------------------|")
-    print(
-        f"||    Data from file:       {counts_fname}                               "
-    )
-    print(
-        f"||    Detector backgrounds: {bkg_fname}                                  "
-    )
-    print(
-        f"||    Supported level:      {supLvl} dpm/g                               "
-    )
+# decay constant of 210Pb, in min^-1
+λ_210Pb_min = 0.00000005914
+# decay constant of 210Po, in min^-1
+λ_210Po_min = 0.000003472848
+# decay constant of 209Po, in min^-1
+λ_209Po_min = 0.00000001292
 
-    # read in csv files specified by user
-    cts = pd.read_csv(counts_fname, float_precision="round_trip", header=0)
-    bkg = pd.read_csv(bkg_fname)
-
-    # CALCULATE SEDIMENT BULK DENSITY AND POROSITY
-    # weight fraction of water and salt in preprocessed aliquot
-    cts["WeightFrac_Water+Salt"] = (
-        (cts["M_WetSed+Pan (g)"] - cts["M_pan (g)"])
-        - (cts["M_DrySed+Pan (g)"] - cts["M_pan (g)"])
-    ) / (cts["M_WetSed+Pan (g)"] - cts["M_pan (g)"])
-    # weight fraction of sediment and salt in preprocessed aliquot
-    cts["WeightFrac_Sed+Salt"] = 1 - cts["WeightFrac_Water+Salt"]
-    # weight of sediment aliquot used in wet chemistry
-    cts["M_WetChemSed_SaltCorrected (g)"] = cts["M_WetChemSed (g)"] - (
-        (cts["WeightFrac_Water+Salt"] * porewater_saltFrac)
-        * (cts["M_WetChemSed (g)"] / cts["WeightFrac_Sed+Salt"])
-    )
-    # volume fraction of water and salt using density assumptions
-    cts["VolFrac_water+salt"] = (
-        cts["WeightFrac_Water+Salt"] / (1 - porewater_saltFrac)
-    ) * (1 / ρ_porewater_gcm3)
-    # volume fraction of sediment only using density assumptions
-    cts["VolFrac_sed"] = (
-        cts["WeightFrac_Sed+Salt"]
-        - (
-            cts["WeightFrac_Water+Salt"]
-            * (porewater_saltFrac / (1 - porewater_saltFrac))
+# density of porewater, g/cm^3
+ρ_porewater_gcm3 = 1.025
+# density of sediment, g/cm^3
+ρ_particle_gcm3 = 2.65
+# mass salt fraction of seawater
+porewater_saltFrac = 0.025
+
+###                              END OF CONSTANTS                            ###
+################################################################################
+
+
+def counts_to_activity(counts_fname, bkg_fname, supLvl, mc_draws=None, fout=None, chunksize=None, columns=None, metrics=None, **metadata):
+    unknown = sorted(set(metadata) - set(CORE_METADATA))
+    if unknown:
+        raise TypeError(f"counts_to_activity: unknown metadata {unknown}, expected {list(CORE_METADATA)}")
+    if chunksize and mc_draws:
+        raise ValueError("counts_to_activity: mc_draws needs the whole table (draws are shared across rows), not chunksize")
+
+    metrics = Metrics() if metrics is None else metrics
+    with metrics.track():
+        log.info(
+            "|----------------------  COUNTS2ACTIVITY STARTED  ----------------------|")
+        log.info(
+            f"||    Data from file:       {counts_fname}                               "
+        )
+        log.info(
+            f"||    Detector backgrounds: {bkg_fname}                                  "
+        )
+        log.info(
+            f"||    Supported level:      {supLvl} dpm/g                               "
         )
-    ) / (ρ_particle_gcm3)
-    # porosity of sediment with no salt correction
-    cts["Φ_uncorrected (volfrac)"] = (
-        cts["WeightFrac_Water+Salt"] * ρ_particle_gcm3
-    ) / (
-        (cts["WeightFrac_Water+Salt"] * ρ_particle_gcm3)
-        + (1 - cts["WeightFrac_Water+Salt"]) * ρ_porewater_gcm3
-    )
-    # porosity after salt correction
-    cts["Φ_saltcor (volfrac)"] = (cts["VolFrac_water+salt"]) / (
-        cts["VolFrac_water+salt"] + cts["VolFrac_sed"]
-    )
-    # material bulk density before drying
-    cts["ρ_bulk_wet (g/cm3)"] = (1 - cts["Φ_saltcor (volfrac)"]) * (
-        ρ_particle_gcm3
-    ) + (cts["Φ_saltcor (volfrac)"]) * (ρ_porewater_gcm3)
-    # material bulk density after drying
-    cts["ρ_bulk_dry (g/cm3)"] = (1 - cts["Φ_saltcor (volfrac)"]) * (
-        ρ_particle_gcm3
-    )
 
-    
-    
-    
-    
+        meta = {**CORE_METADATA, **metadata}
+        if chunksize:
+            with metrics.stage("read"):
+                bkg = read_table(bkg_fname)
+            cts = _activity_chunks(counts_fname, bkg, supLvl, meta, chunksize, fout, columns, metrics)
+        else:
+            # read in the csv/parquet/feather files specified by user
+            with metrics.stage("read"):
+                cts = read_table(counts_fname)
+                bkg = read_table(bkg_fname)
+            metrics.count("rows", len(cts))
+
+            # the Monte Carlo needs the intermediate columns, so it filters later
+            cts = _activity(cts, bkg, supLvl, meta, metrics, columns=None if mc_draws else columns)
+            if mc_draws:
+                log.info(f"||    ...Monte Carlo error propagation, {mc_draws} draws...")
+                with metrics.stage("monte carlo"):
+                    cts = activity_monte_carlo(cts, supLvl, meta, n_draws=mc_draws)
+            if columns is not None:
+                cts = _select_columns(cts, columns)
+            if fout is not None:
+                log.info(f"||    Writing data to {table_format(fout)} at path:             {fout}")
+                with metrics.stage("write"):
+                    write_table(cts, fout)
+
+        log.info(
+            '||    ...created df named "cts".                                          '
+        )
+        log.info(
+            "|---------------------  COUNTS2ACTIVITY FINISHED  -----------------------|"
+        )
+        log.info("   ")
+    if cts is not None:
+        cts.attrs["metrics"] = metrics.as_dict()
+    return cts
+
+
+# streaming counts_to_activity: each chunk of rows is read, computed and
+# written (or kept, if there is no fout) before the next one is read
+def _activity_chunks(counts_fname, bkg, supLvl, meta, chunksize, fout, columns, metrics):
+    log.info(f"||    Streaming in chunks of {chunksize} rows" + (f" to {table_format(fout)} at path: {fout}" if fout is not None else ""))
+    parts = []
+    n_chunks = 0
+    writer = TableWriter(fout) if fout is not None else None
+    try:
+        chunks = iter_table(counts_fname, chunksize)
+        while True:
+            with metrics.stage("read"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            metrics.count("rows", len(chunk))
+            metrics.count("chunks")
+            chunk = _activity(chunk, bkg, supLvl, meta, metrics, progress=n_chunks == 0, columns=columns)
+            n_chunks += 1
+            if columns is not None:
+                chunk = _select_columns(chunk, columns)
+            if writer is None:
+                parts.append(chunk)
+            else:
+                with metrics.stage("write"):
+                    writer.write(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        return None
+    return pd.concat(parts, ignore_index=True) if parts else None
+
+
+def _select_columns(cts, columns):
+    missing = [c for c in columns if c not in cts]
+    if missing:
+        raise ValueError(f"counts_to_activity: no output column(s) {missing}")
+    return cts[list(columns)]
+
+
+################################################################################
+###                         counts_to_activity_batch                         ###
+#   counts_to_activity for many cores at once, each with its own collection    #
+#   date and spike, in a single vectorized pass.                               #
+#
+#  INPUT #1: counts table (DataFrame or table path) with a "CoreID" column,
+#            e.g. a spe_to_counts output over a folder holding several cores
+#  INPUT #2: csv/DataFrame of detector backgrounds (as for counts_to_activity)
+#  INPUT #3: csv/DataFrame of per-core metadata, one row per "CoreID", with any
+#            of the CORE_METADATA columns, an optional "supLvl" (dpm/g) and an
+#            optional "SpikeID". Missing columns/values use CORE_METADATA.
+#  INPUT #4: supLvl, used for cores without a "supLvl" value (optional)
+#  INPUT #5: csv/DataFrame of spikes, one row per "SpikeID", with any of the
+#            spike columns of CORE_METADATA; overrides the per-core values
+#
+#  OPTIONAL: mc_draws=N adds Monte Carlo uncertainty columns (see
+#            activity_monte_carlo), as for counts_to_activity
+#
+#                                   RETURNS:
+#            the same columns as counts_to_activity, for every row of INPUT #1
+###                                                                          ###
+################################################################################
+
+
+def counts_to_activity_batch(counts, bkg, metadata, supLvl=None, spikes=None, mc_draws=None, metrics=None):
+    metrics = Metrics() if metrics is None else metrics
+    with metrics.track():
+        log.info(
+            "|-------------------  COUNTS2ACTIVITY BATCH STARTED  --------------------|")
+        with metrics.stage("read"):
+            cts = _read_table(counts)
+            bkg = _read_table(bkg)
+            metadata = _read_table(metadata)
+            spikes = None if spikes is None else _read_table(spikes)
+        if "CoreID" not in cts:
+            raise ValueError("counts_to_activity_batch: counts table has no 'CoreID' column")
+        metrics.count("rows", len(cts))
+        log.info(
+            f"||    {len(cts)} intervals from {cts['CoreID'].nunique()} cores"
+        )
+
+        with metrics.stage("metadata join"):
+            meta = _core_metadata(cts["CoreID"], metadata, spikes, supLvl)
+        supLvl = meta.pop("supLvl")
+        cts = _activity(cts, bkg, supLvl, meta, metrics)
+        if mc_draws:
+            log.info(f"||    ...Monte Carlo error propagation, {mc_draws} draws...")
+            with metrics.stage("monte carlo"):
+                cts = activity_monte_carlo(cts, supLvl, meta, n_draws=mc_draws)
+
+        log.info(
+            "|------------------  COUNTS2ACTIVITY BATCH FINISHED  --------------------|"
+        )
+        log.info("   ")
+    cts.attrs["metrics"] = metrics.as_dict()
+    return cts
+
+
+################################################################################
+###                              SWEEP_ACTIVITY                              ###
+#   Activities for every candidate window set of sweep_windows, without        #
+#   re-reading spectra: the counts rows are repeated once per candidate, the   #
+#   window sums replaced, and the whole stack goes through the calculation of  #
+#   counts_to_activity in one pass.                                            #
+#
+#  INPUT #1: counts table (DataFrame or table path) as written by
+#            spe_to_counts; with spectra_column=True it carries the spectra
+#  INPUT #2: csv/DataFrame of detector backgrounds (as for counts_to_activity;
+#            background counts are not re-integrated, they stay as given)
+#  INPUT #3: supLvl, supported 210Pb level (dpm/g)
+#  INPUT #4: candidate windows, as for sweep_windows
+#  OPTIONAL: spectra=, the spectra of the counts rows in the same order (by
+#            default the table's "spectrum" column); names=, their detector
+#            names (by default looked up from detID in DETECTORS);
+#            **metadata as for counts_to_activity
+#
+#                                   RETURNS:
+#            the counts_to_activity columns for every (row, candidate), with
+#            "row" (row of INPUT #1), "candidate" and "windows" in front
+###                                                                          ###
+################################################################################
+
+
+def sweep_activity(counts, bkg, supLvl, candidates, spectra=None, names=None, **metadata):
+    unknown = sorted(set(metadata) - set(CORE_METADATA))
+    if unknown:
+        raise TypeError(f"sweep_activity: unknown metadata {unknown}, expected {list(CORE_METADATA)}")
+    cts = _read_table(counts)
+    if spectra is None:
+        spectra = stack_spectra(cts)
+    if len(spectra) != len(cts):
+        raise ValueError(f"sweep_activity: {len(spectra)} spectra for {len(cts)} counts rows")
+    if names is None:
+        names = _detector_names(cts["detID"])
+
+    sums = sweep_windows(spectra, names, candidates)
+    log.info(f"||    Sweeping {len(sums)} (spectrum, window set) pairs over {len(cts)} spectra")
+    cts = cts.drop(columns=["spectrum"], errors="ignore")
+    # parse the plating/counting times once, before the rows are repeated
+    if not ("t_platingstart" in cts and pd.api.types.is_datetime64_any_dtype(cts["t_platingstart"])):
+        cts["t_platingstart"], cts["t_countingstart"] = _timestamps(cts)
+    rows = cts.iloc[sums["row"].to_numpy()].reset_index(drop=True)
+    rows["209Po_decays (counts)"] = sums["209Po_decays (counts)"].to_numpy()
+    rows["210Po_decays (counts)"] = sums["210Po_decays (counts)"].to_numpy()
+
+    act = _activity(rows, _read_table(bkg), supLvl, {**CORE_METADATA, **metadata})
+    act.insert(0, "row", sums["row"].to_numpy())
+    act.insert(1, "candidate", sums["candidate"].to_numpy())
+    act.insert(2, "windows", sums["windows"].to_numpy())
+    return act
+
+
+# registered detector name of every detID
+def _detector_names(detIDs):
+    by_id = {}
+    for name, (detID, _) in DETECTORS.items():
+        by_id.setdefault(detID, []).append(name)
+    shared = sorted(d for d in set(detIDs) if len(by_id.get(d, [])) > 1)
+    if shared:
+        raise ValueError(f"sweep_activity: detIDs {shared} belong to several detectors, pass names=")
+    missing = sorted(set(d for d in detIDs if d not in by_id))
+    if missing:
+        raise ValueError(f"sweep_activity: no detector registered with detID {missing}")
+    return np.array([by_id[d][0] for d in detIDs], dtype=str)
+
+
+# a DataFrame is used as is (copied), anything else is read as a table path
+def _read_table(table):
+    if isinstance(table, pd.DataFrame):
+        return _text_columns(table.copy().reset_index(drop=True))
+    return read_table(table)
+
+
+# look up keyed metadata rows for every sample, failing on gaps and duplicates
+def _keyed_rows(keys, table, key, what):
+    duplicated = sorted(table[key][table[key].duplicated()].unique())
+    if duplicated:
+        raise ValueError(f"counts_to_activity_batch: {key} {duplicated} listed more than once in the {what} table")
+    missing = sorted(set(keys) - set(table[key]))
+    if missing:
+        raise ValueError(f"counts_to_activity_batch: no {what} row for {key} {missing}")
+    return table.set_index(key).reindex(keys).reset_index(drop=True)
+
+
+# per-sample metadata: a Series (aligned with the counts rows) for every value
+# given in the metadata/spike tables, the CORE_METADATA default otherwise
+def _core_metadata(coreIDs, metadata, spikes, supLvl):
+    rows = _keyed_rows(coreIDs, metadata, "CoreID", "metadata")
+    if spikes is not None:
+        if "SpikeID" not in rows:
+            raise ValueError("counts_to_activity_batch: spikes given but metadata has no 'SpikeID' column")
+        spike_rows = _keyed_rows(rows["SpikeID"], spikes, "SpikeID", "spike")
+        for col in spike_rows:
+            rows[col] = spike_rows[col]
+
+    meta = {}
+    for key, default in {**CORE_METADATA, "supLvl": supLvl}.items():
+        if key not in rows:
+            meta[key] = default
+            continue
+        col = rows[key]
+        if key in ("t_collection", "t_spikeCal"):
+            col = pd.to_datetime(col, format="%m/%d/%Y")
+            default = pd.to_datetime(default, format="%m/%d/%Y")
+        meta[key] = col if default is None else col.fillna(default)
+    # activity_monte_carlo draws one calibration per spike
+    if "SpikeID" in rows:
+        meta["SpikeID"] = rows["SpikeID"]
+    if meta["supLvl"] is None or (isinstance(meta["supLvl"], pd.Series) and meta["supLvl"].isna().any()):
+        raise ValueError("counts_to_activity_batch: supLvl missing; pass supLvl= or a 'supLvl' metadata column")
+    return meta
+
+
+################################################################################
+###                             CORRECTION_CHAIN                             ###
+#   The density, decay and salt/mud corrections of counts_to_activity fused    #
+#   into one kernel over plain arrays: every result is written straight into   #
+#   its row of OUT (in-place ufuncs, no temporaries), so nothing is allocated  #
+#   but OUT itself, and OUT can be reused from call to call.                   #
+#
+#      INPUTS  : M_pan, M_wet, M_dry (M_WetSed+Pan / M_DrySed+Pan), M_chem
+#                (M_WetChemSed), siltclay, net209, net210 (decays minus
+#                background), dt_plate, dt_collect, dt_spike (Δt_Plate2Count,
+#                Δt_Collect2Count, Δt_SpikeCal2Count, min), spike_volume_ml,
+#                C_spike (C_spike_atCal_dpmml), supLvl; arrays of one shape,
+#                or scalars, that broadcast together
+#      OUTPUTS :  OUT, (len(CHAIN_OUTPUTS),) + shape float64, one row per
+#                 column of CHAIN_OUTPUTS, with the same definitions (and
+#                 operation order) as the counts_to_activity columns
+#      ENGINE  :  "numpy" (default), "numba" (a compiled single loop; needs
+#                 numba, which is optional) or "auto" (numba if installed)
+###                                                                          ###
+################################################################################
+
+# rows of the correction_chain output, named as the counts_to_activity columns
+CHAIN_OUTPUTS = [
+    "WeightFrac_Water+Salt",
+    "WeightFrac_Sed+Salt",
+    "M_WetChemSed_SaltCorrected (g)",
+    "VolFrac_water+salt",
+    "VolFrac_sed",
+    "Φ_uncorrected (volfrac)",
+    "Φ_saltcor (volfrac)",
+    "ρ_bulk_wet (g/cm3)",
+    "ρ_bulk_dry (g/cm3)",
+    "210Po_DecayCor_Plate2Count",
+    "210Pb_DecayCor_Collect2Plate",
+    "209Po_DecayCor_SpikeCal2Count",
+    "C_i at collection (dpm/g)",
+    "C_i at collection, salt correction (dpm/g)",
+    "C_i excess at collection, salt correction (dpm/g)",
+    "C_i excess at collection, salt+mud correction (dpm/g)",
+]
+
+
+def correction_chain(M_pan, M_wet, M_dry, M_chem, siltclay, net209, net210, dt_plate, dt_collect, dt_spike, spike_volume_ml, C_spike, supLvl, out=None, engine="numpy"):
+    inputs = [np.asarray(v, dtype=np.float64) for v in (M_pan, M_wet, M_dry, M_chem, siltclay, net209, net210, dt_plate, dt_collect, dt_spike, spike_volume_ml, C_spike, supLvl)]
+    shape = np.broadcast_shapes(*[v.shape for v in inputs])
+    if out is None:
+        out = np.empty((len(CHAIN_OUTPUTS),) + shape)
+    elif out.shape != (len(CHAIN_OUTPUTS),) + shape:
+        raise ValueError(f"correction_chain: out has shape {out.shape}, expected {(len(CHAIN_OUTPUTS),) + shape}")
+    if engine == "auto":
+        engine = "numba" if _chain_numba() is not None else "numpy"
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if engine == "numpy":
+            _chain_numpy(*inputs, out)
+        elif engine == "numba":
+            kernel = _chain_numba()
+            if kernel is None:
+                raise ImportError("correction_chain: engine='numba' needs the numba package")
+            flat = [np.ascontiguousarray(np.broadcast_to(v, shape)).reshape(-1) for v in inputs]
+            rows = out.reshape(len(CHAIN_OUTPUTS), -1)
+            kernel(*flat, rows)
+            if not np.shares_memory(rows, out):
+                out[...] = rows.reshape(out.shape)
+        else:
+            raise ValueError(f"correction_chain: engine must be 'numpy', 'numba' or 'auto', not {engine!r}")
+    return out
+
+
+def _chain_numpy(Mp, Mw, Md, Mc, silt, net209, net210, dt_plate, dt_collect, dt_spike, V, C_spike, sup, out):
+    (wf, wsed, mc_salt, vf_water, vf_sed, phi, phi_salt, rho_wet, rho_dry,
+     f210, f210Pb, f209, C, C_salt, C_xs, C_xs_mud) = out
+    s = porewater_saltFrac
+    # densities and porosity (later rows double as scratch space until
+    # their own value is written)
+    np.subtract(Mw, Mp, out=wf)
+    np.subtract(Md, Mp, out=wsed)
+    np.subtract(wf, wsed, out=wsed)
+    np.divide(wsed, wf, out=wf)
+    np.subtract(1, wf, out=wsed)
+    np.divide(Mc, wsed, out=mc_salt)
+    np.multiply(wf, s, out=vf_water)
+    np.multiply(vf_water, mc_salt, out=mc_salt)
+    np.subtract(Mc, mc_salt, out=mc_salt)
+    np.divide(wf, 1 - s, out=vf_water)
+    np.multiply(vf_water, 1 / ρ_porewater_gcm3, out=vf_water)
+    np.multiply(wf, s / (1 - s), out=vf_sed)
+    np.subtract(wsed, vf_sed, out=vf_sed)
+    np.divide(vf_sed, ρ_particle_gcm3, out=vf_sed)
+    np.multiply(wf, ρ_particle_gcm3, out=phi)
+    np.subtract(1, wf, out=phi_salt)
+    np.multiply(phi_salt, ρ_porewater_gcm3, out=phi_salt)
+    np.add(phi, phi_salt, out=phi_salt)
+    np.divide(phi, phi_salt, out=phi)
+    np.add(vf_water, vf_sed, out=phi_salt)
+    np.divide(vf_water, phi_salt, out=phi_salt)
+    np.subtract(1, phi_salt, out=rho_wet)
+    np.multiply(rho_wet, ρ_particle_gcm3, out=rho_wet)
+    np.multiply(phi_salt, ρ_porewater_gcm3, out=rho_dry)
+    np.add(rho_wet, rho_dry, out=rho_wet)
+    np.subtract(1, phi_salt, out=rho_dry)
+    np.multiply(rho_dry, ρ_particle_gcm3, out=rho_dry)
+    # decay corrections
+    np.multiply(dt_plate, -λ_210Po_min, out=f210)
+    np.exp(f210, out=f210)
+    np.multiply(dt_collect, -λ_210Pb_min, out=f210Pb)
+    np.exp(f210Pb, out=f210Pb)
+    np.multiply(dt_spike, -λ_209Po_min, out=f209)
+    np.exp(f209, out=f209)
+    # 210Pb concentrations
+    np.multiply(Mc, f210, out=C)
+    np.divide(net210, C, out=C)
+    np.multiply(V, C_spike, out=C_salt)
+    np.multiply(C_salt, f209, out=C_salt)
+    np.divide(C_salt, net209, out=C_salt)
+    np.multiply(C, C_salt, out=C)
+    np.divide(1, f210Pb, out=C_salt)
+    np.multiply(C, C_salt, out=C)
+    np.multiply(C, Mc, out=C_salt)
+    np.divide(C_salt, mc_salt, out=C_salt)
+    np.subtract(C_salt, sup, out=C_xs)
+    np.divide(C_xs, silt, out=C_xs_mud)
+
+
+# the same chain as one loop over flat arrays, compiled by numba on first use
+def _chain_loop(Mp, Mw, Md, Mc, silt, net209, net210, dt_plate, dt_collect, dt_spike, V, C_spike, sup, out):
+    s = porewater_saltFrac
+    for i in range(Mp.shape[0]):
+        wf = ((Mw[i] - Mp[i]) - (Md[i] - Mp[i])) / (Mw[i] - Mp[i])
+        wsed = 1 - wf
+        mc_salt = Mc[i] - (wf * s) * (Mc[i] / wsed)
+        vf_water = (wf / (1 - s)) * (1 / ρ_porewater_gcm3)
+        vf_sed = (wsed - wf * (s / (1 - s))) / ρ_particle_gcm3
+        phi = (wf * ρ_particle_gcm3) / ((wf * ρ_particle_gcm3) + (1 - wf) * ρ_porewater_gcm3)
+        phi_salt = vf_water / (vf_water + vf_sed)
+        f210 = np.exp(-λ_210Po_min * dt_plate[i])
+        f210Pb = np.exp(-λ_210Pb_min * dt_collect[i])
+        f209 = np.exp(-λ_209Po_min * dt_spike[i])
+        C = (net210[i] / (Mc[i] * f210)) * ((V[i] * C_spike[i] * f209) / net209[i]) * (1 / f210Pb)
+        C_salt = C * Mc[i] / mc_salt
+        out[0, i] = wf
+        out[1, i] = wsed
+        out[2, i] = mc_salt
+        out[3, i] = vf_water
+        out[4, i] = vf_sed
+        out[5, i] = phi
+        out[6, i] = phi_salt
+        out[7, i] = (1 - phi_salt) * ρ_particle_gcm3 + phi_salt * ρ_porewater_gcm3
+        out[8, i] = (1 - phi_salt) * ρ_particle_gcm3
+        out[9, i] = f210
+        out[10, i] = f210Pb
+        out[11, i] = f209
+        out[12, i] = C
+        out[13, i] = C_salt
+        out[14, i] = C_salt - sup[i]
+        out[15, i] = (C_salt - sup[i]) / silt[i]
+
+
+_CHAIN_NUMBA = []
+
+
+# the compiled _chain_loop, or None without numba
+def _chain_numba():
+    if not _CHAIN_NUMBA:
+        try:
+            import numba
+        except ImportError:
+            _CHAIN_NUMBA.append(None)
+        else:
+            _CHAIN_NUMBA.append(numba.njit(cache=True)(_chain_loop))
+    return _CHAIN_NUMBA[0]
+
+
+# the uncertainty columns of counts_to_activity, in output order
+_ERROR_COLUMNS = [
+    "Po209_counting_error",
+    "Po210_counting_error",
+    "pipette_error",
+    "spike_error",
+    "Error_total",
+    "Error",
+    "Error_SaltCorr",
+    "Error_MudSaltCorr (Xdir_error)",
+]
+
+
+# the activity calculation shared by counts_to_activity and its batch version.
+# every entry of meta is either one value or a Series aligned with the rows;
+# with columns=[...] computed columns not listed are never added
+def _activity(cts, bkg, supLvl, meta, metrics=None, progress=True, columns=None):
+    # progress lines go to DEBUG for every chunk but the first of a stream
+    say = log.info if progress else log.debug
+    metrics = Metrics() if metrics is None else metrics
+    cts = cts.drop(columns=_array_columns(cts))
+    metrics.lap("timestamps")
+
+    t_collection_yCE = pd.to_datetime(meta["t_collection"], format="%m/%d/%Y")
+    t_spikeCal = pd.to_datetime(meta["t_spikeCal"], format="%m/%d/%Y")
+    spike_volume_ml = meta["spike_volume_ml"]
+    C_spike_atCal_dpmml = meta["C_spike_atCal_dpmml"]
+    u_C_spike_atCal_dpmml = meta["u_C_spike_atCal_dpmml"]
+
     # TIME CONVERSIONS & CALCULATIONS
     # elapsed minutes plated planchets spent in counting
-    cts["Δt_in_counting (min)"] = cts["Δt_in_counting (sec)"] / 60
+    t_count_min = cts["Δt_in_counting (sec)"] / 60
     # elapsed minutes spent counting with no sample to measure bkg decays
     bkg["Δt_in_counting (min)"] = bkg["counting time (sec)"] / 60
-    # time of plating in datetime format
-    cts["t_platingstart"] = (
-        cts["Plating_StartDate (DD/MM/YYYY)"]
-        + " "
-        + cts["Plating_StartTime (HH:MM:SS)"]
-    )
-    cts["t_platingstart"] = pd.to_datetime(
-        cts["t_platingstart"], infer_datetime_format=True
-    )
-    # time of counting in datetime format
-    cts["t_countingstart"] = (
-        cts["Counting_StartDate"] + " " + cts["Counting_StartTime"]
-    )
-    cts["t_countingstart"] = pd.to_datetime(
-        cts["t_countingstart"], infer_datetime_format=True
-    )
+    # times of plating and counting in datetime format (a columnar counts
+    # table already carries them typed, so they are not parsed again)
+    if all(pd.api.types.is_datetime64_any_dtype(cts.get(c)) for c in ("t_platingstart", "t_countingstart")):
+        t_plating, t_counting = cts["t_platingstart"], cts["t_countingstart"]
+    else:
+        t_plating, t_counting = _timestamps(cts)
+    # elapsed time between plating and counting
+    dt_plate = (t_counting - t_plating) / np.timedelta64(1, "m")
+    # elapsed time between plating and counting
+    dt_collect = (t_plating - t_collection_yCE) / np.timedelta64(1, "m")
+    # elapsed time between spike calibration and counting
+    dt_spike = (t_counting - t_spikeCal) / np.timedelta64(1, "m")
 
     # read in a csv of background activity with the following column names
     # "Detector Name", "counts Po209", "counts Po210", "counting time (sec)"
@@ -563,152 +2013,120 @@ def counts_to_activity(counts_fname, bkg_fname, supLvl):
         bkg["counts Po210"] / bkg["Δt_in_counting (min)"]
     )
 
-   
-
-
-
-
-
-
     # CORRECT FOR THE BACKGROUND ACTIVITY OF EACH DETECTOR
-    a = []
-    for i in range(len(cts)):
-        a.append(bkg.loc[bkg["Detector Name"] == cts["detID"][i]].values[0])
-    a = pd.DataFrame(a)
-    a = a.drop(labels=[0], axis=1)
-    a = a.rename(
-        columns={
-            1: "BKG counts Pb209",
-            2: "BKG counts Pb210",
-            3: "BKG counts (sec)",
-            5: "209Po_detector_background_activity (cpm)",
-            6: "210Po_detector_background_activity (cpm)",
-        }
-    )
-    cts = pd.concat([a, cts], axis=1)
+    metrics.lap("background join")
+    a = _join_backgrounds(cts["detID"], bkg)
     # total 209Po α-counts from planchet only (background decays removed)
-    cts["209Po_decays_minus_bkg (counts)"] = cts["209Po_decays (counts)"] - (
-        cts["Δt_in_counting (min)"]
-        * cts["209Po_detector_background_activity (cpm)"]
+    net209 = cts["209Po_decays (counts)"].to_numpy() - (
+        t_count_min.to_numpy()
+        * a["209Po_detector_background_activity (cpm)"].to_numpy()
     )
     # total 210Po α-counts from planchet only (background decays removed)
-    cts["210Po_decays_minus_bkg (counts)"] = cts["210Po_decays (counts)"] - (
-        cts["Δt_in_counting (min)"]
-        * cts["210Po_detector_background_activity (cpm)"]
+    net210 = cts["210Po_decays (counts)"].to_numpy() - (
+        t_count_min.to_numpy()
+        * a["210Po_detector_background_activity (cpm)"].to_numpy()
     )
-    print(f"||   ")
-    print(f"||    ...calculating sample activites... ")
 
-    # CALCULATE CORRECTION VALUES FOR DECAY OF ISOTOPES
-    # elapsed time between plating and counting
-    cts["Δt_Plate2Count (min)"] = (
-        cts["t_countingstart"] - cts["t_platingstart"]
-    ) / np.timedelta64(1, "m")
-    # elapsed time between plating and counting
-    cts["Δt_Collect2Count (min)"] = (
-        cts["t_platingstart"] - t_collection_yCE
-    ) / np.timedelta64(1, "m")
-    # elapsed time between spike calibration and counting
-    cts["Δt_SpikeCal2Count (min)"] = (
-        cts["t_countingstart"] - t_spikeCal
-    ) / np.timedelta64(1, "m")
-    # fraction of 210Po remaining after the time elapsed between plating and α-counting
-    cts["210Po_DecayCor_Plate2Count"] = np.exp(
-        -λ_210Po_min * cts["Δt_Plate2Count (min)"]
-    )
-    # fraction of 210Pb remaining after the time elapsed between collection and plating
-    cts["210Pb_DecayCor_Collect2Plate"] = np.exp(
-        -λ_210Pb_min * cts["Δt_Collect2Count (min)"]
-    )
-    # fraction of 209Po remaining after the time elapsed between spike calibration and α-counting
-    cts["209Po_DecayCor_SpikeCal2Count"] = np.exp(
-        -λ_209Po_min * cts["Δt_SpikeCal2Count (min)"]
+    # CALCULATE SEDIMENT BULK DENSITY AND POROSITY, CORRECTIONS FOR THE DECAY
+    # OF ISOTOPES AND THE 210Pb CONCENTRATIONS (see CORRECTION_CHAIN)
+    say(f"||   ")
+    say(f"||    ...calculating sample activites... ")
+    metrics.lap("correction chain")
+    chain = correction_chain(
+        cts["M_pan (g)"], cts["M_WetSed+Pan (g)"], cts["M_DrySed+Pan (g)"],
+        cts["M_WetChemSed (g)"], cts["siltclay (volfrac)"], net209, net210,
+        dt_plate, dt_collect, dt_spike, spike_volume_ml, C_spike_atCal_dpmml,
+        supLvl,
     )
 
-    # 210Pb concentration of sediment section i at the date of collection
-    cts["C_i at collection (dpm/g)"] = (
-        (
-            cts["210Po_decays_minus_bkg (counts)"]
-            / (cts["M_WetChemSed (g)"] * cts["210Po_DecayCor_Plate2Count"])
-        )
-        * (  # 210Po activity of mud
-            (
-                spike_volume_ml
-                * C_spike_atCal_dpmml
-                * cts["209Po_DecayCor_SpikeCal2Count"]
-            )
-            / cts["209Po_decays_minus_bkg (counts)"]
-        )
-        * (  # scaled by 209Po yield
-            1 / cts["210Pb_DecayCor_Collect2Plate"]
-        )  # scaled by 210Pb decay
-    )
-    # 210Pb concentration of sediment section i at the date of collection after correcting for the mass of salt
-    cts["C_i at collection, salt correction (dpm/g)"] = (
-        cts["C_i at collection (dpm/g)"]
-        * cts["M_WetChemSed (g)"]
-        / cts["M_WetChemSed_SaltCorrected (g)"]
-    )
-    # 210Pb excess concentration of sediment section i at the date of collection after correcting for the mass of salt
-    cts["C_i excess at collection, salt correction (dpm/g)"] = (
-        cts["C_i at collection, salt correction (dpm/g)"] - supLvl
-    )
-    # 210Pb excess concentration of sediment section i at the date of collection after correcting for the mass of salt and the fraction of silt present
-    cts["C_i excess at collection, salt+mud correction (dpm/g)"] = (
-        cts["C_i excess at collection, salt correction (dpm/g)"]
-        / cts["siltclay (volfrac)"]
-    )
+    # the columns, in their long-standing order; with columns= only those
+    # asked for are built (the chain rows are views of one buffer)
+    metrics.lap("columns")
+    wanted = None if columns is None else set(columns)
+
+    def want(name):
+        return wanted is None or name in wanted
+
+    for k, name in enumerate(CHAIN_OUTPUTS[:9]):
+        if want(name):
+            cts[name] = chain[k]
+    if want("Δt_in_counting (min)"):
+        cts["Δt_in_counting (min)"] = t_count_min
+    for name, times in (("t_platingstart", t_plating), ("t_countingstart", t_counting)):
+        if want(name):
+            cts[name] = times
+    cts = pd.concat([a[[c for c in a if want(c)]], cts], axis=1)
+    for name, values in (
+        ("209Po_decays_minus_bkg (counts)", net209),
+        ("210Po_decays_minus_bkg (counts)", net210),
+        ("Δt_Plate2Count (min)", dt_plate.to_numpy()),
+        ("Δt_Collect2Count (min)", dt_collect.to_numpy()),
+        ("Δt_SpikeCal2Count (min)", dt_spike.to_numpy()),
+    ):
+        if want(name):
+            cts[name] = values
+    for k, name in enumerate(CHAIN_OUTPUTS[9:], 9):
+        if want(name):
+            cts[name] = chain[k]
 
     # the percentage of the spike successfully measured in the alpha counter
-    cts["radioisotope_yield (%)"] = (
-        cts["209Po_decays_minus_bkg (counts)"]
-        / (
-            C_spike_atCal_dpmml
-            * spike_volume_ml
-            * cts["Δt_in_counting (sec)"]
-            / 60
+    if want("radioisotope_yield (%)"):
+        cts["radioisotope_yield (%)"] = (
+            net209
+            / (
+                C_spike_atCal_dpmml
+                * spike_volume_ml
+                * cts["Δt_in_counting (sec)"]
+                / 60
+            )
+            * 100
         )
-        * 100
-    )
 
     # calculate error
-    print(
+    say(
         f"||    ...calculating error...                                            "
     )
-    # ☑
-    cts["Po209_counting_error"] = (
-        (cts["209Po_decays (counts)"]) ** (1 / 2)
-    ) / (cts["209Po_decays (counts)"])
-    # ☑
-    cts["Po210_counting_error"] = (
-        (cts["210Po_decays (counts)"]) ** (1 / 2)
-    ) / (cts["210Po_decays (counts)"])
-    # ☑
-    cts["pipette_error"] = 0.003 / spike_volume_ml
-    # ☑
-    cts["spike_error"] = u_C_spike_atCal_dpmml / C_spike_atCal_dpmml
-    # ☑
-    cts["Error_total"] = (
-        ((cts["pipette_error"]) ** 2)
-        + ((cts["spike_error"]) ** 2)
-        + ((cts["Po210_counting_error"]) ** 2)
-        + ((cts["Po209_counting_error"]) ** 2)
-    ) ** (1 / 2)
-    # ☑
-    cts["Error"] = cts["C_i at collection (dpm/g)"] * cts["Error_total"]
-    # ☑
-    cts["Error_SaltCorr"] = np.abs(
-        (cts["Error"] / cts["C_i at collection (dpm/g)"])
-        * (cts["C_i at collection, salt correction (dpm/g)"])
-    )
-    # ☑
-    cts["Error_MudSaltCorr (Xdir_error)"] = (
-        cts["Error_SaltCorr"] / cts["siltclay (volfrac)"]
-    )
+    metrics.lap("errors")
+    if any(want(name) for name in _ERROR_COLUMNS):
+        err = {}
+        # ☑
+        err["Po209_counting_error"] = (
+            (cts["209Po_decays (counts)"]) ** (1 / 2)
+        ) / (cts["209Po_decays (counts)"])
+        # ☑
+        err["Po210_counting_error"] = (
+            (cts["210Po_decays (counts)"]) ** (1 / 2)
+        ) / (cts["210Po_decays (counts)"])
+        # ☑
+        err["pipette_error"] = 0.003 / spike_volume_ml
+        # ☑
+        err["spike_error"] = u_C_spike_atCal_dpmml / C_spike_atCal_dpmml
+        # ☑
+        err["Error_total"] = (
+            ((err["pipette_error"]) ** 2)
+            + ((err["spike_error"]) ** 2)
+            + ((err["Po210_counting_error"]) ** 2)
+            + ((err["Po209_counting_error"]) ** 2)
+        ) ** (1 / 2)
+        # ☑
+        err["Error"] = chain[12] * err["Error_total"]
+        # ☑
+        err["Error_SaltCorr"] = np.abs(
+            (err["Error"] / chain[12])
+            * (chain[13])
+        )
+        # ☑
+        err["Error_MudSaltCorr (Xdir_error)"] = (
+            err["Error_SaltCorr"] / cts["siltclay (volfrac)"]
+        )
+        for name in _ERROR_COLUMNS:
+            if want(name):
+                cts[name] = err[name]
 
-    print(
+    say(
         "||    ...cleaning df...                                                  "
     )
+    metrics.lap("cleanup")
     # DROP REDUNDANT COLS
     cts = cts.drop(
         labels=[
@@ -719,12 +2137,194 @@ def counts_to_activity(counts_fname, bkg_fname, supLvl):
         ],
         axis=1,
     )
+    metrics.lap(None)
 
-    print(
-        '||    ...created df named "cts".                                          '
-    )
-    print(
-        "|---------------------  COUNTS2ACTIVITY FINISHED  -----------------------|"
+    return cts
+
+
+# object columns whose cells are arrays (the "spectrum" of spectra_column=True)
+def _array_columns(table):
+    names = []
+    for name in table.columns[table.dtypes == object]:
+        first = table[name].first_valid_index()
+        if first is not None and np.ndim(table[name].at[first]) > 0:
+            names.append(name)
+    return names
+
+
+# plating and counting start times parsed from the date/time text columns
+def _timestamps(cts):
+    # time of plating in datetime format
+    t_platingstart = (
+        cts["Plating_StartDate (DD/MM/YYYY)"]
+        + " "
+        + cts["Plating_StartTime (HH:MM:SS)"]
     )
-    print("   ")
+    t_platingstart = _parse_times(t_platingstart, "%d/%m/%Y %H:%M:%S", dayfirst=True)
+    # time of counting in datetime format
+    t_countingstart = cts["Counting_StartDate"] + " " + cts["Counting_StartTime"]
+    t_countingstart = _parse_times(t_countingstart, "%m/%d/%Y %H:%M:%S", dayfirst=False)
+    return t_platingstart, t_countingstart
+
+
+# the documented format first; other spellings are parsed one by one. An
+# explicit format keeps the result independent of which row comes first,
+# so a chunk parses exactly as it would within the whole table
+def _parse_times(text, fmt, dayfirst):
+    try:
+        return pd.to_datetime(text, format=fmt)
+    except ValueError:
+        return pd.to_datetime(text, format="mixed", dayfirst=dayfirst)
+
+
+################################################################################
+###                           ACTIVITY_MONTE_CARLO                           ###
+#   Monte Carlo propagation of every measured input through the full 210Pb     #
+#   activity equation, for all rows at once.                                   #
+#
+#  INPUT #1: table returned by counts_to_activity / counts_to_activity_batch
+#  INPUT #2: supLvl (dpm/g), one value or a Series aligned with INPUT #1
+#  INPUT #3: meta, the CORE_METADATA values used for INPUT #1 (default
+#            CORE_METADATA; values may be Series aligned with INPUT #1), and
+#            optionally "SpikeID"
+#
+#  Each realisation redraws
+#    . sample 209Po/210Po decays ............. Poisson(observed counts)
+#    . detector background counts ............ Poisson(observed), ONE draw per
+#                                              detector, shared by its samples
+#    . pan/wet/dry/wet-chem masses ........... Normal(M, u_mass_g)
+#    . siltclay (volfrac) .................... Normal(f, u_siltclay)
+#    . plating/counting start times .......... Normal(t, u_time_min), per row
+#    . core collection date .................. Normal(t, u_time_min), ONE draw
+#                                              per CoreID
+#    . pipetted spike volume ................. Normal(V, u_pipette_ml), per row
+#    . spike activity at calibration ......... Normal(C, u_C_spike_atCal_dpmml),
+#      and spike calibration date              Normal(t, u_time_min), ONE draw
+#                                              per spike (meta["SpikeID"], else
+#                                              per distinct calibration values)
+#  as a (rows, n_draws) array, so correlated terms stay correlated. The Δt of
+#  the decay corrections are taken between the drawn times (the counting
+#  start is shared by all three), and the draws run through correction_chain. Rows are processed in chunks that keep
+#  the working arrays under max_bytes; the chain output is allocated once.
+#
+#                                   RETURNS:
+#   INPUT #1 plus, for "C_i at collection (dpm/g)" and "C_i excess at
+#   collection, salt+mud correction (dpm/g)", the columns "<name> MC mean",
+#   "<name> MC std" and "<name> MC p<q>" for each requested percentile q
+###                                                                          ###
+################################################################################
+
+# default 1σ input uncertainties for the Monte Carlo propagation
+MC_UNCERTAINTIES = {
+    # balance reading, g
+    "u_mass_g": 0.0001,
+    # siltclay volume fraction (absolute)
+    "u_siltclay": 0.0,
+    # plating/counting/collection times, min
+    "u_time_min": 1.0,
+    # pipetted spike volume, ml
+    "u_pipette_ml": 0.003,
+}
+
+# activity columns summarised by the Monte Carlo propagation
+_MC_OUTPUTS = [
+    "C_i at collection (dpm/g)",
+    "C_i excess at collection, salt+mud correction (dpm/g)",
+]
+
+
+def activity_monte_carlo(cts, supLvl, meta=None, n_draws=10000, percentiles=(2.5, 50, 97.5), seed=None, max_bytes=256 * 2**20, **uncertainties):
+    unknown = sorted(set(uncertainties) - set(MC_UNCERTAINTIES))
+    if unknown:
+        raise TypeError(f"activity_monte_carlo: unknown uncertainties {unknown}, expected {list(MC_UNCERTAINTIES)}")
+    u = {**MC_UNCERTAINTIES, **uncertainties}
+    meta = {**CORE_METADATA, **(meta or {})}
+    rng = np.random.default_rng(seed)
+    n = len(cts)
+
+    # per-row inputs as (rows, 1) float columns that broadcast against draws
+    def col(values):
+        return np.broadcast_to(np.asarray(values, dtype=float), (n,)).reshape(n, 1)
+
+    Mp, Mw, Md = col(cts["M_pan (g)"]), col(cts["M_WetSed+Pan (g)"]), col(cts["M_DrySed+Pan (g)"])
+    Mc, silt = col(cts["M_WetChemSed (g)"]), col(cts["siltclay (volfrac)"])
+    P209, P210 = col(cts["209Po_decays (counts)"]), col(cts["210Po_decays (counts)"])
+    t_count = col(cts["Δt_in_counting (min)"])
+    dt_plate, dt_collect, dt_spike = col(cts["Δt_Plate2Count (min)"]), col(cts["Δt_Collect2Count (min)"]), col(cts["Δt_SpikeCal2Count (min)"])
+    V, C_spike, u_C_spike = col(meta["spike_volume_ml"]), col(meta["C_spike_atCal_dpmml"]), col(meta["u_C_spike_atCal_dpmml"])
+    sup = col(supLvl)
+
+    # one background measurement per detector, shared by all of its samples
+    detIDs, det_row = np.unique(np.asarray(cts["detID"], dtype=str), return_inverse=True)
+    first = np.unique(det_row, return_index=True)[1]
+    B209 = np.asarray(cts["BKG counts Pb209"], dtype=float)[first]
+    B210 = np.asarray(cts["BKG counts Pb210"], dtype=float)[first]
+    B_min = np.asarray(cts["BKG counts (sec)"], dtype=float)[first] / 60
+    # one collection per core and one calibration per spike
+    core_row = _group_codes(n, cts["CoreID"] if "CoreID" in cts else 0)
+    if "SpikeID" in meta:
+        spike_row = _group_codes(n, meta["SpikeID"])
+    else:
+        spike_row = _group_codes(n, meta["t_spikeCal"], meta["C_spike_atCal_dpmml"], meta["u_C_spike_atCal_dpmml"])
+    # the shared terms are drawn once, before the rows are split into chunks,
+    # so rows of different chunks see the same realisations
+    spike_draw = rng.standard_normal((spike_row.max(initial=-1) + 1, n_draws))
+    det_bkg209 = rng.poisson(B209[:, None], (len(detIDs), n_draws)) / B_min[:, None]
+    det_bkg210 = rng.poisson(B210[:, None], (len(detIDs), n_draws)) / B_min[:, None]
+    e_collect = u["u_time_min"] * rng.standard_normal((core_row.max(initial=-1) + 1, n_draws))
+    e_spikeCal = u["u_time_min"] * rng.standard_normal((len(spike_draw), n_draws))
+
+    # ~30 (rows, draws) float64 arrays are alive at once, 16 of them the
+    # correction_chain rows, allocated once and reused by every chunk
+    chunk = max(1, min(n, int(max_bytes // (30 * 8 * n_draws))))
+    work = np.empty((len(CHAIN_OUTPUTS), chunk, n_draws))
+    stats = {name: [] for name in _MC_OUTPUTS}
+    for lo in range(0, n, chunk):
+        s = slice(lo, min(lo + chunk, n))
+        m = s.stop - s.start
+        shape = (m, n_draws)
+
+        def normal(mean, sd):
+            return mean + sd * rng.standard_normal(shape)
+
+        mp, mw, md, mc = normal(Mp[s], u["u_mass_g"]), normal(Mw[s], u["u_mass_g"]), normal(Md[s], u["u_mass_g"]), normal(Mc[s], u["u_mass_g"])
+        # each spike calibration is one measurement, shared by its rows
+        c_spike = C_spike[s] + u_C_spike[s] * spike_draw[spike_row[s]]
+        v = normal(V[s], u["u_pipette_ml"])
+        bkg209, bkg210 = det_bkg209[det_row[s]], det_bkg210[det_row[s]]
+        net209 = rng.poisson(P209[s], shape) - t_count[s] * bkg209
+        net210 = rng.poisson(P210[s], shape) - t_count[s] * bkg210
+        # errors of the counting and plating start times; each Δt is the
+        # counting start minus the plating, collection or calibration time
+        e_count, e_plate = normal(0, u["u_time_min"]), normal(0, u["u_time_min"])
+        t_plate = dt_plate[s] + e_count - e_plate
+        t_collect = dt_collect[s] + e_count - e_collect[core_row[s]]
+        t_spike = dt_spike[s] + e_count - e_spikeCal[spike_row[s]]
+        siltclay = normal(silt[s], u["u_siltclay"])
+
+        # same chain as counts_to_activity, on whole (rows, draws) arrays
+        out = correction_chain(mp, mw, md, mc, siltclay, net209, net210, t_plate, t_collect, t_spike, v, c_spike, sup[s], out=work[:, :m])
+
+        for name in _MC_OUTPUTS:
+            draws = out[CHAIN_OUTPUTS.index(name)]
+            stats[name].append(
+                np.column_stack(
+                    [np.mean(draws, axis=1), np.std(draws, axis=1)]
+                    + [np.percentile(draws, q, axis=1) for q in percentiles]
+                )
+            )
+
+    cts = cts.copy()
+    for name in _MC_OUTPUTS:
+        table = np.concatenate(stats[name]) if n else np.zeros((0, 2 + len(percentiles)))
+        labels = ["MC mean", "MC std"] + [f"MC p{q:g}" for q in percentiles]
+        for k, label in enumerate(labels):
+            cts[f"{name} {label}"] = table[:, k]
     return cts
+
+
+# code 0.. of the distinct value (or combination of values) of every row;
+# missing values form a group of their own
+def _group_codes(n, *keys):
+    frame = pd.DataFrame({k: np.broadcast_to(np.asarray(v), (n,)) for k, v in enumerate(keys)})
+    return frame.groupby(list(frame.columns), dropna=False, sort=False).ngroup().to_numpy()
@@ -0,0 +1,210 @@
+################################################################################
+###                                PBWATCH.py                                ###
+#      Watches the folder the α-counters write their SPE files into and keeps  #
+#      each core's counts and activity tables up to date as spectra arrive.    #
+#   Polls with os.scandir (stat only, no reads) and treats a file as finished  #
+#   once its size and mtime have not changed for `settle` seconds. Each batch  #
+#   of finished files re-runs spe_to_counts (incremental) and                  #
+#   counts_to_activity for the cores they belong to. Local filesystems only.   #
+#
+#      USAGE   :  python PbWatch.py SPE_DIR LABSHEET BKG OUT_DIR --supLvl 1.2
+#                 (python PbWatch.py -h for the options)
+###                                                                          ###
+################################################################################
+
+import argparse
+import fnmatch
+import logging
+import os
+import re
+import time
+
+import PbTools
+
+log = logging.getLogger("PbTools.watch")
+
+
+################################################################################
+###                              FOLDERWATCHER                               ###
+#  Tracks the spe files of one folder between polls.                           #
+#
+#      .poll(now)       : stats the folder and returns the files that are new
+#                         or changed since they were last processed and have
+#                         been stable for at least `settle` seconds
+#      .mark_done(files): records the files as processed at their current
+#                         size and mtime (a later change makes them due again)
+###                                                                          ###
+################################################################################
+
+
+class FolderWatcher:
+    def __init__(self, directory, pattern="*.Spe", settle=10.0):
+        self.directory = directory
+        self.pattern = pattern
+        self.settle = settle
+        # path -> (mtime_ns, size) when processed
+        self._done = {}
+        # path -> [(mtime_ns, size), time that signature was first seen]
+        self._seen = {}
+
+    def poll(self, now=None):
+        now = time.monotonic() if now is None else now
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and fnmatch.fnmatch(entry.name.lower(), self.pattern.lower()):
+                    st = entry.stat()
+                    current[entry.path] = (st.st_mtime_ns, st.st_size)
+
+        # restart the settle clock of every file whose signature changed
+        for path, sig in current.items():
+            rec = self._seen.get(path)
+            if rec is None or rec[0] != sig:
+                self._seen[path] = [sig, now]
+        for path in set(self._seen) - set(current):
+            del self._seen[path]
+            self._done.pop(path, None)
+
+        return sorted(
+            path
+            for path, (sig, since) in self._seen.items()
+            if self._done.get(path) != sig and now - since >= self.settle
+        )
+
+    def mark_done(self, files):
+        for path in files:
+            if path in self._seen:
+                self._done[path] = self._seen[path][0]
+
+
+################################################################################
+###                               UPDATE_CORES                               ###
+#  Rebuilds the tables of every core that has a file in FILES.                 #
+#
+#      INPUTS  : "FILES"   : SETTLED SPE FILES (E.G. FROM FolderWatcher.poll)
+#                "SPE_DIR" : THE WATCHED FOLDER (ALL OF A CORE'S FILES ARE USED)
+#                "LABSHEET", "BKG": AS FOR spe_to_counts / counts_to_activity
+#                "OUT_DIR" : WRITES <CoreID>_counts.<fmt> (WITH ITS INCREMENTAL
+#                            MANIFEST) AND <CoreID>_activity.<fmt>
+#                "SUPLVL"  : SUPPORTED 210Pb LEVEL (dpm/g)
+#                "METADATA": OPTIONAL csv/DataFrame, ONE ROW PER "CoreID" WITH
+#                            ANY CORE_METADATA COLUMNS AND AN OPTIONAL "supLvl"
+#      OUTPUTS :  {CoreID: activity DataFrame} FOR THE CORES UPDATED
+#
+#  A core whose update fails (bad file, missing lab data, ...) is reported and
+#  skipped, so one bad spectrum does not stop the others.
+###                                                                          ###
+################################################################################
+
+
+def update_cores(files, spe_dir, labsheet, bkg, out_dir, supLvl, metadata=None, fmt="csv", pattern="*.Spe", filename_pattern=None, cache=None):
+    import pandas as pd
+
+    os.makedirs(out_dir, exist_ok=True)
+    lab = pd.read_csv(labsheet, header=0, dtype=PbTools.TEXT_COLUMNS) if isinstance(labsheet, str) else labsheet
+    if isinstance(metadata, str):
+        metadata = pd.read_csv(metadata, header=0, dtype=PbTools.TEXT_COLUMNS)
+    # files whose names the pattern cannot read are reported and left out
+    regex = filename_pattern if filename_pattern is not None else PbTools.FILENAME_PATTERN
+    if isinstance(regex, str):
+        regex = re.compile(regex, re.IGNORECASE)
+    all_files = sorted(
+        os.path.join(spe_dir, f)
+        for f in os.listdir(spe_dir)
+        if fnmatch.fnmatch(f.lower(), pattern.lower()) and regex.search(f)
+    )
+    unnamed = [f for f in files if not regex.search(os.path.basename(f))]
+    if unnamed:
+        log.warning(f"||    WARNING: skipping {len(unnamed)} files the file name pattern cannot read, e.g. {unnamed[:3]}")
+    keys = PbTools.parse_filenames(all_files, regex)
+    changed = set(PbTools.parse_filenames([f for f in files if f not in unnamed], regex)["CoreID"])
+
+    results = {}
+    for core in sorted(changed):
+        core_files = [f for f, c in zip(all_files, keys["CoreID"]) if c == core]
+        counts_out = os.path.join(out_dir, f"{core}_counts.{fmt}")
+        activity_out = os.path.join(out_dir, f"{core}_activity.{fmt}")
+        try:
+            PbTools.spe_to_counts(
+                core_files,
+                lab[lab["CoreID"].astype(str) == core],
+                counts_out,
+                cache=cache,
+                incremental=True,
+                filename_pattern=filename_pattern,
+            )
+            meta, core_supLvl = _core_kwargs(core, metadata, supLvl)
+            results[core] = PbTools.counts_to_activity(counts_out, bkg, core_supLvl, fout=activity_out, **meta)
+        except (ValueError, KeyError, OSError) as err:
+            log.warning(f"||    WARNING: core {core} not updated: {err}")
+    return results
+
+
+# counts_to_activity keyword arguments and supLvl of one core
+def _core_kwargs(core, metadata, supLvl):
+    if metadata is None:
+        return {}, supLvl
+    rows = metadata[metadata["CoreID"].astype(str) == core]
+    if len(rows) == 0:
+        return {}, supLvl
+    row = rows.iloc[0]
+    meta = {k: row[k] for k in PbTools.CORE_METADATA if k in row and row[k] == row[k]}
+    if "supLvl" in row and row["supLvl"] == row["supLvl"]:
+        supLvl = float(row["supLvl"])
+    return meta, supLvl
+
+
+################################################################################
+###                                  WATCH                                   ###
+#  The polling loop: every `interval` seconds, update the cores of all files   #
+#  that have settled. Runs until interrupted (Ctrl-C), or for one pass if      #
+#  once=True (all files already in the folder are treated as settled).         #
+###                                                                          ###
+################################################################################
+
+
+def watch(spe_dir, labsheet, bkg, out_dir, supLvl, metadata=None, interval=5.0, settle=10.0, fmt="csv", pattern="*.Spe", filename_pattern=None, cache=None, once=False):
+    if isinstance(cache, str):
+        from SpeReader import SpeCache
+        cache = SpeCache(cache)
+    watcher = FolderWatcher(spe_dir, pattern, 0.0 if once else settle)
+    log.info(f"||    Watching {spe_dir} for {pattern} (poll {interval:g} s, settle {settle:g} s)")
+    try:
+        while True:
+            due = watcher.poll()
+            if due:
+                log.info(f"||    {len(due)} new or changed spe files")
+                update_cores(due, spe_dir, labsheet, bkg, out_dir, supLvl, metadata, fmt, pattern, filename_pattern, cache)
+                watcher.mark_done(due)
+            if once:
+                return
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        log.info("||    Watch stopped.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep 210Pb counts and activity tables up to date as SPE files arrive.")
+    parser.add_argument("spe_dir", help="folder the counters write .Spe files into")
+    parser.add_argument("labsheet", help="lab csv (CoreID, Z_upper (cm), Z_lower (cm), ...)")
+    parser.add_argument("bkg", help="detector background csv")
+    parser.add_argument("out_dir", help="folder for the <CoreID>_counts / <CoreID>_activity tables")
+    parser.add_argument("--supLvl", type=float, required=True, help="supported 210Pb level (dpm/g), unless given per core in --metadata")
+    parser.add_argument("--metadata", help="csv with one row per CoreID of CORE_METADATA values and/or supLvl")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between polls (default 5)")
+    parser.add_argument("--settle", type=float, default=10.0, help="seconds a file must stay unchanged (default 10)")
+    parser.add_argument("--format", dest="fmt", choices=["csv", "parquet", "feather"], default="csv")
+    parser.add_argument("--pattern", default="*.Spe", help="glob of the spe files (default *.Spe)")
+    parser.add_argument("--filename-pattern", help="regex for CoreID/Z_upper/Z_lower (default PbTools.FILENAME_PATTERN)")
+    parser.add_argument("--cache", help="SpeCache folder for parsed spectra")
+    parser.add_argument("--once", action="store_true", help="process the folder once and exit")
+    args = parser.parse_args(argv)
+    watch(
+        args.spe_dir, args.labsheet, args.bkg, args.out_dir, args.supLvl,
+        metadata=args.metadata, interval=args.interval, settle=args.settle, fmt=args.fmt,
+        pattern=args.pattern, filename_pattern=args.filename_pattern, cache=args.cache, once=args.once,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+################################################################################
+###                               PLOTTOOLS.py                               ###
+#      QC plots of the 209Po/210Po integration windows, drawn in batches       #
+#      from an already-parsed spectra matrix (see PbTools.read_spes).          #
+#   Figures are rendered headless (Agg/PDF canvases, no pyplot state), written #
+#   straight to disk and released as soon as they are saved.                   #
+###                                                                          ###
+################################################################################
+
+import os
+
+import numpy as np
+
+# channels of context drawn on either side of the integration windows
+PLOT_MARGIN = 100
+
+
+################################################################################
+###                             DRAW_INTEGRATION                             ###
+#  Draws one spectrum and its integration windows onto a matplotlib axis.      #
+#
+#      INPUTS  : "AX"      : MATPLOTLIB AXIS TO DRAW ON
+#                "COUNTS"  : CHANNEL COUNTS OF ONE SPECTRUM
+#                "DETID"   : DETECTOR ID SHOWN IN THE TITLE BLOCK
+#                "DET"     : [209Po lower, 209Po upper, 210Po lower, 210Po upper]
+#                "SAMPLEID": FILE NAME SHOWN IN THE TITLE BLOCK
+###                                                                          ###
+################################################################################
+
+
+def draw_integration(ax, counts, detID, det, sampleID):
+    channels = np.arange(len(counts))
+    lo, hi = max(det[0] - PLOT_MARGIN, 0), det[3] + PLOT_MARGIN
+    ax.fill_between(channels[det[0] : det[1]],0, counts[det[0] : det[1]],color='red', zorder=3)
+    ax.fill_between(channels[det[2] : det[3]],0, counts[det[2] : det[3]],color='blue', zorder=4)
+    ax.fill_between(channels[lo : hi],0, counts[lo : hi],color='0.7', zorder=1)
+    ax.text(.025, .92, 'SPECTRUM INTEGRATION RANGES', transform=ax.transAxes, fontsize='medium', fontweight='bold')
+    ax.text(.025, .85, f'Detector: {detID}', transform=ax.transAxes, fontsize='small')
+    ax.text(.025, .78, f'File: {sampleID}', transform=ax.transAxes, fontsize='small')
+    ax.text(.885, .922, f'[{det[0]}:{det[1]}]', transform=ax.transAxes, fontsize='medium', color='red',zorder=6)
+    ax.text(.885, .86, f'[{det[2]}:{det[3]}]', transform=ax.transAxes, fontsize='medium', color='blue',zorder=6)
+    ax.legend(['209Po', '210Po', 'not counted         '])
+    ax.set_ylabel('counts')
+    ax.set_xlabel('decay energy channels')
+
+
+################################################################################
+###                               FLAG_SPECTRA                               ###
+#  Picks out spectra worth a look, so QC on large runs only plots those.       #
+#  A spectrum is flagged when                                                  #
+#    . its 209Po window holds fewer than MIN_209PO counts (poor yield), or     #
+#    . more than MAX_OUTSIDE of the counts within PLOT_MARGIN channels of the  #
+#      windows fall outside them (a peak drifting out of its window).          #
+#
+#      INPUTS  : "SPECTRA": (n_spectra, n_channels) ARRAY OF COUNTS, OR A
+#                           SpeRoi.RoiSpectra (ONLY ITS KEPT CHANNELS COUNT
+#                           TOWARDS THE BAND)
+#                "NAMES"  : DETECTOR NAME OF EACH SPECTRUM
+#      OUTPUTS :  BOOLEAN ARRAY, TRUE FOR FLAGGED SPECTRA
+###                                                                          ###
+################################################################################
+
+
+def flag_spectra(spectra, names, min_209Po=100, max_outside=0.05, detectors=None):
+    import PbTools
+
+    from SpeRoi import RoiSpectra
+
+    if detectors is None:
+        detectors = PbTools.DETECTORS
+    if not isinstance(spectra, RoiSpectra):
+        spectra = np.asarray(spectra)
+    _, po209, po210 = PbTools.integrate_windows(spectra, names, detectors)
+    unique, inverse = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+    windows = np.array([detectors[u][1] for u in unique], dtype=np.intp).reshape(-1, 4)[inverse]
+
+    # counts in the band [lower - margin, upper + margin) around both windows
+    rows = np.arange(len(spectra))
+    lo = np.maximum(windows[:, 0] - PLOT_MARGIN, 0)
+    hi = np.minimum(windows[:, 3] + PLOT_MARGIN, spectra.shape[1])
+    if isinstance(spectra, RoiSpectra):
+        cum = spectra.cumulative(np.stack([lo, hi], axis=1))
+        band = cum[:, 1] - cum[:, 0]
+    else:
+        cum = np.zeros((len(spectra), spectra.shape[1] + 1), dtype=np.int64)
+        np.cumsum(spectra, axis=1, out=cum[:, 1:])
+        band = cum[rows, hi] - cum[rows, lo]
+    outside = band - po209 - po210
+    return (po209 < min_209Po) | (outside > max_outside * np.maximum(band, 1))
+
+
+################################################################################
+###                               PLOT_SPECTRA                               ###
+#  Writes integration-window QC plots for a batch of spectra.                  #
+#
+#      INPUTS  : "SPECTRA": (n_spectra, n_channels) ARRAY OF COUNTS
+#                "NAMES"  : DETECTOR NAME OF EACH SPECTRUM ("DET# 1", ...)
+#                "FILES"  : SPE FILE OF EACH SPECTRUM (USED AS THE LABEL)
+#                "OUT_DIR": FOLDER TO WRITE INTO (CREATED IF NEEDED)
+#                "FMT"    : "pdf" -> ONE MULTI-PAGE PDF PER DETECTOR
+#                           "png" -> ONE PNG PER SPECTRUM
+#                "FLAGGED": OPTIONAL BOOLEAN MASK (E.G. FROM flag_spectra);
+#                           ONLY THOSE SPECTRA ARE PLOTTED
+#                "WORKERS": RENDER IN A POOL OF N PROCESSES (OPTIONAL)
+#      OUTPUTS :  LIST OF THE FILES WRITTEN
+###                                                                          ###
+################################################################################
+
+
+def plot_spectra(spectra, names, files, out_dir, fmt="pdf", flagged=None, workers=None, detectors=None):
+    import PbTools
+
+    if fmt not in ("pdf", "png"):
+        raise ValueError(f"plot_spectra: fmt must be 'pdf' or 'png', not {fmt!r}")
+    if detectors is None:
+        detectors = PbTools.DETECTORS
+    names = np.asarray(names, dtype=str)
+    files = np.asarray(files, dtype=str)
+    rows = np.arange(len(names)) if flagged is None else np.flatnonzero(flagged)
+    missing = sorted({str(n) for n in names[rows] if n not in detectors})
+    if missing:
+        raise ValueError(f"plot_spectra: no detector registered as {missing}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # one job per output file: (path, [(counts, detID, windows, label), ...])
+    jobs = []
+    if fmt == "pdf":
+        for name in np.unique(names[rows]):
+            detID, det = detectors[name]
+            pages = [(spectra[i], detID, det, files[i]) for i in rows if names[i] == name]
+            jobs.append((os.path.join(out_dir, f"spectra_{detID}.pdf"), pages))
+    else:
+        for i in rows:
+            detID, det = detectors[names[i]]
+            stem = os.path.splitext(os.path.basename(files[i]))[0]
+            jobs.append((os.path.join(out_dir, f"{stem}.png"), [(spectra[i], detID, det, files[i])]))
+
+    if workers is not None and workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_render, jobs))
+    return [_render(job) for job in jobs]
+
+
+# render one output file; figures are never registered with pyplot, so each
+# is freed as soon as it has been written
+def _render(job):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    path, pages = job
+    if path.endswith(".pdf"):
+        with PdfPages(path) as pdf:
+            for page in pages:
+                fig = Figure(figsize=(10, 4))
+                draw_integration(fig.add_subplot(), *page)
+                pdf.savefig(fig)
+    else:
+        fig = Figure(figsize=(10, 4))
+        FigureCanvasAgg(fig)
+        draw_integration(fig.add_subplot(), *pages[0])
+        fig.savefig(path)
+    return path
@@ -0,0 +1,230 @@
+################################################################################
+###                               SPEARCHIVE.py                              ###
+#      Consolidated store for many spectra: one file instead of thousands      #
+#      of small SPE files. Channel counts are kept as uint32 rows in           #
+#      fixed-size chunks (zlib-compressed or raw), followed by a JSON index    #
+#      of CoreID, depth interval, detector and counting date per spectrum.     #
+#   Reads go through a memory map of the file, so selecting a few spectra      #
+#   only touches the chunks that hold them.                                    #
+###                                                                          ###
+################################################################################
+
+################################################################################
+###                               FILE LAYOUT                                ###
+#
+#   bytes 0..7    : MAGIC
+#   bytes 8..15   : uint64 (little endian), offset of the JSON index
+#   bytes 16..23  : uint64 (little endian), length of the JSON index
+#   bytes 24..    : chunks of up to chunk_rows spectra, each an (rows, 2048)
+#                   little-endian uint32 array, zlib-compressed or raw
+#   index (utf-8 JSON):
+#       "n_channels", "compression" ("zlib" or "none"),
+#       "chunks": [[offset, nbytes, rows], ...],
+#       "records": {column: [value of every spectrum, in archive order]}
+#                  with the columns of INDEX_COLUMNS
+#
+#  Raw archives are larger but their rows are read straight out of the memory
+#  map, without a copy or a decompression step.
+###                                                                          ###
+################################################################################
+
+import json
+import mmap as _mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"SPEARC01"
+# file extension spe_to_counts recognises as an archive
+ARCHIVE_EXT = ".spa"
+_HEADER = struct.Struct("<8sQQ")
+# per-spectrum index columns
+INDEX_COLUMNS = [
+    "path",  # spe file the spectrum was read from
+    "CoreID",
+    "Z_upper (cm)",
+    "Z_lower (cm)",
+    "det",  # detector name, e.g. "DET# 1"
+    "date",  # counting start, MM/DD/YYYY hh:mm:ss
+    "live_time",  # live counting time (sec)
+]
+
+
+################################################################################
+###                              BUILD_ARCHIVE                               ###
+#  Packs a list of SPE files into one archive.                                 #
+#
+#      INPUTS  : "FILES"     : LIST OF SPE FILE PATHS
+#                "PATH"      : ARCHIVE TO WRITE (REPLACED ATOMICALLY)
+#                "KEYS"      : OPTIONAL DICT OF LISTS (OR DATAFRAME) "CoreID",
+#                              "Z_upper (cm)", "Z_lower (cm)", ONE VALUE PER
+#                              FILE; BY DEFAULT READ FROM THE FILE NAMES WITH
+#                              PbTools.parse_filenames(files, PATTERN)
+#                "CHUNK_ROWS": SPECTRA PER CHUNK
+#                "COMPRESS"  : ZLIB LEVEL (0 OR FALSE -> RAW, MEMORY-MAPPABLE)
+#                "WORKERS"   : PARSE THE SPE FILES IN A POOL OF N PROCESSES
+#      OUTPUTS :  THE OPENED SpeArchive
+#
+#  Files are parsed one chunk at a time, so memory use does not grow with the
+#  number of files.
+###                                                                          ###
+################################################################################
+
+
+def build_archive(files, path, keys=None, pattern=None, chunk_rows=64, compress=6, workers=None):
+    import PbTools
+
+    files = list(files)
+    if keys is None:
+        keys = PbTools.parse_filenames(files, pattern)
+    for col in ("CoreID", "Z_upper (cm)", "Z_lower (cm)"):
+        if len(keys[col]) != len(files):
+            raise ValueError(f"build_archive: {len(keys[col])} {col!r} keys for {len(files)} files")
+
+    records = {col: [] for col in INDEX_COLUMNS}
+    chunks = []
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, 0, 0))
+        for lo in range(0, len(files), chunk_rows):
+            block = files[lo : lo + chunk_rows]
+            spectra, headers = PbTools.read_spes(block, workers=workers)
+            if spectra.size and (spectra.min() < 0 or spectra.max() > np.iinfo(np.uint32).max):
+                raise ValueError(f"build_archive: counts outside the uint32 range in {block}")
+            data = spectra.astype("<u4").tobytes()
+            if compress:
+                data = zlib.compress(data, compress)
+            chunks.append([f.tell(), len(data), len(block)])
+            f.write(data)
+            records["path"] += [os.path.abspath(p) for p in block]
+            records["det"] += headers["det"].tolist()
+            records["date"] += headers["date"].tolist()
+            records["live_time"] += headers["live_time"].tolist()
+        for col in ("CoreID", "Z_upper (cm)", "Z_lower (cm)"):
+            records[col] = [v.item() if hasattr(v, "item") else v for v in list(keys[col])]
+
+        index = json.dumps({
+            "n_channels": PbTools.N_CHANNELS,
+            "compression": "zlib" if compress else "none",
+            "chunks": chunks,
+            "records": records,
+        }).encode("utf-8")
+        index_at = f.tell()
+        f.write(index)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, index_at, len(index)))
+    os.replace(tmp, path)
+    return SpeArchive(path)
+
+
+################################################################################
+###                                SPEARCHIVE                                ###
+#  Read access to an archive.                                                  #
+#
+#      .index          : dict of numpy arrays, one entry per spectrum for each
+#                        of INDEX_COLUMNS
+#      .select(...)    : row numbers matching CoreID / detector (one value or a
+#                        list), a depth range and/or a counting date range
+#      .read(rows)     : (len(rows), n_channels) uint32 array of those spectra
+#                        (all of them if rows is None), in the order given
+#      .blocks()       : [lo, hi) archive rows of every stored chunk, so a
+#                        whole archive can be read one chunk at a time
+#
+#  Usable as a context manager; close() releases the memory map.
+###                                                                          ###
+################################################################################
+
+
+class SpeArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        magic, index_at, index_len = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path}: not a spectrum archive")
+        meta = json.loads(self._map[index_at : index_at + index_len].decode("utf-8"))
+        self.n_channels = meta["n_channels"]
+        self.compression = meta["compression"]
+        self._chunks = np.array(meta["chunks"], dtype=np.int64).reshape(-1, 3)
+        # first archive row of every chunk
+        self._starts = np.r_[0, np.cumsum(self._chunks[:, 2])]
+        records = meta["records"]
+        self.index = {
+            "path": np.array(records["path"], dtype=str),
+            "CoreID": np.array(records["CoreID"], dtype=str),
+            "Z_upper (cm)": np.array(records["Z_upper (cm)"], dtype=float),
+            "Z_lower (cm)": np.array(records["Z_lower (cm)"], dtype=float),
+            "det": np.array(records["det"], dtype=str),
+            "date": np.array(records["date"], dtype=str),
+            "live_time": np.array(records["live_time"], dtype=np.int64),
+        }
+        # YYYYMMDDhhmmss, so counting dates compare as strings
+        self._date_key = np.array([_date_key(d, "") for d in records["date"]], dtype=str)
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def select(self, CoreID=None, det=None, z_min=None, z_max=None, date_from=None, date_to=None):
+        keep = np.ones(len(self), dtype=bool)
+        if CoreID is not None:
+            keep &= np.isin(self.index["CoreID"], np.atleast_1d(CoreID).astype(str))
+        if det is not None:
+            keep &= np.isin(self.index["det"], np.atleast_1d(det).astype(str))
+        # intervals lying within [z_min, z_max]
+        if z_min is not None:
+            keep &= self.index["Z_upper (cm)"] >= z_min
+        if z_max is not None:
+            keep &= self.index["Z_lower (cm)"] <= z_max
+        # counting dates within [date_from, date_to], given as MM/DD/YYYY with
+        # an optional hh:mm:ss
+        if date_from is not None:
+            keep &= self._date_key >= _date_key(date_from, "00:00:00")
+        if date_to is not None:
+            keep &= self._date_key <= _date_key(date_to, "23:59:59")
+        return np.flatnonzero(keep)
+
+    def blocks(self):
+        return [(int(lo), int(hi)) for lo, hi in zip(self._starts[:-1], self._starts[1:])]
+
+    def read(self, rows=None):
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows, dtype=np.intp).reshape(-1)
+        if rows.size and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError(f"{self.path}: rows outside 0..{len(self) - 1}")
+        out = np.empty((len(rows), self.n_channels), dtype=np.uint32)
+        # decode each chunk that holds a requested row once
+        chunk_of = np.searchsorted(self._starts, rows, side="right") - 1
+        for c in np.unique(chunk_of):
+            take = np.flatnonzero(chunk_of == c)
+            out[take] = self._chunk(c)[rows[take] - self._starts[c]]
+        return out
+
+    def _chunk(self, c):
+        offset, nbytes, n = (int(v) for v in self._chunks[c])
+        if self.compression == "zlib":
+            with memoryview(self._map) as view:
+                data = zlib.decompress(view[offset : offset + nbytes])
+            return np.frombuffer(data, dtype="<u4").reshape(n, self.n_channels)
+        # raw chunk: a view straight into the memory map
+        return np.frombuffer(self._map, dtype="<u4", count=n * self.n_channels, offset=offset).reshape(n, self.n_channels)
+
+
+def _date_key(date, default_time):
+    date = str(date).strip()
+    if len(date) == 10:
+        date = f"{date} {default_time}"
+    return date[6:10] + date[0:2] + date[3:5] + date[11:13] + date[14:16] + date[17:19]
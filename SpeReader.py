@@ -0,0 +1,258 @@
+################################################################################
+###                               SPEREADER.py                               ###
+#        Fast reader for fixed-layout ASCII SPE spectra (ORTEC Maestro).       #
+#   Reads the $SPEC_REM/$DATE_MEA/$MEAS_TIM/$DATA sections of one file         #
+#   straight into NumPy buffers, without a CSV tokenizer or a DataFrame.       #
+#   SpeCache keeps parsed spectra on disk between runs.                        #
+###                                                                          ###
+################################################################################
+
+################################################################################
+###                                 READ_SPE                                 ###
+#  Reads a single SPE file.                                                    #
+#
+#      INPUTS  : "PATH": PATH OF THE SPE FILE
+#                "MMAP": IF TRUE, THE FILE IS MEMORY-MAPPED INSTEAD OF READ
+#                    INTO A BYTES OBJECT (USEFUL FOR NETWORK/LARGE FILES)
+#      PERFORMS:  LOCATES EACH "$SECTION:" KEY, VALIDATES THE HEADER VALUES,
+#                 AND PARSES THE CHANNEL COUNTS IN ONE VECTORIZED PASS
+#      OUTPUTS :  "COUNTS": 1D INT64 ARRAY OF CHANNEL COUNTS
+#                 "HEADER": DICT WITH KEYS det, date, live_time, real_time
+#
+#  A malformed file raises SpeFormatError naming the file and the section.
+###                                                                          ###
+################################################################################
+
+import hashlib
+import json
+import mmap as _mmap
+import os
+import re
+import time
+
+import numpy as np
+
+# counting start as written in $DATE_MEA, MM/DD/YYYY hh:mm:ss
+_DATE_RE = re.compile(r"^\d{2}/\d{2}/\d{4} \d{2}:\d{2}:\d{2}$")
+# widest count field decoded by the fast path (exact in float64)
+_MAX_FIELD = 15
+
+class SpeFormatError(ValueError):
+    """Raised when an SPE file does not have the expected sections."""
+
+
+def read_spe(path, mmap=False):
+    with open(path, "rb") as f:
+        if mmap:
+            buf = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+    try:
+        data_at = buf.find(b"$DATA:")
+        if data_at < 0:
+            raise SpeFormatError(f"{path}: no $DATA: section")
+        header = _parse_header(path, bytes(buf[:data_at]))
+
+        # the line after $DATA: holds the first and last channel numbers
+        range_at = buf.find(b"\n", data_at) + 1
+        block_at = buf.find(b"\n", range_at) + 1
+        if range_at == 0 or block_at == 0:
+            raise SpeFormatError(f"{path}: truncated $DATA: section")
+        try:
+            first, last = (int(v) for v in bytes(buf[range_at:block_at]).split())
+        except ValueError:
+            raise SpeFormatError(
+                f"{path}: bad $DATA: channel range {bytes(buf[range_at:block_at])!r}"
+            ) from None
+        n = last - first + 1
+
+        # channel counts run until the next "$SECTION:" key (or end of file)
+        block_end = buf.find(b"$", block_at)
+        if block_end < 0:
+            block_end = len(buf)
+        counts = _parse_channels(path, buf, block_at, block_end, n)
+    finally:
+        if mmap:
+            buf.close()
+    return counts, header
+
+
+def _parse_header(path, head):
+    # split the text before $DATA: into {section key: [lines]}
+    sections = {}
+    key = None
+    for line in head.decode("latin-1").splitlines():
+        line = line.strip()
+        if line.startswith("$"):
+            key = line
+            sections[key] = []
+        elif key is not None and line:
+            sections[key].append(line)
+
+    for key in ("$SPEC_REM:", "$DATE_MEA:", "$MEAS_TIM:"):
+        if not sections.get(key):
+            raise SpeFormatError(f"{path}: missing or empty {key} section")
+
+    # name of detector ID, e.g. "DET# 1"
+    det = [line for line in sections["$SPEC_REM:"] if line.startswith("DET#")]
+    if not det:
+        raise SpeFormatError(f"{path}: no 'DET#' line in $SPEC_REM:")
+    # date of counting
+    date = sections["$DATE_MEA:"][0]
+    if not _DATE_RE.match(date):
+        raise SpeFormatError(
+            f"{path}: $DATE_MEA: {date!r} is not MM/DD/YYYY hh:mm:ss"
+        )
+    # live and real counting time (sec)
+    try:
+        live_time, real_time = (int(v) for v in sections["$MEAS_TIM:"][0].split())
+    except ValueError:
+        raise SpeFormatError(
+            f"{path}: $MEAS_TIM: {sections['$MEAS_TIM:'][0]!r} is not 'live real'"
+        ) from None
+    return {"det": det[0], "date": date, "live_time": live_time, "real_time": real_time}
+
+
+def _parse_channels(path, buf, start, stop, n):
+    # fast path: Maestro writes one right-aligned count per fixed-width line,
+    # so the block can be viewed as an (n, width) byte matrix and decoded at once
+    size = stop - start
+    width = size // n if n > 0 else 0
+    if width >= 2 and width * n == size:
+        flat = np.frombuffer(buf, dtype=np.uint8, count=size, offset=start)
+        rows = flat.reshape(n, width)
+        eol = 2 if (rows[:, -2] == ord("\r")).all() else 1
+        field = width - eol
+        if 0 < field <= _MAX_FIELD and (rows[:, -1] == ord("\n")).all():
+            digit = (flat - np.uint8(ord("0"))) <= 9
+            space = flat == ord(" ")
+            # only digits and leading spaces before the line ending, and the
+            # last character of every field is a digit
+            if (
+                np.count_nonzero(digit) + np.count_nonzero(space) == n * field
+                and not (space[1:] & digit[:-1]).any()
+                and digit.reshape(n, width)[:, field - 1].all()
+            ):
+                # "0".."9" & 0x0F -> 0..9, " " & 0x0F -> 0; line endings get weight 0
+                weights = np.zeros(width)
+                weights[:field] = 10.0 ** np.arange(field - 1, -1, -1)
+                return ((rows & np.uint8(0x0F)) @ weights).astype(np.int64)
+
+    # general path: any whitespace-separated layout
+    try:
+        counts = np.array(bytes(buf[start:stop]).split(), dtype=np.int64)
+    except ValueError:
+        raise SpeFormatError(f"{path}: non-integer value in $DATA: section") from None
+    if len(counts) != n:
+        raise SpeFormatError(
+            f"{path}: $DATA: declares {n} channels but holds {len(counts)}"
+        )
+    return counts
+
+
+################################################################################
+###                                 SPECACHE                                 ###
+#  Persistent on-disk cache of parsed spectra. Spectra never change after      #
+#  acquisition, so a file parsed once never needs to be parsed again.          #
+#
+#      STORE   :  <directory>/index.json   path -> [mtime, size, content hash]
+#                                          hash -> header, size, last access
+#                 <directory>/<hash>.npy   channel counts in the smallest
+#                                          unsigned dtype that holds them
+#      LOOKUP  :  A FILE WHOSE PATH, MTIME AND SIZE MATCH THE INDEX IS NOT
+#                 EVEN RE-HASHED; A TOUCHED OR COPIED FILE IS RE-HASHED AND
+#                 STILL HITS IF ITS CONTENT IS UNCHANGED
+#      EVICTION:  LEAST RECENTLY USED ENTRIES ARE DROPPED ON flush() ONCE THE
+#                 STORE EXCEEDS max_bytes
+#
+#  .hits and .misses count lookups since the cache was opened.
+###                                                                          ###
+################################################################################
+
+
+class SpeCache:
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        try:
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            self._index = {"files": {}, "entries": {}}
+
+    def get(self, path):
+        digest = self._digest(path)
+        entry = self._index["entries"].get(digest)
+        if entry is not None:
+            try:
+                counts = np.load(self._entry_path(digest)).astype(np.int64)
+            except (OSError, ValueError):
+                # entry file lost or damaged: forget it and re-parse
+                del self._index["entries"][digest]
+            else:
+                entry["atime"] = time.time()
+                self.hits += 1
+                return counts, dict(entry["header"])
+        self.misses += 1
+        return None
+
+    def put(self, path, counts, header):
+        digest = self._digest(path)
+        counts = np.asarray(counts)
+        if counts.size and counts.min() >= 0:
+            counts = counts.astype(np.min_scalar_type(counts.max()))
+        tmp = self._entry_path(digest) + ".tmp.npy"
+        np.save(tmp, counts)
+        os.replace(tmp, self._entry_path(digest))
+        self._index["entries"][digest] = {
+            "header": header,
+            "bytes": os.path.getsize(self._entry_path(digest)),
+            "atime": time.time(),
+        }
+
+    def read(self, path, mmap=False):
+        hit = self.get(path)
+        if hit is None:
+            hit = read_spe(path, mmap=mmap)
+            self.put(path, *hit)
+        return hit
+
+    def flush(self):
+        # evict least recently used entries until the store fits max_bytes
+        entries = self._index["entries"]
+        total = sum(e["bytes"] for e in entries.values())
+        for digest in sorted(entries, key=lambda d: entries[d]["atime"]):
+            if total <= self.max_bytes:
+                break
+            total -= entries.pop(digest)["bytes"]
+            try:
+                os.remove(self._entry_path(digest))
+            except OSError:
+                pass
+        # drop path records that point at evicted content
+        self._index["files"] = {
+            p: rec for p, rec in self._index["files"].items() if rec[2] in entries
+        }
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path)
+
+    def _digest(self, path):
+        # content hash of the file, re-computed only if path/mtime/size changed
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        rec = self._index["files"].get(key)
+        if rec is not None and rec[0] == st.st_mtime_ns and rec[1] == st.st_size:
+            return rec[2]
+        with open(path, "rb") as f:
+            digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        self._index["files"][key] = [st.st_mtime_ns, st.st_size, digest]
+        return digest
+
+    def _entry_path(self, digest):
+        return os.path.join(self.directory, digest + ".npy")
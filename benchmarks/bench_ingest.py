@@ -0,0 +1,59 @@
+################################################################################
+###                             bench_ingest.py                              ###
+#  Times SPE ingestion (PbTools.read_spes) against the number of files read.   #
+#  A linear-time reader keeps the "per file" column flat as n_files grows;     #
+#  the old growing-DataFrame loop is timed alongside it for comparison.        #
+#
+#      USAGE   :  python benchmarks/bench_ingest.py [n_files ...]
+###                                                                          ###
+################################################################################
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import PbTools
+from synthetic import ensure_detectors, spectra, write_spe
+
+
+def legacy_ingest(files):
+    # the per-file pd.concat loop that read_spes replaced (quadratic copying)
+    spe = pd.DataFrame()
+    for i in range(len(files)):
+        spe_raw = pd.read_csv(files[i])
+        spe = pd.concat(
+            [spe, pd.DataFrame(spe_raw[11:2059].astype(int))], axis=1, ignore_index=True
+        )
+    return spe
+
+
+def main(sizes):
+    rng = np.random.default_rng(0)
+    names = ensure_detectors(8)
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        dets = [names[i % 8] for i in range(max(sizes))]
+        counts = spectra(rng, dets, np.ones(len(dets)))
+        for i in range(max(sizes)):
+            path = os.path.join(tmp, f"bench_{i:06d}.Spe")
+            write_spe(path, counts[i], det=dets[i])
+            files.append(path)
+
+        print(f"{'n_files':>8} {'read_spes (s)':>14} {'per file (ms)':>14} {'legacy (s)':>11} {'per file (ms)':>14}")
+        for n in sizes:
+            t0 = time.perf_counter()
+            PbTools.read_spes(files[:n])
+            t_new = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            legacy_ingest(files[:n])
+            t_old = time.perf_counter() - t0
+            print(f"{n:8d} {t_new:14.3f} {1e3 * t_new / n:14.3f} {t_old:11.3f} {1e3 * t_old / n:14.3f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100, 200, 400, 800, 1600])
@@ -0,0 +1,186 @@
+################################################################################
+###                            run_benchmarks.py                             ###
+#  Times the pipeline stages on synthetic runs of increasing size and appends  #
+#  one JSON line per (size, stage) to bench_output.txt at the repository root, #
+#  tagged with the git commit, so results can be compared across commits.      #
+#
+#  stages: spe_to_counts, det_match_sum (per spectrum, as PlotSPEs=True runs   #
+#  it), integrate_windows (the batch equivalent), fit_peak_shapes (the tail    #
+#  correction), counts_to_activity and counts_to_activity_batch. A small       #
+#  warm-up run (not recorded) goes first, so one-off import costs do not land  #
+#  on the smallest size.                                                       #
+#  Those one-off costs are measured separately, in a fresh interpreter, and    #
+#  recorded with n_intervals 0: import PbTools, and the first calls of         #
+#  spe_to_counts and counts_to_activity on a tiny run (cold_start).            #
+#
+#      USAGE   :  python benchmarks/run_benchmarks.py [--sizes 10 100 ...]
+#                 python benchmarks/run_benchmarks.py --history [--size N]
+###                                                                          ###
+################################################################################
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+OUTPUT = os.path.join(ROOT, "bench_output.txt")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+import PbTools
+import synthetic
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+# run in a fresh interpreter by cold_start; prints one JSON dict of seconds
+_COLD_START = """
+import json, logging, sys, time, warnings
+warnings.simplefilter("ignore")
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+import PbTools
+t1 = time.perf_counter()
+logging.getLogger("PbTools").setLevel(logging.WARNING)
+PbTools.spe_to_counts(sys.argv[2], sys.argv[3], sys.argv[4])
+t2 = time.perf_counter()
+PbTools.counts_to_activity(sys.argv[4], sys.argv[5], 1.0)
+t3 = time.perf_counter()
+print(json.dumps({
+    "import PbTools": t1 - t0,
+    "first spe_to_counts": t2 - t1,
+    "first counts_to_activity": t3 - t2,
+    "matplotlib loaded": "matplotlib" in sys.modules,
+}))
+"""
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def timed(fn, *args, **kwargs):
+    # run fn with its progress banners and warnings silenced; returns
+    # (seconds, result)
+    logger = logging.getLogger("PbTools")
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            return time.perf_counter() - t0, result
+    finally:
+        logger.setLevel(level)
+
+
+def cold_start(tmp, n_detectors):
+    data = synthetic.make_dataset(tmp, 8, n_detectors=n_detectors)
+    counts_out = os.path.join(tmp, "counts.csv")
+    out = subprocess.run(
+        [sys.executable, "-c", _COLD_START, ROOT, data["spe_glob"], data["labsheet"], counts_out, data["bkg"]],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    results = json.loads(out.strip().splitlines()[-1])
+    if results.pop("matplotlib loaded"):
+        print("WARNING: matplotlib was imported without plotting")
+    return results
+
+
+def bench_size(n, tmp, n_detectors, workers):
+    data = synthetic.make_dataset(tmp, n, n_detectors=n_detectors)
+    counts_out = os.path.join(tmp, "counts.csv")
+    results = {}
+
+    results["spe_to_counts"], _ = timed(PbTools.spe_to_counts, data["spe_glob"], data["labsheet"], counts_out, workers=workers)
+
+    spectra, headers = PbTools.read_spes(data["files"])
+    results["integrate_windows"], _ = timed(PbTools.integrate_windows, spectra, headers["det"])
+
+    def per_spectrum():
+        for i in range(len(spectra)):
+            PbTools.det_match_sum(spectra[i], headers["det"][i], data["files"][i], False)
+
+    results["det_match_sum"], _ = timed(per_spectrum)
+    results["fit_peak_shapes"], _ = timed(PbTools.fit_peak_shapes, spectra, headers["det"])
+    results["counts_to_activity"], _ = timed(PbTools.counts_to_activity, counts_out, data["bkg"], 1.0)
+    results["counts_to_activity_batch"], _ = timed(PbTools.counts_to_activity_batch, counts_out, data["bkg"], data["metadata"])
+    return results
+
+
+def run(sizes, n_detectors=8, workers=None, output=OUTPUT):
+    commit, dirty = git_commit()
+    print(f"commit {commit}{' (dirty)' if dirty else ''}, {n_detectors} detectors")
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_size(8, tmp, n_detectors, workers)
+    print(f"{'n':>8} {'stage':<26} {'seconds':>10} {'per interval (us)':>18}")
+    for n in [0] + list(sizes):
+        with tempfile.TemporaryDirectory() as tmp:
+            results = cold_start(tmp, n_detectors) if n == 0 else bench_size(n, tmp, n_detectors, workers)
+        with open(output, "a") as f:
+            for stage, seconds in results.items():
+                record = {
+                    "commit": commit,
+                    "dirty": dirty,
+                    "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "n_intervals": n,
+                    "n_detectors": n_detectors,
+                    "workers": workers,
+                    "stage": stage,
+                    "seconds": round(seconds, 6),
+                }
+                f.write(json.dumps(record) + "\n")
+                per_interval = f"{1e6 * seconds / n:18.2f}" if n else f"{'-':>18}"
+                print(f"{n:8d} {stage:<26} {seconds:10.4f} {per_interval}")
+
+
+def history(size=None, output=OUTPUT):
+    # latest time of every (commit, n_intervals, stage), one row per commit
+    latest = {}
+    with open(output) as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except ValueError:
+                continue
+            if size is None or r["n_intervals"] == size:
+                latest[(r["commit"], r["n_intervals"], r["stage"])] = r["seconds"]
+    stages = sorted({k[2] for k in latest})
+    print(f"{'commit':<10} {'n':>8} " + " ".join(f"{s[:24]:>24}" for s in stages))
+    for commit, n in dict.fromkeys((k[0], k[1]) for k in latest):
+        print(f"{commit:<10} {n:8d} " + " ".join(f"{latest.get((commit, n, s), float('nan')):24.4f}" for s in stages))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the PbTools pipeline on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of intervals (default 10 .. 100000)")
+    parser.add_argument("--detectors", type=int, default=8, help="number of detectors (default 8)")
+    parser.add_argument("--workers", type=int, help="worker processes for spe_to_counts")
+    parser.add_argument("--history", action="store_true", help="print recorded results per commit instead of running")
+    parser.add_argument("--size", type=int, help="with --history, only this number of intervals")
+    args = parser.parse_args(argv)
+    if args.history:
+        history(args.size)
+    else:
+        run(args.sizes, args.detectors, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+################################################################################
+###                               synthetic.py                               ###
+#  Generators of realistic test inputs for the benchmarks: Maestro ASCII SPE   #
+#  files, the matching labsheet, detector background and core metadata csvs.   #
+#
+#  . spectra: 2048 channels of Poisson counts, a flat continuum plus Gaussian  #
+#    209Po and 210Po peaks (with a low-energy tail) inside each detector's     #
+#    registered windows; 210Po decays with depth like a real core              #
+#  . any number of detectors: names past DET# 8 are added to the registry      #
+#    with ensure_detectors                                                     #
+#  . files are named <CoreID>_Pb__<Z_upper>-<Z_lower>.Spe (FILENAME_PATTERN)   #
+###                                                                          ###
+################################################################################
+
+import csv
+import datetime
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import PbTools
+
+# intervals per synthetic core, each 1 cm thick (depths fit the 3-digit names)
+INTERVALS_PER_CORE = 100
+# peak shape, in channels: Gaussian width, join of the low-energy tail below
+# the centroid, and its decay length
+PEAK_SIGMA, PEAK_TAIL, PEAK_TAU = 18, 25, 40
+
+
+def ensure_detectors(n_detectors):
+    # register chambers DET# 9.. with the default windows, as a lab adding
+    # counters would
+    for k in range(1, n_detectors + 1):
+        if f"DET# {k}" not in PbTools.DETECTORS:
+            PbTools.register_detector(f"DET# {k}", f"EnsembleInput{k}", [608, 789, 789, 970])
+    return [f"DET# {k}" for k in range(1, n_detectors + 1)]
+
+
+def peak_shape(d):
+    # unit-height peak at offsets d (channels) from its centroid
+    core = np.exp(-0.5 * (d / PEAK_SIGMA) ** 2)
+    tail = np.exp(-0.5 * (PEAK_TAIL / PEAK_SIGMA) ** 2 + (d + PEAK_TAIL) / PEAK_TAU)
+    return np.where(d < -PEAK_TAIL, tail, core)
+
+
+def spectra(rng, names, po210_scale, n_channels=PbTools.N_CHANNELS):
+    # (len(names), n_channels) Poisson spectra, peaks placed in each
+    # detector's windows; po210_scale sets the 210Po/209Po ratio per spectrum
+    windows = np.array([PbTools.DETECTORS[n][1] for n in names], dtype=float).reshape(-1, 4)
+    ch = np.arange(n_channels)[None, :]
+    c209 = (windows[:, 0] + windows[:, 1])[:, None] / 2
+    c210 = (windows[:, 2] + windows[:, 3])[:, None] / 2
+
+    def peak(centre, height):
+        # Gaussian core with a low-energy exponential tail
+        return height * peak_shape(ch - centre)
+
+    lam = 0.3 + peak(c209, 120.0) + peak(c210, 120.0 * np.asarray(po210_scale)[:, None])
+    return rng.poisson(lam)
+
+
+def spe_bytes(counts, det, date, live_time=86400, real_time=86412):
+    # one Maestro ASCII file; counts are right-aligned in 8-wide fields,
+    # built as a byte matrix rather than formatted line by line
+    counts = np.asarray(counts, dtype=np.int64)
+    digits = (counts[:, None] // 10 ** np.arange(7, -1, -1)) % 10
+    leading = counts[:, None] < 10 ** np.arange(7, -1, -1)
+    leading[:, -1] = False
+    field = np.where(leading, ord(" "), digits + ord("0")).astype(np.uint8)
+    block = np.hstack([field, np.full((len(counts), 1), ord("\n"), dtype=np.uint8)]).tobytes()
+    num = det.split()[-1]
+    head = (
+        "$SPEC_ID:\nNo sample description was entered.\n$SPEC_REM:\n"
+        f"{det}\nDETDESC# EnsembleInput{num}\nAP# Maestro Version 7.01\n"
+        f"$DATE_MEA:\n{date:%m/%d/%Y %H:%M:%S}\n$MEAS_TIM:\n{live_time} {real_time}\n"
+        f"$DATA:\n0 {len(counts) - 1}\n"
+    )
+    tail = (
+        "$ROI:\n0\n$PRESETS:\nNone\n0\n0\n$ENER_FIT:\n0.000000 1.000000\n"
+        "$MCA_CAL:\n3\n0.000000E+000 1.000000E+000 0.000000E+000 keV\n"
+        "$SHAPE_CAL:\n3\n1.0E+000 0.0E+000 0.0E+000\n"
+    )
+    return head.encode() + block + tail.encode()
+
+
+def write_spe(path, counts, det="DET# 1", date=datetime.datetime(2021, 10, 20, 12, 0, 0)):
+    with open(path, "wb") as f:
+        f.write(spe_bytes(counts, det, date))
+
+
+################################################################################
+###                               MAKE_DATASET                               ###
+#  Writes a complete synthetic run into DIRECTORY:                             #
+#     spes/<CoreID>_Pb__<up>-<lo>.Spe   one spectrum per interval              #
+#     labsheet.csv                      one lab row per interval               #
+#     bkg.csv                           one background row per detector        #
+#     metadata.csv                      one row per core (CoreID, supLvl, ...) #
+#  Spectra are generated and written in blocks, so memory stays flat.          #
+#
+#      OUTPUTS :  DICT OF PATHS: spe_glob, labsheet, bkg, metadata, files
+###                                                                          ###
+################################################################################
+
+
+def make_dataset(directory, n_intervals, n_detectors=8, seed=0, block=2000):
+    rng = np.random.default_rng(seed)
+    names = ensure_detectors(n_detectors)
+    spe_dir = os.path.join(directory, "spes")
+    os.makedirs(spe_dir, exist_ok=True)
+
+    i = np.arange(n_intervals)
+    core = i // INTERVALS_PER_CORE
+    z_upper = i % INTERVALS_PER_CORE
+    coreIDs = np.array([f"SC{c:05d}" for c in range(core.max() + 1 if n_intervals else 0)])
+    start = datetime.datetime(2021, 11, 1, 8, 0, 0)
+    files = []
+    for lo in range(0, n_intervals, block):
+        rows = i[lo : lo + block]
+        det = [names[k % n_detectors] for k in rows]
+        # excess 210Pb decaying with depth over a supported floor
+        scale = 0.4 + 2.5 * np.exp(-z_upper[rows] / 15.0)
+        counts = spectra(rng, det, scale)
+        for r, row in enumerate(rows):
+            path = os.path.join(spe_dir, f"{coreIDs[core[row]]}_Pb__{z_upper[row]:03d}-{z_upper[row] + 1:03d}.Spe")
+            with open(path, "wb") as f:
+                f.write(spe_bytes(counts[r], det[r], start + datetime.timedelta(hours=int(row))))
+            files.append(path)
+
+    labsheet = os.path.join(directory, "labsheet.csv")
+    with open(labsheet, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["CoreID", "Z_upper (cm)", "Z_lower (cm)", "Plating_StartDate (DD/MM/YYYY)", "Plating_StartTime (HH:MM:SS)", "M_pan (g)", "M_WetSed+Pan (g)", "M_DrySed+Pan (g)", "M_WetChemSed (g)", "siltclay (volfrac)"])
+        pan = rng.uniform(9, 11, n_intervals)
+        wet = rng.uniform(15, 25, n_intervals)
+        dry = wet * rng.uniform(0.5, 0.7, n_intervals)
+        for row in range(n_intervals):
+            plated = start + datetime.timedelta(hours=int(row)) - datetime.timedelta(days=3)
+            w.writerow([coreIDs[core[row]], z_upper[row], z_upper[row] + 1, f"{plated:%d/%m/%Y}", f"{plated:%H:%M:%S}", round(pan[row], 4), round(pan[row] + wet[row], 4), round(pan[row] + dry[row], 4), round(rng.uniform(4, 6), 4), round(rng.uniform(0.3, 0.9), 3)])
+
+    bkg = os.path.join(directory, "bkg.csv")
+    with open(bkg, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["Detector Name", "counts Po209", "counts Po210", "counting time (sec)"])
+        for name in names:
+            w.writerow([PbTools.DETECTORS[name][0], int(rng.integers(2, 10)), int(rng.integers(4, 15)), 86400 * 3])
+
+    metadata = os.path.join(directory, "metadata.csv")
+    with open(metadata, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["CoreID", "t_collection", "supLvl"])
+        for c in coreIDs:
+            w.writerow([c, "10/15/2021", round(rng.uniform(0.8, 1.5), 3)])
+
+    return {
+        "spe_glob": os.path.join(spe_dir, "*.Spe"),
+        "labsheet": labsheet,
+        "bkg": bkg,
+        "metadata": metadata,
+        "files": files,
+    }
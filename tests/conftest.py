@@ -0,0 +1,62 @@
+################################################################################
+###                               conftest.py                                ###
+#  Shared fixtures: the repository root (and benchmarks/, for the synthetic    #
+#  data generators) on sys.path, and small spe/labsheet runs written to a      #
+#  temporary folder.                                                           #
+###                                                                          ###
+################################################################################
+
+import datetime
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import PbTools
+import synthetic
+
+logging.getLogger("PbTools").setLevel(logging.WARNING)
+
+START = datetime.datetime(2021, 11, 1, 8, 0, 0)
+
+
+def write_run(directory, intervals, seed=0, det="DET# 1", names=None):
+    # one spe file per (CoreID, Z_upper, Z_lower) text triple, named as
+    # FILENAME_PATTERN expects, and the matching labsheet csv; returns
+    # (spe glob, labsheet path)
+    rng = np.random.default_rng(seed)
+    spe_dir = os.path.join(directory, "spes")
+    os.makedirs(spe_dir, exist_ok=True)
+    counts = synthetic.spectra(rng, [det] * len(intervals), np.full(len(intervals), 1.5))
+    rows = []
+    for k, (core, upper, lower) in enumerate(intervals):
+        date = START + datetime.timedelta(hours=k)
+        name = names[k] if names else f"{core}_Pb__{upper}-{lower}.Spe"
+        synthetic.write_spe(os.path.join(spe_dir, name), counts[k], det, date)
+        plated = date - datetime.timedelta(days=3)
+        rows.append({
+            "CoreID": core, "Z_upper (cm)": upper, "Z_lower (cm)": lower,
+            "Plating_StartDate (DD/MM/YYYY)": f"{plated:%d/%m/%Y}",
+            "Plating_StartTime (HH:MM:SS)": f"{plated:%H:%M:%S}",
+            "M_pan (g)": 10.0, "M_WetSed+Pan (g)": 30.0 + k % 7, "M_DrySed+Pan (g)": 22.0,
+            "M_WetChemSed (g)": 5.0, "siltclay (volfrac)": 0.6,
+        })
+    labsheet = os.path.join(directory, "labsheet.csv")
+    pd.DataFrame(rows).to_csv(labsheet, index=False)
+    return os.path.join(spe_dir, "*.Spe"), labsheet
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    # a 60-interval synthetic run over 4 detectors (benchmarks/synthetic.py)
+    data = synthetic.make_dataset(str(tmp_path), 60, n_detectors=4, seed=1)
+    counts = os.path.join(str(tmp_path), "counts.csv")
+    PbTools.spe_to_counts(data["spe_glob"], data["labsheet"], counts)
+    return {**data, "counts": counts}
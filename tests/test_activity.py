@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import PbTools
+
+SELECTED = ["CoreID", "Z_midpt (cm)", "C_i excess at collection, salt+mud correction (dpm/g)", "Error_MudSaltCorr (Xdir_error)"]
+
+
+@pytest.mark.parametrize("ext", ["csv", "parquet", "feather"])
+def test_chunked_matches_unchunked(dataset, tmp_path, ext):
+    whole = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0)
+    chunked = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0, chunksize=7)
+    pd.testing.assert_frame_equal(whole, chunked, check_exact=True)
+    fout = str(tmp_path / f"act.{ext}")
+    assert PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0, chunksize=7, fout=fout) is None
+    written = PbTools.read_table(fout)
+    pd.testing.assert_frame_equal(whole[SELECTED], written[SELECTED], check_exact=True)
+
+
+def test_columns_selects_the_same_values(dataset):
+    whole = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0)
+    for chunksize in (None, 7):
+        selected = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0, chunksize=chunksize, columns=SELECTED)
+        assert list(selected.columns) == SELECTED
+        pd.testing.assert_frame_equal(whole[SELECTED], selected, check_exact=True)
+
+
+def test_unrequested_columns_are_never_built(dataset):
+    cts = PbTools.read_table(dataset["counts"])
+    bkg = PbTools.read_table(dataset["bkg"])
+    out = PbTools._activity(cts, bkg, 1.0, dict(PbTools.CORE_METADATA), columns=SELECTED)
+    built = set(out.columns) - set(cts.columns)
+    assert built == set(SELECTED) - set(cts.columns)
+
+
+def test_columns_with_monte_carlo(dataset):
+    name = "C_i at collection (dpm/g) MC mean"
+    act = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0, mc_draws=200, columns=["CoreID", name])
+    assert list(act.columns) == ["CoreID", name]
+    assert np.isfinite(act[name]).all()
+
+
+def test_unknown_column_raises(dataset):
+    with pytest.raises(ValueError, match="no output column"):
+        PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0, columns=["not a column"])
+
+
+def test_plating_dates_are_day_first():
+    cts = pd.DataFrame({
+        "Plating_StartDate (DD/MM/YYYY)": ["03/04/2022", "13/04/2022"],
+        "Plating_StartTime (HH:MM:SS)": ["08:00:00", "08:00:00"],
+        "Counting_StartDate": ["03/04/2022", "04/13/2022"],
+        "Counting_StartTime": ["09:30:00", "09:30:00"],
+    })
+    plating, counting = PbTools._timestamps(cts)
+    assert plating.tolist() == [pd.Timestamp("2022-04-03 08:00"), pd.Timestamp("2022-04-13 08:00")]
+    assert counting.tolist() == [pd.Timestamp("2022-03-04 09:30"), pd.Timestamp("2022-04-13 09:30")]
+    # the format does not depend on the first row: each row parses alone as
+    # it does within the table
+    for i in range(len(cts)):
+        p, c = PbTools._timestamps(cts.iloc[i : i + 1])
+        assert (p.iloc[0], c.iloc[0]) == (plating[i], counting[i])
+
+
+def test_other_date_spellings_keep_the_day_order():
+    cts = pd.DataFrame({
+        "Plating_StartDate (DD/MM/YYYY)": ["3/4/2022", "03/04/2022"],
+        "Plating_StartTime (HH:MM:SS)": ["08:00", "08:00:00"],
+        "Counting_StartDate": ["3/4/2022", "03/04/2022"],
+        "Counting_StartTime": ["09:30", "09:30:00"],
+    })
+    plating, counting = PbTools._timestamps(cts)
+    assert (plating == pd.Timestamp("2022-04-03 08:00")).all()
+    assert (counting == pd.Timestamp("2022-03-04 09:30")).all()
+
+
+@pytest.mark.parametrize("chunksize", [None, 7])
+def test_spectrum_column_is_not_carried(dataset, tmp_path, chunksize):
+    counts = str(tmp_path / "counts.parquet")
+    PbTools.spe_to_counts(dataset["spe_glob"], dataset["labsheet"], counts, spectra_column=True)
+    fout = str(tmp_path / "act.csv")
+    act = PbTools.counts_to_activity(counts, dataset["bkg"], 1.0, chunksize=chunksize, fout=fout)
+    written = PbTools.read_table(fout)
+    assert "spectrum" not in written
+    if act is not None:
+        assert "spectrum" not in act
+    # the same numbers as from the csv counts table without spectra
+    whole = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0)
+    pd.testing.assert_frame_equal(written[SELECTED], whole[SELECTED])
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import AgeModels
+
+# sedimentation rate (cm/yr), dry bulk density (g/cm3), interval thickness (cm)
+RATE, RHO, DZ = 0.5, 0.8, 1.0
+SLOPE = -AgeModels.λ_210Pb_yr / RATE
+
+
+def profile(core="A", n=300, mixed=0, rel=0.0, seed=0):
+    # constant flux, constant sedimentation: C_xs falls as exp(SLOPE z); a
+    # mixed layer holds the activity of the interval below it
+    rng = np.random.default_rng(seed)
+    z = (np.arange(n) + 0.5) * DZ
+    C = 20 * np.exp(SLOPE * z)
+    if mixed:
+        C[:mixed] = C[mixed]
+    C = C * np.exp(rng.normal(0, rel, n)) if rel else C
+    return pd.DataFrame({
+        "CoreID": core, AgeModels.Z_MID: z, AgeModels.DZ: DZ, AgeModels.RHO_DRY: RHO,
+        AgeModels.C_XS: C, AgeModels.ERR: max(rel, 0.05) * C,
+    })
+
+
+def test_age_models_recover_the_rate():
+    out = AgeModels.age_models(profile())
+    z = out[AgeModels.Z_MID]
+    np.testing.assert_allclose(out["S_CFCS (cm/yr)"], RATE, rtol=1e-10)
+    np.testing.assert_allclose(out["MAR_CFCS (g/cm2/yr)"], RHO * RATE, rtol=1e-10)
+    np.testing.assert_allclose(out["Age_CFCS (yr)"], z / RATE, rtol=1e-10)
+    np.testing.assert_allclose(out["Age_CIC (yr)"], (z - z[0]) / RATE, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(out["M_cum (g/cm2)"], RHO * z, rtol=1e-12)
+    # CRS integrates interval by interval: within 1% over the first 150 yr
+    young = z / RATE < 150
+    np.testing.assert_allclose(out["Age_CRS (yr)"][young], (z / RATE)[young], rtol=1e-2, atol=0.1)
+    np.testing.assert_allclose(out["MAR_CRS (g/cm2/yr)"][young], RHO * RATE, rtol=1e-2)
+    np.testing.assert_allclose(out["I_total (dpm/cm2)"], out["I_i (dpm/cm2)"].sum())
+
+
+def test_age_models_per_core_in_any_row_order():
+    cores = pd.concat([profile("A"), profile("B", n=120, mixed=6)])
+    shuffled = cores.sample(frac=1, random_state=0)
+    out = AgeModels.age_models(shuffled)
+    assert out.index.equals(shuffled.index)
+    for core in ("A", "B"):
+        alone = AgeModels.age_models(cores[cores["CoreID"] == core])
+        pd.testing.assert_frame_equal(out[out["CoreID"] == core].sort_index(), alone.sort_index())
+
+
+def test_fit_without_mixed_layer():
+    fit = AgeModels.fit_sedimentation_rates(profile(n=60), n_boot=0)
+    row = fit.iloc[0]
+    assert row["mixed_layer_intervals"] == 0 and row["n_fit"] == 60
+    assert row["slope (1/cm)"] == pytest.approx(SLOPE, rel=1e-10)
+    assert row["S (cm/yr)"] == pytest.approx(RATE, rel=1e-10)
+
+
+def test_fit_finds_a_mixed_layer():
+    fit = AgeModels.fit_sedimentation_rates(profile(n=60, mixed=4), n_boot=0)
+    row = fit.iloc[0]
+    # the deepest mixed interval is 1.2σ off the line, within mixed_sigma
+    assert row["mixed_layer_intervals"] == 3
+    assert row["mixed_layer_depth (cm)"] == 3.5 * DZ
+    assert row["slope (1/cm)"] == pytest.approx(SLOPE, rel=5e-3)
+    strict = AgeModels.fit_sedimentation_rates(profile(n=60, mixed=4), n_boot=0, mixed_sigma=1.0).iloc[0]
+    assert strict["mixed_layer_intervals"] == 4
+    assert strict["slope (1/cm)"] == pytest.approx(SLOPE, rel=1e-10)
+
+
+@pytest.mark.parametrize("mixed", [0, 4])
+def test_fit_noisy_cores(mixed):
+    # 5% errors; with a 4-interval mixed layer rows 0 and 1 lie about 5σ and
+    # 3.7σ off the line, so the χ² of the whole core alone would keep them
+    cores = pd.concat([profile(f"C{s}", n=40, mixed=mixed, rel=0.05, seed=s) for s in range(200)])
+    fit = AgeModels.fit_sedimentation_rates(cores, n_boot=0)
+    assert fit["slope (1/cm)"].mean() == pytest.approx(SLOPE, rel=0.01)
+    if mixed:
+        assert (fit["mixed_layer_intervals"] == 0).mean() < 0.02
+    else:
+        assert (fit["mixed_layer_intervals"] == 0).mean() > 0.9
+
+
+def test_bootstrap():
+    cores = pd.concat([profile(f"C{s}", n=40, rel=0.05, seed=s) for s in range(6)])
+    fit = AgeModels.fit_sedimentation_rates(cores, n_boot=500, seed=1)
+    low, high = fit["S p2.5 (cm/yr)"], fit["S p97.5 (cm/yr)"]
+    assert ((low < fit["S (cm/yr)"]) & (fit["S (cm/yr)"] < high)).all()
+    # about ±2 standard errors wide
+    assert ((high - low) / fit["S_err (cm/yr)"]).between(2.5, 6).all()
+    # the draws do not depend on how the cores are chunked
+    chunked = AgeModels.fit_sedimentation_rates(cores, n_boot=500, seed=1, max_bytes=1)
+    pd.testing.assert_frame_equal(fit, chunked)
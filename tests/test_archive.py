@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import PbTools
+from SpeArchive import SpeArchive, build_archive
+
+
+@pytest.fixture(params=[6, 0], ids=["zlib", "raw"])
+def archive(dataset, tmp_path, request):
+    path = str(tmp_path / "run.spa")
+    build_archive(dataset["files"], path, chunk_rows=16, compress=request.param).close()
+    return path
+
+
+def test_round_trip(dataset, archive):
+    spectra, headers = PbTools.read_spes(dataset["files"])
+    with SpeArchive(archive) as a:
+        assert len(a) == len(dataset["files"])
+        assert a.blocks() == [(0, 16), (16, 32), (32, 48), (48, 60)]
+        np.testing.assert_array_equal(a.read(), spectra)
+        rows = [59, 3, 17, 3]
+        np.testing.assert_array_equal(a.read(rows), spectra[rows])
+        np.testing.assert_array_equal(a.index["det"], headers["det"])
+        np.testing.assert_array_equal(a.index["live_time"], headers["live_time"])
+        with pytest.raises(IndexError):
+            a.read([60])
+
+
+def test_select(archive):
+    with SpeArchive(archive) as a:
+        z_upper = a.index["Z_upper (cm)"]
+        assert (a.select() == np.arange(len(a))).all()
+        assert len(a.select(CoreID="nope")) == 0
+        rows = a.select(det=["DET# 1", "DET# 3"], z_min=10, z_max=30)
+        expected = np.flatnonzero(np.isin(a.index["det"], ["DET# 1", "DET# 3"]) & (z_upper >= 10) & (a.index["Z_lower (cm)"] <= 30))
+        np.testing.assert_array_equal(rows, expected)
+        # counting starts one hour apart from 11/01/2021 08:00
+        rows = a.select(date_from="11/01/2021 10:00:00", date_to="11/01/2021")
+        np.testing.assert_array_equal(rows, np.flatnonzero((z_upper >= 2) & (z_upper <= 15)))
+
+
+@pytest.mark.parametrize("roi", [None, True])
+@pytest.mark.parametrize("spectra_column", [False, True])
+def test_spe_to_counts_from_archive(dataset, archive, tmp_path, roi, spectra_column):
+    fout = str(tmp_path / "counts.parquet")
+    expected = PbTools.spe_to_counts(dataset["spe_glob"], dataset["labsheet"], fout, spectra_column=spectra_column)
+    counts = PbTools.spe_to_counts(archive, dataset["labsheet"], fout, roi=roi, spectra_column=spectra_column)
+    scalar = [c for c in expected.columns if c != "spectrum"]
+    pd.testing.assert_frame_equal(counts[scalar], expected[scalar])
+    if spectra_column and roi is None:
+        np.testing.assert_array_equal(np.stack(counts["spectrum"]), np.stack(expected["spectrum"]))
@@ -0,0 +1,58 @@
+import copy
+
+import numpy as np
+
+import PbTools
+import synthetic
+
+SHIFT = 30
+
+
+def shifted_spectra(n=40, seed=0):
+    # DET# 1 spectra whose peaks sit SHIFT channels above the registered windows
+    rng = np.random.default_rng(seed)
+    spectra = synthetic.spectra(rng, ["DET# 1"] * n, np.full(n, 1.5))
+    return np.roll(spectra, SHIFT, axis=1)
+
+
+def test_apply_leaves_the_registry_alone():
+    before = copy.deepcopy(PbTools.DETECTORS)
+    table = PbTools.calibrate_windows(shifted_spectra(), ["DET# 1"] * 40, apply=True)
+    assert PbTools.DETECTORS == before
+    windows = before["DET# 1"][1]
+    assert table.attrs["detectors"]["DET# 1"][1] == [w + SHIFT for w in windows]
+    assert table["applied"].all()
+
+
+def test_apply_updates_the_given_mapping():
+    detectors = {"DET# 1": copy.deepcopy(PbTools.DETECTORS["DET# 1"])}
+    table = PbTools.calibrate_windows(shifted_spectra(), ["DET# 1"] * 40, detectors=detectors, apply=True)
+    assert detectors["DET# 1"][1] == [w + SHIFT for w in PbTools.DETECTORS["DET# 1"][1]]
+    assert table.attrs["detectors"] is detectors
+
+
+def test_spe_to_counts_apply_is_local_to_the_call(tmp_path):
+    spe_dir = tmp_path / "spes"
+    spe_dir.mkdir()
+    spectra = shifted_spectra()
+    files = []
+    for k, counts in enumerate(spectra):
+        path = str(spe_dir / f"MC01_Pb__{k:03d}-{k + 1:03d}.Spe")
+        synthetic.write_spe(path, counts)
+        files.append(path)
+    labsheet = PbTools.pd.DataFrame({
+        "CoreID": ["MC01"] * len(files), "Z_upper (cm)": np.arange(len(files)), "Z_lower (cm)": np.arange(len(files)) + 1,
+        "Plating_StartDate (DD/MM/YYYY)": "17/10/2021", "Plating_StartTime (HH:MM:SS)": "12:00:00",
+        "M_pan (g)": 10.0, "M_WetSed+Pan (g)": 30.0, "M_DrySed+Pan (g)": 22.0, "M_WetChemSed (g)": 5.0, "siltclay (volfrac)": 0.6,
+    })
+    before = copy.deepcopy(PbTools.DETECTORS)
+    applied = PbTools.spe_to_counts(files, labsheet, str(tmp_path / "a.csv"), calibrate="apply")
+    assert PbTools.DETECTORS == before
+    shifted = {"DET# 1": (before["DET# 1"][0], [w + SHIFT for w in before["DET# 1"][1]])}
+    _, po209, po210 = PbTools.integrate_windows(spectra, ["DET# 1"] * len(files), shifted)
+    np.testing.assert_array_equal(applied["209Po_decays (counts)"], po209)
+    np.testing.assert_array_equal(applied["210Po_decays (counts)"], po210)
+    # the next call integrates with the registered windows again
+    plain = PbTools.spe_to_counts(files, labsheet, str(tmp_path / "b.csv"))
+    _, po209, _ = PbTools.integrate_windows(spectra, ["DET# 1"] * len(files))
+    np.testing.assert_array_equal(plain["209Po_decays (counts)"], po209)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import PbTools
+from PbTools import λ_209Po_min, λ_210Pb_min, λ_210Po_min, porewater_saltFrac, ρ_particle_gcm3, ρ_porewater_gcm3
+
+SUP = 1.0
+
+
+def old_columns(act):
+    # the density, decay and salt corrections as counts_to_activity computed
+    # them column by column before correction_chain
+    meta = PbTools.CORE_METADATA
+    out = {}
+    wf = ((act["M_WetSed+Pan (g)"] - act["M_pan (g)"]) - (act["M_DrySed+Pan (g)"] - act["M_pan (g)"])) / (act["M_WetSed+Pan (g)"] - act["M_pan (g)"])
+    out["WeightFrac_Water+Salt"] = wf
+    out["WeightFrac_Sed+Salt"] = 1 - wf
+    out["M_WetChemSed_SaltCorrected (g)"] = act["M_WetChemSed (g)"] - ((wf * porewater_saltFrac) * (act["M_WetChemSed (g)"] / (1 - wf)))
+    out["VolFrac_water+salt"] = (wf / (1 - porewater_saltFrac)) * (1 / ρ_porewater_gcm3)
+    out["VolFrac_sed"] = ((1 - wf) - (wf * (porewater_saltFrac / (1 - porewater_saltFrac)))) / ρ_particle_gcm3
+    out["Φ_uncorrected (volfrac)"] = (wf * ρ_particle_gcm3) / ((wf * ρ_particle_gcm3) + (1 - wf) * ρ_porewater_gcm3)
+    phi = out["VolFrac_water+salt"] / (out["VolFrac_water+salt"] + out["VolFrac_sed"])
+    out["Φ_saltcor (volfrac)"] = phi
+    out["ρ_bulk_wet (g/cm3)"] = (1 - phi) * ρ_particle_gcm3 + phi * ρ_porewater_gcm3
+    out["ρ_bulk_dry (g/cm3)"] = (1 - phi) * ρ_particle_gcm3
+    f210 = np.exp(-λ_210Po_min * act["Δt_Plate2Count (min)"])
+    f210Pb = np.exp(-λ_210Pb_min * act["Δt_Collect2Count (min)"])
+    f209 = np.exp(-λ_209Po_min * act["Δt_SpikeCal2Count (min)"])
+    out["210Po_DecayCor_Plate2Count"], out["210Pb_DecayCor_Collect2Plate"], out["209Po_DecayCor_SpikeCal2Count"] = f210, f210Pb, f209
+    C = (
+        (act["210Po_decays_minus_bkg (counts)"] / (act["M_WetChemSed (g)"] * f210))
+        * ((meta["spike_volume_ml"] * meta["C_spike_atCal_dpmml"] * f209) / act["209Po_decays_minus_bkg (counts)"])
+        * (1 / f210Pb)
+    )
+    out["C_i at collection (dpm/g)"] = C
+    out["C_i at collection, salt correction (dpm/g)"] = C * act["M_WetChemSed (g)"] / out["M_WetChemSed_SaltCorrected (g)"]
+    out["C_i excess at collection, salt correction (dpm/g)"] = out["C_i at collection, salt correction (dpm/g)"] - SUP
+    out["C_i excess at collection, salt+mud correction (dpm/g)"] = out["C_i excess at collection, salt correction (dpm/g)"] / act["siltclay (volfrac)"]
+    return out
+
+
+def chain_inputs(act):
+    meta = PbTools.CORE_METADATA
+    return [
+        act["M_pan (g)"], act["M_WetSed+Pan (g)"], act["M_DrySed+Pan (g)"], act["M_WetChemSed (g)"], act["siltclay (volfrac)"],
+        act["209Po_decays_minus_bkg (counts)"], act["210Po_decays_minus_bkg (counts)"],
+        act["Δt_Plate2Count (min)"], act["Δt_Collect2Count (min)"], act["Δt_SpikeCal2Count (min)"],
+        meta["spike_volume_ml"], meta["C_spike_atCal_dpmml"], SUP,
+    ]
+
+
+@pytest.fixture
+def act(dataset):
+    return PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], SUP)
+
+
+def test_kernel_matches_the_old_formulas(act):
+    old = old_columns(act)
+    chain = PbTools.correction_chain(*chain_inputs(act))
+    for k, name in enumerate(PbTools.CHAIN_OUTPUTS):
+        np.testing.assert_allclose(chain[k], old[name], rtol=1e-12, err_msg=name)
+        np.testing.assert_allclose(act[name], old[name], rtol=1e-12, err_msg=name)
+
+
+def test_loop_matches_the_numpy_engine(act):
+    # _chain_loop is the body numba compiles; run here as plain Python
+    inputs = [np.broadcast_to(np.asarray(v, dtype=float), (len(act),)) for v in chain_inputs(act)]
+    out = np.empty((len(PbTools.CHAIN_OUTPUTS), len(act)))
+    PbTools._chain_loop(*inputs, out)
+    np.testing.assert_allclose(out, PbTools.correction_chain(*chain_inputs(act)), rtol=1e-12)
+
+
+def test_out_is_filled_in_place(act):
+    out = np.empty((len(PbTools.CHAIN_OUTPUTS), len(act)))
+    assert PbTools.correction_chain(*chain_inputs(act), out=out) is out
+    with pytest.raises(ValueError, match="out has shape"):
+        PbTools.correction_chain(*chain_inputs(act), out=out[:, :-1])
+
+
+def test_numba_engine(act):
+    pytest.importorskip("numba")
+    expected = PbTools.correction_chain(*chain_inputs(act))
+    np.testing.assert_allclose(PbTools.correction_chain(*chain_inputs(act), engine="numba"), expected, rtol=1e-12)
+    # a non-contiguous out is filled through a contiguous copy
+    work = np.empty((len(PbTools.CHAIN_OUTPUTS), len(act), 2))
+    PbTools.correction_chain(*chain_inputs(act), out=work[:, :, 0], engine="numba")
+    np.testing.assert_allclose(work[:, :, 0], expected, rtol=1e-12)
+
+
+def test_unknown_engine_raises(act):
+    with pytest.raises(ValueError, match="engine must be"):
+        PbTools.correction_chain(*chain_inputs(act), engine="fortran")
@@ -0,0 +1,89 @@
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import PbTools
+import synthetic
+
+
+@pytest.fixture
+def run(tmp_path):
+    data = synthetic.make_dataset(str(tmp_path), 40, n_detectors=4, seed=2)
+    return {**data, "files": sorted(data["files"]), "dir": str(tmp_path)}
+
+
+def incremental(run, fout, steps, **kwargs):
+    # spe_to_counts(incremental=True) over a growing list of files
+    for n in steps:
+        counts = PbTools.spe_to_counts(run["files"][:n], run["labsheet"], fout, incremental=True, **kwargs)
+    return counts
+
+
+def full(run, name, **kwargs):
+    return PbTools.spe_to_counts(run["files"], run["labsheet"], os.path.join(run["dir"], name), **kwargs)
+
+
+def assert_same(a, b):
+    pd.testing.assert_frame_equal(a.reset_index(drop=True), b.reset_index(drop=True), check_dtype=False)
+
+
+@pytest.mark.parametrize("ext", ["csv", "parquet"])
+def test_incremental_matches_full_rebuild(run, ext):
+    fout = os.path.join(run["dir"], f"inc.{ext}")
+    assert_same(incremental(run, fout, [15, 30, 40]), full(run, f"full.{ext}"))
+    # a run with nothing new keeps every row as it was
+    assert_same(incremental(run, fout, [40]), full(run, f"full.{ext}"))
+
+
+def test_tail_correction_kept_by_incremental_runs(run):
+    fout = os.path.join(run["dir"], "inc.csv")
+    counts = incremental(run, fout, [20, 40], tail_correction=True)
+    assert counts[PbTools._TAIL_COLUMN].notna().all()
+    rebuilt = full(run, "full.csv", tail_correction=True)
+    # the peak shapes come from the spectra fitted together, so the corrected
+    # sums of rows read in different runs differ slightly
+    fitted = ["209Po_decays (counts)", "210Po_decays (counts)", PbTools._TAIL_COLUMN]
+    assert_same(counts.drop(columns=fitted), rebuilt.drop(columns=fitted))
+    np.testing.assert_allclose(counts[fitted[:2]], rebuilt[fitted[:2]], rtol=1e-2)
+
+
+def test_changed_options_rebuild_every_row(run):
+    fout = os.path.join(run["dir"], "inc.csv")
+    incremental(run, fout, [20], tail_correction=True)
+    counts = incremental(run, fout, [40])
+    assert PbTools._TAIL_COLUMN not in counts
+    assert_same(counts, full(run, "full.csv"))
+
+
+def test_changed_windows_rebuild_every_row(run, monkeypatch):
+    fout = os.path.join(run["dir"], "inc.csv")
+    incremental(run, fout, [20])
+    detID, windows = PbTools.DETECTORS["DET# 2"]
+    monkeypatch.setitem(PbTools.DETECTORS, "DET# 2", (detID, [w + 12 for w in windows]))
+    assert_same(incremental(run, fout, [40]), full(run, "full.csv"))
+
+
+def test_applied_calibration_is_not_carried_over(tmp_path):
+    # spectra whose peaks sit 30 channels above the registered windows
+    rng = np.random.default_rng(0)
+    spectra = np.roll(synthetic.spectra(rng, ["DET# 1"] * 30, np.full(30, 1.5)), 30, axis=1)
+    spe_dir = tmp_path / "spes"
+    spe_dir.mkdir()
+    files = []
+    for k, counts in enumerate(spectra):
+        files.append(str(spe_dir / f"MC01_Pb__{k:03d}-{k + 1:03d}.Spe"))
+        synthetic.write_spe(files[-1], counts)
+    labsheet = pd.DataFrame({"CoreID": "MC01", "Z_upper (cm)": np.arange(30), "Z_lower (cm)": np.arange(30) + 1})
+    for col in ("M_pan (g)", "M_WetSed+Pan (g)", "M_DrySed+Pan (g)", "M_WetChemSed (g)", "siltclay (volfrac)",
+                "Plating_StartDate (DD/MM/YYYY)", "Plating_StartTime (HH:MM:SS)"):
+        labsheet[col] = 1.0
+    before = copy.deepcopy(PbTools.DETECTORS)
+    fout = str(tmp_path / "inc.csv")
+    PbTools.spe_to_counts(files[:20], labsheet, fout, incremental=True, calibrate="apply")
+    counts = PbTools.spe_to_counts(files, labsheet, fout, incremental=True)
+    assert PbTools.DETECTORS == before
+    plain = PbTools.spe_to_counts(files, labsheet, str(tmp_path / "full.csv"))
+    assert_same(counts, plain)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import PbTools
+
+
+def slice_sums(spectrum, windows):
+    # the window sums as det_match_sum's per-detector branches took them
+    return spectrum[windows[0] : windows[1]].sum(), spectrum[windows[2] : windows[3]].sum()
+
+
+@pytest.mark.parametrize("name", sorted(PbTools.DETECTORS))
+def test_matches_slice_sums(name):
+    rng = np.random.default_rng(0)
+    spectra = rng.poisson(5.0, (20, PbTools.N_CHANNELS))
+    detID, windows = PbTools.DETECTORS[name]
+    detIDs, po209, po210 = PbTools.integrate_windows(spectra, [name] * len(spectra))
+    assert (detIDs == detID).all()
+    for i, spectrum in enumerate(spectra):
+        assert (po209[i], po210[i]) == slice_sums(spectrum, windows)
+        assert PbTools.det_match_sum(spectrum, name, "x", False) == (detID, po209[i], po210[i])
+
+
+def test_mixed_batch():
+    rng = np.random.default_rng(1)
+    names = rng.choice(sorted(PbTools.DETECTORS), 200)
+    spectra = rng.poisson(5.0, (len(names), PbTools.N_CHANNELS))
+    detIDs, po209, po210 = PbTools.integrate_windows(spectra, names)
+    for i, name in enumerate(names):
+        detID, windows = PbTools.DETECTORS[name]
+        assert (detIDs[i], po209[i], po210[i]) == (detID, *slice_sums(spectra[i], windows))
+
+
+def test_unknown_detector_raises():
+    spectra = np.ones((2, PbTools.N_CHANNELS), dtype=np.int64)
+    with pytest.raises(ValueError, match="no detector registered as \\['DET# 99'\\]"):
+        PbTools.integrate_windows(spectra, ["DET# 1", "DET# 99"])
+    with pytest.raises(ValueError, match="no detector registered"):
+        PbTools.det_match_sum(spectra[0], "DET# 99", "x", False)
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+import PbTools
+from conftest import write_run
+
+LAB_COLUMNS = ["M_pan (g)", "M_WetSed+Pan (g)", "M_DrySed+Pan (g)", "M_WetChemSed (g)", "siltclay (volfrac)"]
+
+
+def fractional_intervals():
+    # 0.1 cm steps and uneven thicknesses, whose midpoint -/+ half thickness
+    # does not round-trip in floating point
+    edges = np.round(np.arange(0, 12.1, 0.1), 1)
+    intervals = [("MC01", f"{u:.1f}", f"{l:.1f}") for u, l in zip(edges[:-1], edges[1:])]
+    intervals += [("MC02", "0.3", "0.7"), ("MC02", "0.7", "1.15"), ("MC02", "1.15", "2.05")]
+    return intervals
+
+
+def test_fractional_depths_find_their_lab_rows(tmp_path):
+    spes, labsheet = write_run(str(tmp_path), fractional_intervals())
+    counts = PbTools.spe_to_counts(spes, labsheet, str(tmp_path / "counts.csv"), strict=True)
+    assert len(counts) == len(fractional_intervals())
+    assert counts[LAB_COLUMNS].notna().all().all()
+    assert "Z_upper (cm)" not in counts
+
+
+def test_fractional_depths_kept_by_incremental_runs(tmp_path):
+    intervals = fractional_intervals()
+    spes, labsheet = write_run(str(tmp_path), intervals)
+    fout = str(tmp_path / "counts.csv")
+    files = sorted(PbTools.glob.glob(spes))
+    PbTools.spe_to_counts(files[:50], labsheet, fout, incremental=True)
+    counts = PbTools.spe_to_counts(files, labsheet, fout, incremental=True, strict=True)
+    assert len(counts) == len(intervals)
+    assert counts[LAB_COLUMNS].notna().all().all()
+
+
+def test_unmatched_rows_still_reported(tmp_path):
+    spes, labsheet = write_run(str(tmp_path), [("MC01", "0.1", "0.3"), ("MC01", "0.3", "0.5")])
+    lab = PbTools.pd.read_csv(labsheet)
+    lab.loc[1, "Z_lower (cm)"] = 0.6
+    lab.to_csv(labsheet, index=False)
+    with pytest.raises(ValueError, match="1 spectra without a lab row: MC01 0.3-0.5 cm"):
+        PbTools.spe_to_counts(spes, labsheet, str(tmp_path / "counts.csv"), strict=True)
+
+
+@pytest.mark.parametrize("ext", ["csv", "parquet", "feather"])
+def test_leading_zero_coreids_stay_text(tmp_path, ext):
+    intervals = [("0101", "0", "1"), ("0101", "1", "2"), ("0102", "0", "1")]
+    spes, labsheet = write_run(str(tmp_path), intervals)
+    fout = str(tmp_path / f"counts.{ext}")
+    files = sorted(PbTools.glob.glob(spes))
+    PbTools.spe_to_counts(files[:1], labsheet, fout, incremental=True)
+    counts = PbTools.spe_to_counts(files, labsheet, fout, incremental=True, strict=True)
+    assert counts[LAB_COLUMNS].notna().all().all()
+    assert PbTools.read_table(fout)["CoreID"].tolist() == ["0101", "0101", "0102"]
+
+    metadata = tmp_path / "metadata.csv"
+    metadata.write_text("CoreID,t_collection,supLvl\n0101,10/15/2021,1.0\n0102,10/15/2021,1.5\n")
+    bkg = tmp_path / "bkg.csv"
+    bkg.write_text("Detector Name,counts Po209,counts Po210,counting time (sec)\nEnsembleInput1,5,8,259200\n")
+    act = PbTools.counts_to_activity_batch(fout, str(bkg), str(metadata))
+    assert act["C_i excess at collection, salt+mud correction (dpm/g)"].notna().all()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import PbTools
+
+
+# zero sample counts make the activities infinite; only the draws matter
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_shared_draws_span_row_chunks(dataset, monkeypatch):
+    act = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0)
+    # no sample counts: the 209Po net counts are then the background draws alone
+    act["209Po_decays (counts)"] = 0
+    seen = []
+    chain = PbTools.correction_chain
+
+    def spy(*args, **kwargs):
+        seen.append((np.array(args[5]), np.array(np.broadcast_to(args[11], args[5].shape))))
+        return chain(*args, **kwargs)
+
+    monkeypatch.setattr(PbTools, "correction_chain", spy)
+    n_draws = 50
+    # one row per chunk
+    PbTools.activity_monte_carlo(act, 1.0, n_draws=n_draws, seed=0, max_bytes=30 * 8 * n_draws)
+    assert len(seen) == len(act)
+    net209 = np.concatenate([s[0] for s in seen])
+    c_spike = np.concatenate([s[1] for s in seen])
+    # one spike calibration draw for every row
+    assert (c_spike == c_spike[0]).all()
+    # one background draw per detector, shared by its rows (equal counting times)
+    t_count = act["Δt_in_counting (min)"].to_numpy()
+    for det in act["detID"].unique():
+        rows = np.flatnonzero((act["detID"] == det).to_numpy() & (t_count == t_count[0]))
+        assert len(rows) > 1
+        assert (net209[rows] == net209[rows[0]]).all()
+
+
+def spy_chain(monkeypatch):
+    # the (rows, draws) inputs of every correction_chain call, by argument
+    seen = []
+    chain = PbTools.correction_chain
+
+    def spy(*args, **kwargs):
+        seen.append([np.array(np.broadcast_to(a, args[5].shape)) for a in args[:13]])
+        return chain(*args, **kwargs)
+
+    monkeypatch.setattr(PbTools, "correction_chain", spy)
+    return lambda k: np.concatenate([s[k] for s in seen])
+
+
+def test_time_intervals_share_the_counting_start(dataset, monkeypatch):
+    act = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0).iloc[:2]
+    inputs = spy_chain(monkeypatch)
+    PbTools.activity_monte_carlo(act, 1.0, n_draws=20000, seed=0, u_time_min=1.0)
+    # drawn minus recorded Δt_Plate2Count, Δt_Collect2Count, Δt_SpikeCal2Count
+    plate, collect, spike = (inputs(k) - act[c].to_numpy()[:, None] for k, c in ((7, "Δt_Plate2Count (min)"), (8, "Δt_Collect2Count (min)"), (9, "Δt_SpikeCal2Count (min)")))
+    # each Δt is the difference of two timestamps with 1 min errors
+    for d in (plate, collect, spike):
+        assert np.var(d) == pytest.approx(2, rel=0.05)
+    # sharing the counting start, but no other timestamp
+    assert np.mean(plate * collect) == pytest.approx(1, abs=0.05)
+    assert np.mean(collect * spike) == pytest.approx(1, abs=0.05)
+    # one core collected once and one spike calibrated once for both rows
+    np.testing.assert_allclose((collect - spike)[0], (collect - spike)[1], atol=1e-6)
+    assert not np.allclose(plate[0], plate[1])
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_one_spike_draw_per_spike(dataset, monkeypatch):
+    act = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0)
+    spikes = np.where(np.arange(len(act)) % 3 == 0, "S1", "S2")
+    meta = dict(PbTools.CORE_METADATA, SpikeID=pd.Series(spikes))
+    inputs = spy_chain(monkeypatch)
+    PbTools.activity_monte_carlo(act, 1.0, meta, n_draws=50, seed=0, max_bytes=30 * 8 * 50 * 7)
+    c_spike = inputs(11)
+    first = {s: c_spike[np.flatnonzero(spikes == s)[0]] for s in ("S1", "S2")}
+    for i, s in enumerate(spikes):
+        np.testing.assert_array_equal(c_spike[i], first[s])
+    assert not np.allclose(first["S1"], first["S2"])
+
+
+def test_spikes_without_ids_differ_by_calibration(dataset, monkeypatch):
+    act = PbTools.counts_to_activity(dataset["counts"], dataset["bkg"], 1.0)
+    C = np.where(np.arange(len(act)) < 30, 12.0, 15.0)
+    meta = dict(PbTools.CORE_METADATA, C_spike_atCal_dpmml=pd.Series(C))
+    inputs = spy_chain(monkeypatch)
+    PbTools.activity_monte_carlo(act, 1.0, meta, n_draws=50, seed=0)
+    # (C_spike - C) / u is the standard normal draw of each row's spike
+    z = (inputs(11) - C[:, None]) / PbTools.CORE_METADATA["u_C_spike_atCal_dpmml"]
+    assert np.allclose(z[:30], z[0]) and np.allclose(z[30:], z[30])
+    assert not np.allclose(z[0], z[30])
+
+
+def test_batch_metadata_carries_spike_ids():
+    metadata = pd.DataFrame({"CoreID": ["A", "B"], "SpikeID": ["S1", "S2"]})
+    spikes = pd.DataFrame({"SpikeID": ["S1", "S2"], "C_spike_atCal_dpmml": [12.0, 15.0]})
+    meta = PbTools._core_metadata(pd.Series(["A", "B", "A"]), metadata, spikes, 1.0)
+    assert meta["SpikeID"].tolist() == ["S1", "S2", "S1"]
+    assert meta["C_spike_atCal_dpmml"].tolist() == [12.0, 15.0, 12.0]
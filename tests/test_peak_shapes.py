@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import PbTools
+import synthetic
+
+# relative tolerance on the mean spill of 210Po counts into the 209Po window
+SPILL_RTOL = 0.03
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    rng = np.random.default_rng(0)
+    names = [f"DET# {k % 8 + 1}" for k in range(200)]
+    scale = 0.4 + 2.5 * rng.uniform(0, 1, len(names))
+    spectra = synthetic.spectra(rng, names, scale)
+    return names, scale, PbTools.fit_peak_shapes(spectra, names)
+
+
+def test_recovers_the_generator_shape(fitted):
+    _, _, table = fitted
+    assert table["converged"].all()
+    assert table["sigma"].median() == pytest.approx(synthetic.PEAK_SIGMA, rel=0.02)
+    assert table["tail"].median() == pytest.approx(synthetic.PEAK_TAIL, rel=0.05)
+    assert table["tau"].median() == pytest.approx(synthetic.PEAK_TAU, rel=0.05)
+
+
+def test_recovers_the_known_spill(fitted):
+    names, scale, table = fitted
+    windows = np.array([PbTools.DETECTORS[n][1] for n in names])
+    ch = np.arange(PbTools.N_CHANNELS)[None, :]
+    centre = (windows[:, 2:3] + windows[:, 3:4]) / 2
+    in209 = (ch >= windows[:, 0:1]) & (ch < windows[:, 1:2])
+    true = (120 * scale[:, None] * synthetic.peak_shape(ch - centre) * in209).sum(1)
+    fit = table["210Po_in_209Po_window (counts)"].to_numpy()
+    assert fit.mean() == pytest.approx(true.mean(), rel=SPILL_RTOL)
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import PbTools
+from SpeRoi import RoiSpectra
+
+REGIONS = [(100, 300), (600, 1000), (1500, 1510)]
+
+
+@pytest.fixture
+def spectra():
+    return np.random.default_rng(0).poisson(3.0, (50, PbTools.N_CHANNELS))
+
+
+@pytest.fixture
+def masked(spectra):
+    # the dense matrix with the channels outside REGIONS zeroed
+    out = np.zeros_like(spectra)
+    for lo, hi in REGIONS:
+        out[:, lo:hi] = spectra[:, lo:hi]
+    return out
+
+
+def test_dense_rows(spectra, masked):
+    roi = RoiSpectra.from_dense(spectra, REGIONS)
+    assert roi.shape == spectra.shape
+    assert roi.data.dtype == np.uint8
+    np.testing.assert_array_equal(roi.to_dense(), masked)
+    np.testing.assert_array_equal(np.asarray(roi), masked)
+    for i in (0, 17, 49):
+        assert roi[i].dtype == np.int64
+        np.testing.assert_array_equal(roi[i], masked[i])
+    rows = [3, 1, 40]
+    np.testing.assert_array_equal(roi[rows].to_dense(), masked[rows])
+    np.testing.assert_array_equal(roi[10:20].to_dense(), masked[10:20])
+    both = RoiSpectra.concatenate([roi[:20], roi[20:]])
+    np.testing.assert_array_equal(both.to_dense(), masked)
+
+
+@pytest.mark.parametrize("block", [8192, 7])
+def test_cumulative(spectra, masked, block):
+    roi = RoiSpectra.from_dense(spectra, REGIONS)
+    rng = np.random.default_rng(1)
+    # bounds anywhere in or at the edges of the regions, different per row
+    edges = np.concatenate([np.arange(lo, hi + 1) for lo, hi in REGIONS])
+    bounds = np.sort(rng.choice(edges, (len(spectra), 6)), axis=1)
+    cum = np.zeros((len(spectra), PbTools.N_CHANNELS + 1), dtype=np.int64)
+    np.cumsum(masked, axis=1, out=cum[:, 1:])
+    np.testing.assert_array_equal(roi.cumulative(bounds, block=block), np.take_along_axis(cum, bounds, axis=1))
+    # the same bounds for every row
+    np.testing.assert_array_equal(roi.cumulative([100, 300, 600, 1510], block=block), cum[:, [100, 300, 600, 1510]])
+
+
+def test_covers():
+    roi = RoiSpectra(np.zeros((1, 610), dtype=np.uint8), REGIONS)
+    assert roi.covers(100, 300) and roi.covers(650, 700) and roi.covers(1500, 1510)
+    assert not roi.covers(50, 150) and not roi.covers(250, 650) and not roi.covers(1000, 1001)
+
+
+def test_integrate_matches_dense(spectra):
+    names = np.random.default_rng(2).choice(sorted(PbTools.DETECTORS), len(spectra))
+    roi = RoiSpectra.from_dense(spectra)
+    for dense, compact in zip(PbTools.integrate_windows(spectra, names), PbTools.integrate_windows(roi, names)):
+        np.testing.assert_array_equal(dense, compact)
+    with pytest.raises(ValueError, match="reach outside the kept regions"):
+        PbTools.integrate_windows(RoiSpectra.from_dense(spectra, REGIONS), names)
+
+
+def test_save_load(spectra, tmp_path):
+    roi = RoiSpectra.from_dense(spectra, REGIONS)
+    roi.save(str(tmp_path / "roi.npz"))
+    back = RoiSpectra.load(str(tmp_path / "roi.npz"))
+    assert back.regions == roi.regions
+    np.testing.assert_array_equal(back.data, roi.data)
+
+
+def test_spe_to_counts_roi(dataset, tmp_path):
+    dense = PbTools.read_table(dataset["counts"])
+    fout = str(tmp_path / "roi.csv")
+    PbTools.spe_to_counts(dataset["spe_glob"], dataset["labsheet"], fout, roi=True)
+    pd.testing.assert_frame_equal(PbTools.read_table(fout), dense)
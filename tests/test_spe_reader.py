@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import PbTools
+from SpeReader import SpeFormatError, read_spe
+
+HEAD = "$SPEC_ID:\nNo sample description was entered.\n$SPEC_REM:\nDET# 3\nDETDESC# EnsembleInput3\n$DATE_MEA:\n11/01/2021 08:00:00\n$MEAS_TIM:\n86400 86412\n"
+COUNTS = [0, 7, 12345, 3]
+# the counts as Maestro writes them: right-aligned in 8-wide fields
+DATA = "$DATA:\n0 3\n" + "".join(f"{c:8d}\n" for c in COUNTS)
+TAIL = "$ROI:\n0\n"
+
+
+def spe(tmp_path, text, newline="\n"):
+    path = tmp_path / "x.Spe"
+    path.write_bytes(text.replace("\n", newline).encode("latin-1"))
+    return str(path)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_reads_fixed_width_counts(tmp_path, mmap, newline):
+    counts, header = read_spe(spe(tmp_path, HEAD + DATA + TAIL, newline), mmap=mmap)
+    assert counts.dtype == np.int64
+    assert counts.tolist() == COUNTS
+    assert header == {"det": "DET# 3", "date": "11/01/2021 08:00:00", "live_time": 86400, "real_time": 86412}
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_reads_free_layout_counts(tmp_path, newline):
+    text = HEAD + "$DATA:\n0 3\n0 7\n  12345\t3\n"
+    counts, _ = read_spe(spe(tmp_path, text, newline))
+    assert counts.tolist() == COUNTS
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        (HEAD, "no \\$DATA: section"),
+        (HEAD + "$DATA:", "truncated \\$DATA: section"),
+        (HEAD + "$DATA:\n0 3", "truncated \\$DATA: section"),
+        (HEAD + "$DATA:\n0\n" + DATA[12:], "bad \\$DATA: channel range"),
+        (HEAD + "$DATA:\n0 4\n" + DATA[12:], "declares 5 channels but holds 4"),
+        (HEAD + "$DATA:\n0 2\n" + DATA[12:], "declares 3 channels but holds 4"),
+        (HEAD + "$DATA:\n0 3\n1\n2\nx\n4\n", "non-integer value"),
+        (HEAD.replace("$DATE_MEA:\n11/01/2021 08:00:00\n", "") + DATA, "missing or empty \\$DATE_MEA:"),
+        (HEAD.replace("86400 86412\n", "") + DATA, "missing or empty \\$MEAS_TIM:"),
+        (HEAD.replace("$MEAS_TIM:\n86400 86412\n", "") + DATA, "missing or empty \\$MEAS_TIM:"),
+        (HEAD.replace("DET# 3\n", "") + DATA, "no 'DET#' line"),
+        (HEAD.replace("11/01/2021 08:00:00", "2021-11-01 08:00") + DATA, "is not MM/DD/YYYY hh:mm:ss"),
+        (HEAD.replace("86400 86412", "86400") + DATA, "is not 'live real'"),
+    ],
+)
+def test_malformed_files_raise(tmp_path, text, message):
+    path = spe(tmp_path, text)
+    with pytest.raises(SpeFormatError, match=message):
+        read_spe(path)
+
+
+def test_channel_count_must_match_the_detectors(tmp_path):
+    # a well-formed file with fewer channels than N_CHANNELS
+    path = spe(tmp_path, HEAD + DATA)
+    with pytest.raises(SpeFormatError, match=f"expected {PbTools.N_CHANNELS} channels, found 4"):
+        PbTools.read_spes([path])
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import PbTools
+
+# every combination of these edge shifts, in channels
+GRID = {"lower": (-10, 0), "boundary": (0, 15), "upper": (0, 20)}
+
+
+@pytest.fixture
+def swept(dataset, tmp_path):
+    counts = str(tmp_path / "counts.parquet")
+    PbTools.spe_to_counts(dataset["spe_glob"], dataset["labsheet"], counts, spectra_column=True)
+    names = set(PbTools._detector_names(PbTools.read_table(counts)["detID"]))
+    candidates = {n: PbTools.window_grid(PbTools.DETECTORS[n][1], **GRID) for n in sorted(names)}
+    return counts, candidates
+
+
+def test_sweep_windows_matches_integrate(swept):
+    counts, candidates = swept
+    table = PbTools.read_table(counts)
+    spectra = PbTools.stack_spectra(table)
+    names = PbTools._detector_names(table["detID"])
+    sums = PbTools.sweep_windows(spectra, names, candidates)
+    k = len(next(iter(candidates.values())))
+    assert len(sums) == len(table) * k
+    for j in range(k):
+        detectors = {n: (PbTools.DETECTORS[n][0], list(candidates[n][j])) for n in candidates}
+        _, po209, po210 = PbTools.integrate_windows(spectra, names, detectors)
+        part = sums[sums["candidate"] == j].sort_values("row")
+        np.testing.assert_array_equal(part["209Po_decays (counts)"], po209)
+        np.testing.assert_array_equal(part["210Po_decays (counts)"], po210)
+
+
+def test_sweep_activity_matches_counts_to_activity(dataset, swept, tmp_path, monkeypatch):
+    counts, candidates = swept
+    act = PbTools.sweep_activity(counts, dataset["bkg"], 1.0, candidates)
+    for j in range(len(next(iter(candidates.values())))):
+        # the whole pipeline run once with candidate j as the registered windows
+        for name, grid in candidates.items():
+            monkeypatch.setitem(PbTools.DETECTORS, name, (PbTools.DETECTORS[name][0], [int(w) for w in grid[j]]))
+        fout = str(tmp_path / f"counts_{j}.csv")
+        PbTools.spe_to_counts(dataset["spe_glob"], dataset["labsheet"], fout)
+        expected = PbTools.counts_to_activity(fout, dataset["bkg"], 1.0)
+        part = act[act["candidate"] == j].sort_values("row").reset_index(drop=True)
+        assert part["windows"].map(tuple).tolist() == [tuple(candidates[n][j]) for n in PbTools._detector_names(expected["detID"])]
+        columns = [c for c in expected.columns if c not in ("t_platingstart", "t_countingstart")]
+        pd.testing.assert_frame_equal(part[columns], expected[columns], check_exact=False, rtol=1e-12)
@@ -0,0 +1,20 @@
+import os
+
+import PbWatch
+from conftest import write_run
+
+
+def test_update_cores_with_leading_zero_coreid(tmp_path):
+    spes, labsheet = write_run(str(tmp_path), [("0101", "0", "1"), ("0101", "1", "2")])
+    spe_dir = os.path.dirname(spes)
+    bkg = tmp_path / "bkg.csv"
+    bkg.write_text("Detector Name,counts Po209,counts Po210,counting time (sec)\nEnsembleInput1,5,8,259200\n")
+    metadata = tmp_path / "metadata.csv"
+    metadata.write_text("CoreID,t_collection,supLvl\n0101,10/15/2021,1.25\n")
+    files = [os.path.join(spe_dir, f) for f in os.listdir(spe_dir)]
+    results = PbWatch.update_cores(files, spe_dir, labsheet, str(bkg), str(tmp_path / "out"), 9.0, metadata=str(metadata))
+    act = results["0101"]
+    assert act["M_pan (g)"].notna().all()
+    # supLvl from the metadata row, not the 9.0 default
+    excess = act["C_i at collection, salt correction (dpm/g)"] - act["C_i excess at collection, salt correction (dpm/g)"]
+    assert (excess.round(9) == 1.25).all()